@@ -1,25 +1,47 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
+import re
 import logging
 import secrets
+import hashlib
+import hmac
+import random
 import io
+import struct
+import tempfile
+import wave
+import zlib
+import lzma
 import zipfile
 import json
+import functools
 from pathlib import Path
+from urllib.parse import quote
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
 import base64
 import asyncio
+import time
 import httpx
+from PIL import Image, ImageOps
+from fpdf import FPDF
+from fontTools.ttLib import TTFont
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 ROOT_DIR = Path(__file__).parent
@@ -27,7 +49,8 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware so BSON datetimes (TTL-indexed expiry fields) come back as UTC-aware
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -35,6 +58,109 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'family-court-app-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Password hashing (bcrypt runs on a dedicated pool, off the event loop)
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', '32'))
+
+# Authenticated-user cache (per process; invalidated explicitly on writes)
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+
+# Decoded-JWT cache; entries never outlive the token's exp claim
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', '20000'))
+TOKEN_CACHE_TTL_SECONDS = float(os.environ.get('TOKEN_CACHE_TTL_SECONDS', '60'))
+
+# Expired share links stay listed on the Sharing page this long before the TTL index purges them
+SHARE_TOKEN_RETENTION_DAYS = int(os.environ.get('SHARE_TOKEN_RETENTION_DAYS', '30'))
+
+# Rate limiting for auth endpoints ("memory" per worker, or "mongo" shared)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Number of reverse proxies in front of the app that append to X-Forwarded-For
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+
+# Bearer token for internal endpoints (metrics); they are disabled when unset
+INTERNAL_API_TOKEN = os.environ.get('INTERNAL_API_TOKEN', '')
+
+# Outbound HTTP (OAuth session lookups and transactional email)
+OUTBOUND_HTTP_TIMEOUT_SECONDS = float(os.environ.get('OUTBOUND_HTTP_TIMEOUT_SECONDS', '10'))
+OUTBOUND_HTTP_MAX_CONNECTIONS = int(os.environ.get('OUTBOUND_HTTP_MAX_CONNECTIONS', '50'))
+OUTBOUND_HTTP_PER_HOST_LIMIT = int(os.environ.get('OUTBOUND_HTTP_PER_HOST_LIMIT', '10'))
+OUTBOUND_HTTP_RETRIES = int(os.environ.get('OUTBOUND_HTTP_RETRIES', '2'))
+EMERGENT_AUTH_SESSION_URL = os.environ.get(
+    'EMERGENT_AUTH_SESSION_URL',
+    'https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data'
+)
+RESEND_API_URL = os.environ.get('RESEND_API_URL', 'https://api.resend.com').rstrip('/')
+
+# Blob storage for uploaded files ("gridfs", "local" or "s3")
+BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 'gridfs')
+BLOB_STORE_LOCAL_PATH = Path(os.environ.get('BLOB_STORE_LOCAL_PATH', str(ROOT_DIR / 'blobs')))
+BLOB_CHUNK_SIZE = int(os.environ.get('BLOB_CHUNK_SIZE', str(1024 * 1024)))
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # e.g. a local MinIO
+S3_REGION = os.environ.get('S3_REGION') or None
+# Lifetime of signed media URLs (lets <video>/<audio>/<img> load without a bearer header).
+# Expiry is rounded up to the granularity so URLs stay stable (and cacheable) in between.
+SIGNED_URL_TTL_SECONDS = int(os.environ.get('SIGNED_URL_TTL_SECONDS', '3600'))
+SIGNED_URL_GRANULARITY_SECONDS = int(os.environ.get('SIGNED_URL_GRANULARITY_SECONDS', '3600'))
+
+# Image derivatives (WebP thumbnails/previews) rendered in a process pool
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', str(max(1, min(2, os.cpu_count() or 1)))))
+IMAGE_VARIANTS = {"thumb": 256, "preview": 1024}  # Longest edge in pixels
+AVATAR_VARIANTS = {"avatar_sm": 96, "avatar_md": 320}  # Square crops
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', '80'))
+# Concurrent metadata extraction jobs per process (the parsing itself runs in the media pool)
+METADATA_WORKERS = int(os.environ.get('METADATA_WORKERS', '2'))
+METADATA_LEASE_SECONDS = 300
+# Idle metadata workers recheck for pending documents this often
+METADATA_POLL_SECONDS = 60
+# Avatar URLs are embedded in /auth/me and list responses, so they rotate daily rather than hourly
+AVATAR_URL_TTL_SECONDS = int(os.environ.get('AVATAR_URL_TTL_SECONDS', str(7 * 86400)))
+AVATAR_URL_GRANULARITY_SECONDS = int(os.environ.get('AVATAR_URL_GRANULARITY_SECONDS', '86400'))
+
+# Uploads are parsed as they stream in; file parts beyond this size spill to a temp file
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', str(1024 * 1024)))
+UPLOAD_MAX_FIELD_SIZE = 64 * 1024
+# Resumable uploads: fixed chunk size, idle sessions expire and are swept with their chunks
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(5 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', str(24 * 3600)))
+UPLOAD_SWEEP_INTERVAL_SECONDS = int(os.environ.get('UPLOAD_SWEEP_INTERVAL_SECONDS', '900'))
+# Streamed exports hand archive bytes to the client whenever this much has accumulated
+EXPORT_FLUSH_SIZE = 256 * 1024
+# Record exports are read from Mongo and written to the client this many rows at a time
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_MAX_BATCH_SIZE = 5000
+# Rows per conversion call when tabular exports are rendered in the media pool
+TABLE_EXPORT_BATCH_SIZE = 2000
+# Exhibit packets are rendered in the media pool and cached by a hash of their inputs
+EXHIBIT_MAX_RECORDS = 500
+EXHIBIT_THUMBNAIL_PX = 480  # Longest edge of embedded JPEGs
+EXHIBIT_THUMBNAIL_POINTS = 160  # Drawn size, three to a row
+EXHIBIT_CACHE_TTL_SECONDS = int(os.environ.get('EXHIBIT_CACHE_TTL_SECONDS', str(7 * 86400)))
+EXHIBIT_RENDER_VERSION = 2  # Bump when the layout changes so cached packets are re-rendered
+# TrueType fonts embedded in packets; fallbacks (e.g. Noto CJK / emoji) cover scripts the main font lacks
+EXHIBIT_FONT_PATH = os.environ.get('EXHIBIT_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+EXHIBIT_BOLD_FONT_PATH = os.environ.get('EXHIBIT_BOLD_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf')
+EXHIBIT_FALLBACK_FONT_PATHS = [path for path in os.environ.get('EXHIBIT_FALLBACK_FONT_PATHS', '').split(',') if path]
+# Public shared views read each section concurrently, each within its own time budget
+SHARED_VIEW_TIMEOUT_SECONDS = float(os.environ.get('SHARED_VIEW_TIMEOUT_SECONDS', '5'))
+SHARED_VIEW_LIMIT = 500
+# Background exports: a bounded pool of jobs, leased while they run; artifacts expire after the TTL
+EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', '2'))
+EXPORT_JOB_LEASE_SECONDS = 120
+# Migrations run in the background under a lease renewed while they run, so a worker
+# killed part-way through is taken over once its lease lapses
+MIGRATION_LEASE_SECONDS = 120
+EXPORT_JOB_MAX_ATTEMPTS = 3
+EXPORT_PROGRESS_INTERVAL_SECONDS = 2
+EXPORT_ARTIFACT_TTL_SECONDS = int(os.environ.get('EXPORT_ARTIFACT_TTL_SECONDS', str(24 * 3600)))
+EXPORT_SWEEP_INTERVAL_SECONDS = int(os.environ.get('EXPORT_SWEEP_INTERVAL_SECONDS', '60'))
+# Delta exports: tombstones are kept this long, so older watermarks need a full export.
+# Changes this close to the previous watermark are exported again to cover in-flight writes.
+DELETION_RETENTION_DAYS = int(os.environ.get('DELETION_RETENTION_DAYS', '180'))
+DELTA_EXPORT_OVERLAP_SECONDS = 60
+
 # AI Configuration
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
 
@@ -46,6 +172,7 @@ api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Configure logging
 logging.basicConfig(
@@ -72,7 +199,8 @@ class UserResponse(BaseModel):
     email: str
     full_name: str
     state: str
-    photo: Optional[str] = ""
+    photo: Optional[str] = ""  # Signed avatar path, or an external picture URL
+    photo_small: Optional[str] = ""
     created_at: str
 
 class TokenResponse(BaseModel):
@@ -96,6 +224,7 @@ class ChildResponse(BaseModel):
     notes: str
     color: str
     photo: str
+    photo_small: str = ""
     created_at: str
 
 # Contact Models
@@ -120,6 +249,7 @@ class ContactResponse(BaseModel):
     email: str
     notes: str
     photo: str
+    photo_small: str = ""
     created_at: str
     updated_at: str
 
@@ -131,7 +261,14 @@ class JournalCreate(BaseModel):
     children_involved: List[str] = []
     mood: Optional[str] = "neutral"
     location: Optional[str] = ""
-    photos: List[str] = []  # Base64 encoded photos
+    photos: List[str] = []  # New photos as data URLs; existing ones as their /media/... paths
+
+class JournalPhoto(BaseModel):
+    media_id: str
+    width: int
+    height: int
+    thumbnail_url: str  # Signed, API-relative
+    preview_url: str
 
 class JournalResponse(BaseModel):
     journal_id: str
@@ -142,7 +279,8 @@ class JournalResponse(BaseModel):
     children_involved: List[str]
     mood: str
     location: str
-    photos: List[str]
+    photos: List[str]  # Signed preview paths, same order as photo_media
+    photo_media: List[JournalPhoto] = []
     created_at: str
     updated_at: str
 
@@ -178,6 +316,60 @@ class DocumentResponse(BaseModel):
     category: str
     description: str
     created_at: str
+    thumbnail_url: Optional[str] = None  # Signed, API-relative; images only
+    preview_url: Optional[str] = None
+    # Filled in after upload: width/height/captured_at, duration_seconds or page_count
+    metadata: Optional[dict] = None
+    metadata_status: Optional[str] = None
+
+class DocumentPage(BaseModel):
+    items: List[DocumentResponse]
+    total: int
+    page: int
+    page_size: int
+    total_pages: int
+    facets: Dict[str, int]  # Documents per category, under every filter except category
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: str
+    size: int
+    category: str
+    description: Optional[str] = ""
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    filename: str
+    content_type: str
+    size: int
+    chunk_size: int
+    total_chunks: int
+    received_chunks: List[int]
+    status: str  # open, or assembling once complete has been called
+    expires_at: str
+
+class ExportJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, done or failed
+    records: int
+    bytes: int
+    size: Optional[int] = None
+    created_at: str
+    finished_at: Optional[str] = None
+    expires_at: Optional[str] = None
+    download_url: Optional[str] = None
+    error: Optional[str] = None
+    since: Optional[str] = None  # Set for delta exports
+    watermark: Optional[str] = None  # Pass as since to the next delta export
+
+class ExhibitPacketRequest(BaseModel):
+    title: str = "Exhibit Packet"
+    journal_ids: List[str] = []
+    violation_ids: List[str] = []
+    event_ids: List[str] = []
+    bates_prefix: str = "CK"
+    bates_start: int = 1
+    include_photos: bool = True
 
 # Calendar Event Models
 class CalendarEventCreate(BaseModel):
@@ -261,14 +453,1693 @@ class AIWritingAssistRequest(BaseModel):
 class GoogleAuthSession(BaseModel):
     session_id: str
 
+# ============== CACHING ==============
+
+_MISSING = object()
+
+class TTLCache:
+    """Bounded LRU cache with per-entry expiry and single-flight loading.
+
+    Concurrent misses for the same key share one loader call; an
+    ``invalidate`` issued while a load is in flight prevents that (possibly
+    stale) result from being stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, ttl_for: Optional[Callable[[Any], float]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._ttl_for = ttl_for
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key, calling loader at most once per miss."""
+        value = self.get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_load(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish_load(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is not task:
+            return  # Invalidated while loading
+        del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        value = task.result()
+        if value is not None:
+            self.set(key, value, self._ttl_for(value) if self._ttl_for else None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "max_entries": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# User documents keyed by user_id, shared by every authenticated request
+user_cache = TTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+def invalidate_user_cache(user_id: str) -> None:
+    """Drop a cached user document after any write to it."""
+    user_cache.invalidate(user_id)
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+# Decoded JWT claims keyed by token digest; capped at each token's own exp
+token_cache = TTLCache(
+    TOKEN_CACHE_MAX_ENTRIES,
+    TOKEN_CACHE_TTL_SECONDS,
+    ttl_for=lambda payload: payload["exp"] - time.time()
+)
+
+class TokenRevocations:
+    """Revoked token digests, each kept only until the token would have expired.
+
+    Revocations are written to Mongo so every worker sees them; a worker that
+    still has the token cached picks it up within TOKEN_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self._revoked: Dict[str, float] = {}
+
+    def is_revoked(self, digest: str) -> bool:
+        exp = self._revoked.get(digest)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            del self._revoked[digest]
+            return False
+        return True
+
+    def add(self, digest: str, exp: float) -> None:
+        self._revoked[digest] = exp
+        token_cache.invalidate(digest)
+        if len(self._revoked) > TOKEN_CACHE_MAX_ENTRIES:
+            now = time.time()
+            for key in [k for k, v in self._revoked.items() if v <= now]:
+                del self._revoked[key]
+
+token_revocations = TokenRevocations()
+
+async def revoke_token(token: str, exp: float) -> None:
+    """Reject a still-valid bearer token from now on (logout, password change)"""
+    digest = token_digest(token)
+    token_revocations.add(digest, exp)
+    await db.revoked_tokens.update_one(
+        {"token_digest": digest},
+        {"$set": {
+            "token_digest": digest,
+            "expires_at": datetime.fromtimestamp(exp, timezone.utc)
+        }},
+        upsert=True
+    )
+
+async def _decode_token(token: str, digest: str) -> dict:
+    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    if await db.revoked_tokens.find_one({"token_digest": digest}, {"_id": 1}):
+        token_revocations.add(digest, payload["exp"])
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
+
+async def decode_token(token: str) -> dict:
+    """Verify a bearer token, reusing the decoded claims while it stays valid"""
+    digest = token_digest(token)
+    if token_revocations.is_revoked(digest):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return await token_cache.get_or_load(digest, lambda: _decode_token(token, digest))
+
+# ============== RATE LIMITING ==============
+
+# "limit/window_seconds" per scope, applied per client IP and per email. Each can be
+# overridden from the environment, e.g. RATE_LIMIT_LOGIN_EMAIL=50/300 for a test run.
+RATE_LIMIT_DEFAULTS = {
+    "login": {"ip": "30/60", "email": "10/300"},
+    "register": {"ip": "10/600", "email": "3/600"},
+    "2fa_send": {"ip": "10/600", "email": "5/600"},
+    "2fa_verify": {"ip": "30/600", "email": "10/600"},
+}
+
+def rate_limit_setting(scope: str, kind: str) -> tuple:
+    value = os.environ.get(f"RATE_LIMIT_{scope.upper()}_{kind.upper()}", RATE_LIMIT_DEFAULTS[scope][kind])
+    limit, window = value.split("/")
+    return int(limit), int(window)
+
+RATE_LIMITS = {
+    scope: {kind: rate_limit_setting(scope, kind) for kind in kinds}
+    for scope, kinds in RATE_LIMIT_DEFAULTS.items()
+}
+
+class MemoryRateLimitStore:
+    """Per-worker counters: one [window, current, previous] triple per key"""
+
+    MAX_KEYS = 100000
+
+    def __init__(self):
+        self._counters: Dict[str, list] = {}
+
+    async def incr(self, key: str, window_index: int, window: int) -> tuple:
+        counter = self._counters.get(key)
+        if counter is None or counter[0] < window_index - 1:
+            counter = [window_index, 0, 0]
+        elif counter[0] == window_index - 1:
+            counter = [window_index, 0, counter[1]]
+        counter[1] += 1
+        self._counters[key] = counter
+        if len(self._counters) > self.MAX_KEYS:
+            self._prune(window_index)
+        return counter[1], counter[2]
+
+    def _prune(self, window_index: int) -> None:
+        for key in [k for k, c in self._counters.items() if c[0] < window_index - 1]:
+            del self._counters[key]
+
+    async def reset(self, key: str, window_index: int) -> None:
+        self._counters.pop(key, None)
+
+class MongoRateLimitStore:
+    """Counters shared by all workers; stale windows are removed by a TTL index"""
+
+    async def incr(self, key: str, window_index: int, window: int) -> tuple:
+        current = await db.rate_limits.find_one_and_update(
+            {"_id": f"{key}:{window_index}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=2 * window)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await db.rate_limits.find_one({"_id": f"{key}:{window_index - 1}"})
+        return current["count"], previous["count"] if previous else 0
+
+    async def reset(self, key: str, window_index: int) -> None:
+        await db.rate_limits.delete_many({"_id": {"$in": [f"{key}:{window_index}", f"{key}:{window_index - 1}"]}})
+
+class SlidingWindowRateLimiter:
+    """Sliding-window counter: the previous fixed window is weighted by its overlap"""
+
+    def __init__(self, store):
+        self.store = store
+        self.allowed = 0
+        self.rejected = 0
+
+    async def hit(self, key: str, limit: int, window: int) -> Optional[int]:
+        """Count one attempt; return seconds to wait if over the limit, else None"""
+        now = time.time()
+        window_index = int(now // window)
+        elapsed = now - window_index * window
+        current, previous = await self.store.incr(key, window_index, window)
+        weight = 1 - elapsed / window
+        estimate = previous * weight + current
+        if estimate <= limit:
+            self.allowed += 1
+            return None
+        self.rejected += 1
+        if current > limit or previous == 0:
+            return max(1, int(window - elapsed) + 1)
+        # Time until the previous window's share decays enough
+        return max(1, int((estimate - limit) * window / previous) + 1)
+
+    async def reset(self, key: str, window: int) -> None:
+        """Forget the attempts counted for key (both windows the estimate reads)"""
+        await self.store.reset(key, int(time.time() // window))
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.store).__name__,
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+rate_limiter = SlidingWindowRateLimiter(
+    MongoRateLimitStore() if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimitStore()
+)
+
+def client_ip(request: Request) -> str:
+    """Client address as seen by the outermost trusted proxy"""
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and TRUSTED_PROXY_HOPS > 0:
+        hops = [h.strip() for h in forwarded.split(",") if h.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(request: Request, scope: str, email: Optional[str] = None) -> None:
+    """Reject with 429 before any database or bcrypt work is done"""
+    limits = RATE_LIMITS[scope]
+    checks = [(f"{scope}:ip:{client_ip(request)}", limits["ip"])]
+    if email:
+        checks.append((f"{scope}:email:{email.strip().lower()}", limits["email"]))
+    
+    retry_after = 0
+    for key, (limit, window) in checks:
+        wait = await rate_limiter.hit(key, limit, window)
+        if wait:
+            retry_after = max(retry_after, wait)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts. Please try again later.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+async def clear_email_rate_limit(scope: str, email: str) -> None:
+    """Called once an attempt succeeds, so only failed attempts count toward the
+    per-email budget; the per-IP budget is left alone."""
+    await rate_limiter.reset(f"{scope}:email:{email.strip().lower()}", RATE_LIMITS[scope]["email"][1])
+
+# ============== OUTBOUND HTTP ==============
+
+class OutboundHTTP:
+    """Application-scoped pooled client for calls to third-party services.
+
+    Connections are kept alive across requests, each host gets its own
+    concurrency cap, and transient failures are retried with full-jitter
+    exponential backoff. Base URLs come from the environment so the whole
+    path can be pointed at a local stub server.
+    """
+
+    RETRY_STATUSES = {429, 502, 503, 504}
+    BACKOFF_BASE_SECONDS = 0.25
+    BACKOFF_MAX_SECONDS = 4.0
+
+    def __init__(self, timeout: float, max_connections: int, per_host_limit: int, retries: int):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=30.0
+                )
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None and response.headers.get("retry-after", "").isdigit():
+            return min(float(response.headers["retry-after"]), self.BACKOFF_MAX_SECONDS)
+        ceiling = min(self.BACKOFF_MAX_SECONDS, self.BACKOFF_BASE_SECONDS * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def request(self, method: str, url: str, retries: Optional[int] = None, **kwargs) -> httpx.Response:
+        """Send a request, retrying connection errors, timeouts and 429/5xx gateway responses"""
+        await self.start()
+        retries = self.retries if retries is None else retries
+        limit = self._host_limit(url)
+        for attempt in range(retries + 1):
+            response = None
+            self.requests += 1
+            try:
+                async with limit:
+                    response = await self._client.request(method, url, **kwargs)
+                if response.status_code not in self.RETRY_STATUSES or attempt == retries:
+                    return response
+            except httpx.TransportError:
+                if attempt == retries:
+                    self.failures += 1
+                    raise
+            self.retried += 1
+            await asyncio.sleep(self._backoff(attempt, response))
+        raise RuntimeError("unreachable")
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+            "hosts": len(self._host_limits)
+        }
+
+outbound_http = OutboundHTTP(
+    OUTBOUND_HTTP_TIMEOUT_SECONDS,
+    OUTBOUND_HTTP_MAX_CONNECTIONS,
+    OUTBOUND_HTTP_PER_HOST_LIMIT,
+    OUTBOUND_HTTP_RETRIES
+)
+
+async def send_resend_email(params: dict) -> dict:
+    """Send one email through the Resend REST API"""
+    response = await outbound_http.request(
+        "POST",
+        f"{RESEND_API_URL}/emails",
+        json=params,
+        headers={
+            "Authorization": f"Bearer {os.environ['RESEND_API_KEY']}",
+            # Makes retries safe: Resend drops duplicates with the same key
+            "Idempotency-Key": str(uuid.uuid4())
+        }
+    )
+    response.raise_for_status()
+    return response.json()
+
+# ============== BLOB STORAGE ==============
+
+class BlobNotFound(Exception):
+    pass
+
+async def iter_bytes(data: bytes, chunk_size: int = BLOB_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
+
+async def read_blob(store: "BlobStore", key: str) -> bytes:
+    """Read a whole blob into memory; only for payloads known to be small"""
+    return b"".join([chunk async for chunk in store.open(key)])
+
+class BlobStore:
+    """Out-of-band file storage; Mongo documents keep only the blob key.
+
+    Keys are '/'-separated paths chosen by the caller. Writes and reads are
+    streamed in chunks so memory per transfer stays bounded.
+    """
+
+    name = ""
+
+    async def put(self, key: str, chunks: AsyncIterator[bytes], content_type: str = "application/octet-stream") -> int:
+        """Store (or overwrite) a blob from an async chunk iterator; returns its size"""
+        raise NotImplementedError
+
+    def open(self, key: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Stream length bytes (or the rest of the blob) starting at offset start"""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+class GridFSBlobStore(BlobStore):
+    """Blobs in a GridFS bucket of the application database, keyed by file _id"""
+
+    name = "gridfs"
+
+    def __init__(self, database, bucket_name: str = "blobs"):
+        self._bucket = AsyncIOMotorGridFSBucket(
+            database, bucket_name=bucket_name, chunk_size_bytes=BLOB_CHUNK_SIZE
+        )
+        self._files = database[f"{bucket_name}.files"]
+
+    async def put(self, key, chunks, content_type="application/octet-stream"):
+        await self.delete(key)
+        grid_in = self._bucket.open_upload_stream_with_id(
+            key, key, metadata={"content_type": content_type}
+        )
+        size = 0
+        try:
+            async for chunk in chunks:
+                await grid_in.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        return size
+
+    async def open(self, key, start=0, length=None):
+        try:
+            grid_out = await self._bucket.open_download_stream(key)
+        except NoFile:
+            raise BlobNotFound(key)
+        grid_out.seek(start)
+        remaining = grid_out.length - start if length is None else length
+        while remaining > 0:
+            chunk = await grid_out.read(min(BLOB_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    async def delete(self, key):
+        try:
+            await self._bucket.delete(key)
+        except NoFile:
+            pass
+
+    async def exists(self, key):
+        return await self._files.find_one({"_id": key}, {"_id": 1}) is not None
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under a local directory; writes land atomically via rename"""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    async def put(self, key, chunks, content_type="application/octet-stream"):
+        path = self._path(key)
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        handle = await asyncio.to_thread(open, tmp_path, "wb")
+        size = 0
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(handle.write, chunk)
+                size += len(chunk)
+            await asyncio.to_thread(handle.close)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            handle.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return size
+
+    async def open(self, key, start=0, length=None):
+        path = self._path(key)
+        try:
+            handle = await asyncio.to_thread(open, path, "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        try:
+            await asyncio.to_thread(handle.seek, start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = BLOB_CHUNK_SIZE if remaining is None else min(BLOB_CHUNK_SIZE, remaining)
+                chunk = await asyncio.to_thread(handle.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            handle.close()
+
+    async def delete(self, key):
+        await asyncio.to_thread(self._path(key).unlink, missing_ok=True)
+
+    async def exists(self, key):
+        return await asyncio.to_thread(self._path(key).exists)
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3-compatible bucket (AWS, or MinIO via S3_ENDPOINT_URL)"""
+
+    name = "s3"
+    # S3 requires every multipart part except the last to be at least 5 MiB
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        import boto3  # Optional dependency, only needed for this backend
+        from botocore.exceptions import ClientError
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self._client_error = ClientError
+        self.bucket = bucket
+
+    async def put(self, key, chunks, content_type="application/octet-stream"):
+        buffer = bytearray()
+        parts = []
+        upload_id = None
+        size = 0
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                size += len(chunk)
+                if len(buffer) >= self.PART_SIZE:
+                    if upload_id is None:
+                        upload = await asyncio.to_thread(
+                            self._client.create_multipart_upload,
+                            Bucket=self.bucket, Key=key, ContentType=content_type
+                        )
+                        upload_id = upload["UploadId"]
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                    buffer.clear()
+            if upload_id is None:
+                await asyncio.to_thread(
+                    self._client.put_object,
+                    Bucket=self.bucket, Key=key, Body=bytes(buffer), ContentType=content_type
+                )
+                return size
+            if buffer:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            await asyncio.to_thread(
+                self._client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            if upload_id is not None:
+                await asyncio.to_thread(
+                    self._client.abort_multipart_upload,
+                    Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+            raise
+        return size
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> dict:
+        result = await asyncio.to_thread(
+            self._client.upload_part,
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+        )
+        return {"ETag": result["ETag"], "PartNumber": number}
+
+    async def open(self, key, start=0, length=None):
+        if length == 0:
+            return
+        byte_range = f"bytes={start}-" if length is None else f"bytes={start}-{start + length - 1}"
+        try:
+            obj = await asyncio.to_thread(
+                self._client.get_object, Bucket=self.bucket, Key=key, Range=byte_range
+            )
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                raise BlobNotFound(key)
+            raise
+        body = obj["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, BLOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key):
+        await asyncio.to_thread(self._client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def exists(self, key):
+        try:
+            await asyncio.to_thread(self._client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except self._client_error:
+            return False
+
+_blob_stores: Dict[str, BlobStore] = {}
+
+def get_blob_store(name: str = BLOB_STORE_BACKEND) -> BlobStore:
+    """Backend by name; records remember which backend holds their blob"""
+    if name not in _blob_stores:
+        if name == "gridfs":
+            _blob_stores[name] = GridFSBlobStore(db)
+        elif name == "local":
+            _blob_stores[name] = LocalBlobStore(BLOB_STORE_LOCAL_PATH)
+        elif name == "s3":
+            _blob_stores[name] = S3BlobStore(S3_BUCKET, S3_ENDPOINT_URL, S3_REGION)
+        else:
+            raise ValueError(f"Unknown blob store backend: {name}")
+    return _blob_stores[name]
+
+blob_store = get_blob_store()
+
+# ============== CONTENT-ADDRESSED BLOBS ==============
+
+# Compression at rest, chosen by content type. Formats that are already compressed
+# (JPEG/PNG/WebP, MP4/WebM, MP3/AAC, and DOCX, which is a ZIP) are stored as-is.
+# WAV is stored as-is too: a compressed stream can only be read from the start, and
+# audio players seek with Range requests, so each seek would inflate the whole prefix.
+COMPRESSION_CODECS = {
+    "application/msword": "lzma",
+    "application/pdf": "zlib",
+}
+# Keep the compressed copy only if it saves at least this fraction
+COMPRESSION_MIN_SAVING = 0.05
+CODEC_SUFFIXES = {"zlib": ".zz", "lzma": ".xz"}
+
+def content_blob_key(content_hash: str, codec: Optional[str] = None, generation: str = "") -> str:
+    # The codec is part of the key so differently-encoded copies never overwrite each other,
+    # and the generation so a copy stored after the last release never reuses a key that
+    # the releasing request is about to delete
+    suffix = f".{generation}" if generation else ""
+    return f"sha256/{content_hash[:2]}/{content_hash}{suffix}{CODEC_SUFFIXES.get(codec, '')}"
+
+def _compressor(codec: str):
+    return zlib.compressobj(6) if codec == "zlib" else lzma.LZMACompressor(preset=6)
+
+def _decompressor(codec: str):
+    return zlib.decompressobj() if codec == "zlib" else lzma.LZMADecompressor()
+
+async def compress_stream(chunks: AsyncIterator[bytes], codec: str) -> AsyncIterator[bytes]:
+    compressor = _compressor(codec)
+    async for chunk in chunks:
+        compressed = await asyncio.to_thread(compressor.compress, chunk)
+        if compressed:
+            yield compressed
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+async def decompress_stream(
+    chunks: AsyncIterator[bytes],
+    codec: str,
+    start: int = 0,
+    length: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """Decompress as it streams, yielding only bytes [start, start + length) of the original.
+
+    Output is produced at most BLOB_CHUNK_SIZE bytes at a time, so a highly
+    compressible stored chunk never inflates into memory all at once.
+    """
+    decompressor = _decompressor(codec)
+    end = None if length is None else start + length
+    position = 0
+    
+    def step(data: bytes) -> tuple:
+        """One bounded step: (output, input to feed next, whether more output is pending)"""
+        output = decompressor.decompress(data, BLOB_CHUNK_SIZE)
+        if codec == "zlib":
+            tail = decompressor.unconsumed_tail
+            return output, tail, bool(tail) or len(output) == BLOB_CHUNK_SIZE
+        return output, b"", bool(output) and not (decompressor.needs_input or decompressor.eof)
+    
+    async for chunk in chunks:
+        pending = True
+        while pending:
+            data, chunk, pending = await asyncio.to_thread(step, chunk)
+            piece_start, position = position, position + len(data)
+            if position <= start:
+                continue
+            low = max(start - piece_start, 0)
+            high = len(data) if end is None else min(end - piece_start, len(data))
+            if high > low:
+                yield data[low:high]
+            if end is not None and position >= end:
+                return
+
+def compression_ratio(blob: dict) -> float:
+    """Stored size over original size (blobs written before compression have no stored_size)"""
+    return round(blob.get("stored_size", blob["size"]) / blob["size"], 3) if blob["size"] else 1.0
+
+def blob_reference(blob: dict) -> dict:
+    """Fields a document or media record keeps to read its content blob"""
+    reference = {"blob_store": blob["blob_store"], "blob_key": blob["blob_key"]}
+    if blob.get("codec"):
+        reference["blob_codec"] = blob["codec"]
+    return reference
+
+def open_stored_blob(holder: dict, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Original bytes behind a blob reference, decompressed on the fly if stored compressed"""
+    store = get_blob_store(holder["blob_store"])
+    codec = holder.get("blob_codec")
+    if not codec:
+        return store.open(holder["blob_key"], start, length)
+    return decompress_stream(store.open(holder["blob_key"]), codec, start, length)
+
+async def read_stored_blob(holder: dict) -> bytes:
+    return b"".join([chunk async for chunk in open_stored_blob(holder)])
+
+async def _put_content_blob(
+    content_hash: str,
+    size: int,
+    codec: Optional[str],
+    chunks: Callable[[], AsyncIterator[bytes]],
+    content_type: str,
+    generation: str
+) -> dict:
+    """Write the bytes (compressed if codec is set and worth it); returns the storage fields"""
+    store = blob_store
+    key = content_blob_key(content_hash, codec, generation)
+    storage = {"blob_store": store.name, "blob_key": key, "codec": codec, "stored_size": size}
+    storage["stored_size"] = await store.put(
+        key, compress_stream(chunks(), codec) if codec else chunks(), content_type
+    )
+    if codec and storage["stored_size"] > size * (1 - COMPRESSION_MIN_SAVING):
+        # Did not compress; keep the plain copy instead
+        await store.delete(key)
+        return await _put_content_blob(content_hash, size, None, chunks, content_type, generation)
+    return storage
+
+async def acquire_content_blob(
+    content_hash: str,
+    size: int,
+    content_type: str,
+    chunks: Callable[[], AsyncIterator[bytes]]
+) -> dict:
+    """Take a reference on the blob for content_hash, storing the bytes only if new.
+
+    chunks is a factory so the content can be re-read if it has to be written.
+    Returns the db.blobs record (blob_store, blob_key, codec, size, stored_size, refcount).
+    """
+    codec = COMPRESSION_CODECS.get(content_type)
+    stored = None
+    while True:
+        # A record exists only once its bytes do, so a live one can be shared as-is
+        record = await db.blobs.find_one_and_update(
+            {"_id": content_hash, "refcount": {"$gt": 0}},
+            {"$inc": {"refcount": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if record:
+            if stored:
+                # A concurrent upload of identical bytes recorded its copy first
+                await get_blob_store(stored["blob_store"]).delete(stored["blob_key"])
+            return record
+        if stored is None:
+            # Every stored copy gets its own generation key, so a release that deletes
+            # the previous copy's bytes can never remove the bytes written here
+            stored = await _put_content_blob(
+                content_hash, size, codec, chunks, content_type, uuid.uuid4().hex[:12]
+            )
+        record = {
+            "_id": content_hash,
+            **stored,
+            "size": size,
+            "content_type": content_type,
+            "refcount": 1,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        try:
+            await db.blobs.insert_one(record)
+            return record
+        except DuplicateKeyError:
+            pass
+        # Either a live record appeared (shared on the next pass) or the last holder
+        # released one that is not collected yet; finish that collection and retry
+        dead = await db.blobs.find_one_and_delete({"_id": content_hash, "refcount": {"$lte": 0}})
+        if dead:
+            await get_blob_store(dead["blob_store"]).delete(dead["blob_key"])
+            await delete_image_variants(content_hash)
+
+async def release_content_blob(content_hash: str) -> None:
+    """Drop one reference; the blob is garbage-collected with the last one.
+
+    The bytes deleted are the ones named by the record this call removed. An
+    acquire racing with it writes its own copy under a new generation key and only
+    then records it, so that copy is never touched here.
+    """
+    record = await db.blobs.find_one_and_update(
+        {"_id": content_hash},
+        {"$inc": {"refcount": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if record and record["refcount"] <= 0:
+        result = await db.blobs.delete_one({"_id": content_hash, "refcount": {"$lte": 0}})
+        if result.deleted_count:
+            await get_blob_store(record["blob_store"]).delete(record["blob_key"])
+            await delete_image_variants(content_hash)
+
+async def release_document_file(document: dict) -> None:
+    """Free the storage behind a deleted document record"""
+    if document.get("content_hash"):
+        await release_content_blob(document["content_hash"])
+    elif document.get("blob_key"):
+        await get_blob_store(document["blob_store"]).delete(document["blob_key"])
+        await delete_image_variants(document["document_id"])
+
+async def read_document_bytes(document: dict) -> bytes:
+    """Whole file for a document record, including not-yet-migrated base64 rows"""
+    if document.get("blob_key"):
+        return await read_stored_blob(document)
+    return base64.b64decode(document.get("file_data", ""))
+
+# ============== IMAGE VARIANTS ==============
+
+_media_pool: Optional[ProcessPoolExecutor] = None
+
+def get_media_pool() -> ProcessPoolExecutor:
+    """CPU-bound media work (image decoding/encoding) runs in worker processes"""
+    global _media_pool
+    if _media_pool is None:
+        _media_pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return _media_pool
+
+async def run_in_media_pool(fn: Callable, *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(get_media_pool(), fn, *args)
+
+_background_tasks: set = set()
+
+def spawn_background(coro: Awaitable, description: str) -> None:
+    """Fire-and-forget with a strong reference and failure logging"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    def done(t: asyncio.Future):
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning(f"Background task failed ({description}): {t.exception()}")
+    task.add_done_callback(done)
+
+def render_image_variant(data: bytes, max_dimension: int, quality: int, square: bool = False) -> bytes:
+    """Downscale to fit max_dimension (or center-crop to a square) and re-encode as WebP.
+
+    Runs in the media pool.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if square:
+            image = ImageOps.fit(image, (max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        else:
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        output = io.BytesIO()
+        image.save(output, "WEBP", quality=quality, method=4)
+        return output.getvalue()
+
+def variant_spec(variant: str) -> Optional[tuple]:
+    """(size in pixels, square crop) for a variant name, or None if unknown"""
+    if variant in IMAGE_VARIANTS:
+        return IMAGE_VARIANTS[variant], False
+    if variant in AVATAR_VARIANTS:
+        return AVATAR_VARIANTS[variant], True
+    return None
+
+def image_variant_key(source_id: str, variant: str) -> str:
+    return f"variants/{source_id}/{variant}.webp"
+
+_variant_inflight: Dict[str, asyncio.Future] = {}
+
+async def ensure_image_variant(source_id: str, variant: str, read_source: Callable[[], Awaitable[bytes]]) -> dict:
+    """Cached WebP derivative of an image, rendered once per (source, variant).
+
+    source_id is the content hash (or another stable id) of the original, so
+    deduplicated uploads share their variants.
+    """
+    key = image_variant_key(source_id, variant)
+    record = await db.media_variants.find_one({"_id": key})
+    if record:
+        return record
+    if key not in _variant_inflight:
+        async def render():
+            try:
+                size, square = variant_spec(variant)
+                rendered = await run_in_media_pool(
+                    render_image_variant, await read_source(), size, IMAGE_VARIANT_QUALITY, square
+                )
+                await blob_store.put(key, iter_bytes(rendered), "image/webp")
+                variant_record = {
+                    "_id": key,
+                    "source_id": source_id,
+                    "variant": variant,
+                    "blob_store": blob_store.name,
+                    "size": len(rendered),
+                    "created_at": datetime.now(timezone.utc).isoformat()
+                }
+                await db.media_variants.replace_one({"_id": key}, variant_record, upsert=True)
+                return variant_record
+            finally:
+                _variant_inflight.pop(key, None)
+        _variant_inflight[key] = asyncio.ensure_future(render())
+    return await asyncio.shield(_variant_inflight[key])
+
+def generate_image_variants(
+    source_id: str,
+    read_source: Callable[[], Awaitable[bytes]],
+    variants: Dict[str, int] = IMAGE_VARIANTS
+) -> None:
+    """Pre-render every variant in the background right after an upload"""
+    async def generate():
+        for variant in variants:
+            await ensure_image_variant(source_id, variant, read_source)
+    spawn_background(generate(), f"image variants for {source_id}")
+
+async def delete_image_variants(source_id: str) -> None:
+    async for record in db.media_variants.find({"source_id": source_id}):
+        await get_blob_store(record["blob_store"]).delete(record["_id"])
+        await db.media_variants.delete_one({"_id": record["_id"]})
+
+async def image_variant_response(request: Request, record: dict) -> Response:
+    """Variants are immutable for a given source, so they can be cached for a year"""
+    store = get_blob_store(record["blob_store"])
+    return await file_stream_response(
+        request,
+        lambda start, length: store.open(record["_id"], start, length),
+        size=record["size"],
+        etag=f'"{record["source_id"]}-{record["variant"]}"',
+        content_type="image/webp",
+        cache_control="private, max-age=31536000, immutable"
+    )
+
+# ============== MEDIA OBJECTS ==============
+
+MEDIA_MAX_SIZE = 10 * 1024 * 1024
+MEDIA_PATH_PATTERN = re.compile(r"/media/([0-9a-f-]{36})/")
+
+def displayed_size(image: Image.Image) -> tuple:
+    width, height = image.size
+    # EXIF orientations 5-8 are rotated a quarter turn when displayed
+    if image.getexif().get(0x0112) in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height
+
+def probe_image(data: bytes) -> tuple:
+    """(content type, width, height) as displayed; raises if the bytes are not an image"""
+    with Image.open(io.BytesIO(data)) as image:
+        return (Image.MIME.get(image.format, "application/octet-stream"), *displayed_size(image))
+
+def decode_data_url(value: str) -> bytes:
+    """Bytes of a data: URL, or of the bare base64 older clients sent"""
+    payload = value.split(",", 1)[1] if value.startswith("data:") else value
+    return base64.b64decode(payload)
+
+async def store_media(
+    user_id: str,
+    owner_type: str,
+    owner_id: str,
+    data: bytes,
+    variants: Dict[str, int] = IMAGE_VARIANTS
+) -> dict:
+    """Save an image as a db.media object and return the {media_id, width, height} reference
+    the owning record keeps in place of the bytes"""
+    if len(data) > MEDIA_MAX_SIZE:
+        raise HTTPException(status_code=400, detail="Photo too large (max 10MB)")
+    try:
+        content_type, width, height = await asyncio.to_thread(probe_image, data)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Photo is not a supported image")
+    
+    content_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+    blob = await acquire_content_blob(content_hash, len(data), content_type, lambda: iter_bytes(data))
+    media = {
+        "media_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "owner_type": owner_type,
+        "owner_id": owner_id,
+        "content_hash": content_hash,
+        **blob_reference(blob),
+        "content_type": content_type,
+        "size": len(data),
+        "width": width,
+        "height": height,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.media.insert_one(media)
+    generate_image_variants(content_hash, lambda: read_media_bytes(media), variants)
+    return {"media_id": media["media_id"], "width": width, "height": height}
+
+async def read_media_bytes(media: dict) -> bytes:
+    return await read_stored_blob(media)
+
+async def release_media(media_ids: List[str]) -> None:
+    """Delete media objects and drop their blob references"""
+    for media_id in media_ids:
+        media = await db.media.find_one_and_delete({"media_id": media_id}, {"_id": 0, "content_hash": 1})
+        if media:
+            await release_content_blob(media["content_hash"])
+
+def media_urls(media_id: str) -> dict:
+    base = f"/media/{media_id}/variants"
+    return {"thumbnail_url": sign_path(f"{base}/thumb"), "preview_url": sign_path(f"{base}/preview")}
+
+# ============== AVATARS ==============
+
+def avatar_fields(owner: dict) -> dict:
+    """photo/photo_small response fields for a user, child or contact record"""
+    media_id = owner.get("photo_media_id")
+    if not media_id:
+        # External pictures (Google profile photos) are passed through as-is
+        photo = owner.get("photo") or ""
+        return {"photo": photo, "photo_small": photo}
+    base = f"/media/{media_id}/variants"
+    return {
+        "photo": sign_path(f"{base}/avatar_md", AVATAR_URL_TTL_SECONDS, AVATAR_URL_GRANULARITY_SECONDS),
+        "photo_small": sign_path(f"{base}/avatar_sm", AVATAR_URL_TTL_SECONDS, AVATAR_URL_GRANULARITY_SECONDS)
+    }
+
+async def resolve_avatar(
+    user_id: str,
+    owner_type: str,
+    owner_id: str,
+    submitted: Optional[str],
+    current: dict,
+    variants: Dict[str, int] = AVATAR_VARIANTS
+) -> tuple:
+    """Fields to $set for a submitted photo value, and the media id it replaces.
+
+    The avatar's own path leaves it unchanged, a data URL is stored as new
+    media, an http(s) URL is kept as a link and anything else clears it.
+    """
+    current_id = current.get("photo_media_id")
+    submitted = submitted or ""
+    if submitted.startswith("data:"):
+        try:
+            data = decode_data_url(submitted)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Photo is not a valid data URL")
+        ref = await store_media(user_id, owner_type, owner_id, data, variants)
+        return {"photo_media_id": ref["media_id"], "photo": ""}, current_id
+    if MEDIA_PATH_PATTERN.search(submitted):
+        return {"photo_media_id": current_id, "photo": current.get("photo") or ""}, None
+    if submitted.startswith(("http://", "https://")):
+        return {"photo_media_id": None, "photo": submitted}, current_id
+    return {"photo_media_id": None, "photo": ""}, current_id
+
+# ============== MEDIA METADATA ==============
+
+ISO_MEDIA_TYPES = {"video/mp4", "video/quicktime", "video/3gpp", "audio/mp4", "audio/x-m4a"}
+MP3_TYPES = {"audio/mpeg", "audio/mp3"}
+WAV_TYPES = {"audio/wav", "audio/x-wav", "audio/wave"}
+MP3_BITRATES = {
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],  # MPEG-1
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],  # MPEG-2
+}
+MP3_BITRATES[0] = MP3_BITRATES[2]  # MPEG-2.5
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+PDF_OBJECT = re.compile(rb"(\d+)\s+\d+\s+obj\b")
+PDF_PAGE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+PDF_STREAM = re.compile(rb"stream\r?\n(.*?)endstream", re.S)
+
+def _image_metadata(path: str) -> dict:
+    with Image.open(path) as image:
+        width, height = displayed_size(image)
+        exif = image.getexif()
+        metadata = {"width": width, "height": height}
+        # DateTimeOriginal from the Exif IFD, else the file's DateTime
+        captured = exif.get_ifd(0x8769).get(0x9003) or exif.get(0x0132)
+        if captured:
+            try:
+                metadata["captured_at"] = datetime.strptime(str(captured).strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+            except ValueError:
+                pass
+        return metadata
+
+def _iso_boxes(handle, end: int):
+    """(type, body offset, end offset) of each box between the current position and end"""
+    while handle.tell() + 8 <= end:
+        start = handle.tell()
+        size, kind = struct.unpack(">I4s", handle.read(8))
+        if size == 1:
+            size = struct.unpack(">Q", handle.read(8))[0]
+        elif size == 0:
+            size = end - start
+        if size < 8:
+            return
+        yield kind, handle.tell(), start + size
+        handle.seek(start + size)
+
+def _iso_media_duration(path: str) -> Optional[float]:
+    """Duration from moov/mvhd of an ISO base media file (MP4, MOV, M4A, 3GP)"""
+    with open(path, "rb") as handle:
+        file_end = handle.seek(0, os.SEEK_END)
+        handle.seek(0)
+        for kind, _, moov_end in _iso_boxes(handle, file_end):
+            if kind != b"moov":
+                continue
+            for child, body, _ in _iso_boxes(handle, moov_end):
+                if child != b"mvhd":
+                    continue
+                handle.seek(body)
+                version = handle.read(4)[0]
+                if version == 1:
+                    handle.seek(16, os.SEEK_CUR)
+                    timescale, duration = struct.unpack(">IQ", handle.read(12))
+                else:
+                    handle.seek(8, os.SEEK_CUR)
+                    timescale, duration = struct.unpack(">II", handle.read(8))
+                return duration / timescale if timescale else None
+    return None
+
+def _mp3_duration(path: str) -> Optional[float]:
+    """Exact from a Xing/Info frame count when present, otherwise estimated as CBR"""
+    with open(path, "rb") as handle:
+        file_size = handle.seek(0, os.SEEK_END)
+        handle.seek(0)
+        header = handle.read(10)
+        offset = 0
+        if header[:3] == b"ID3" and len(header) == 10:
+            offset = 10 + ((header[6] & 0x7F) << 21 | (header[7] & 0x7F) << 14 | (header[8] & 0x7F) << 7 | (header[9] & 0x7F))
+        handle.seek(offset)
+        data = handle.read(64 * 1024)
+    for i in range(len(data) - 4):
+        if data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+            continue
+        version = (data[i + 1] >> 3) & 3
+        layer = (data[i + 1] >> 1) & 3
+        bitrate_index = data[i + 2] >> 4
+        rate_index = (data[i + 2] >> 2) & 3
+        # Layer III only; skip reserved values (false syncs inside tag data)
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+        samples_per_frame = 1152 if version == 3 else 576
+        mono = data[i + 3] >> 6 == 3
+        side_info = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+        xing = i + 4 + side_info
+        if data[xing:xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12:
+            if struct.unpack(">I", data[xing + 4:xing + 8])[0] & 1:
+                frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+                return frames * samples_per_frame / sample_rate
+        return (file_size - offset - i) * 8 / (MP3_BITRATES[version][bitrate_index] * 1000)
+    return None
+
+def _wav_duration(path: str) -> Optional[float]:
+    with wave.open(path, "rb") as audio:
+        rate = audio.getframerate()
+        return audio.getnframes() / rate if rate else None
+
+def _pdf_page_count(path: str) -> Optional[int]:
+    """Count /Type /Page leaf objects, including those packed into compressed object streams"""
+    with open(path, "rb") as handle:
+        data = handle.read()
+    pages = set()
+    packed = 0
+    for match in PDF_OBJECT.finditer(data):
+        end = data.find(b"endobj", match.end())
+        body = data[match.end():end if end != -1 else len(data)]
+        if b"/ObjStm" in body:
+            stream = PDF_STREAM.search(body)
+            if stream:
+                try:
+                    packed += len(PDF_PAGE.findall(zlib.decompressobj().decompress(stream.group(1))))
+                except zlib.error:
+                    pass
+        elif PDF_PAGE.search(body.split(b"stream", 1)[0]):
+            # Incremental updates rewrite objects under the same number
+            pages.add(match.group(1))
+    return len(pages) + packed or None
+
+def extract_media_metadata(path: str, content_type: str) -> dict:
+    """Dimensions, capture time, duration or page count for a spooled file.
+
+    Runs in the media pool; anything that cannot be determined is left out.
+    """
+    if content_type.startswith("image/"):
+        return _image_metadata(path)
+    duration = None
+    if content_type in ISO_MEDIA_TYPES:
+        duration = _iso_media_duration(path)
+    elif content_type in MP3_TYPES:
+        duration = _mp3_duration(path)
+    elif content_type in WAV_TYPES:
+        duration = _wav_duration(path)
+    elif content_type == "application/pdf":
+        page_count = _pdf_page_count(path)
+        return {"page_count": page_count} if page_count else {}
+    return {"duration_seconds": round(duration, 3)} if duration else {}
+
+async def spool_to_tempfile(chunks: AsyncIterator[bytes]) -> str:
+    """Write a stream to a named temp file (for parsers that need to seek); caller unlinks it"""
+    handle = await asyncio.to_thread(tempfile.NamedTemporaryFile, delete=False)
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(handle.write, chunk)
+    except BaseException:
+        handle.close()
+        os.unlink(handle.name)
+        raise
+    await asyncio.to_thread(handle.close)
+    return handle.name
+
+class MetadataWorker:
+    """In-process workers that fill in document metadata after upload.
+
+    Jobs come straight from db.documents: each worker claims the newest
+    pending document under a lease, so several backend processes share the
+    backlog without loading it into memory, and documents left pending by a
+    process that died are picked up once their lease lapses.
+    """
+    
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.failed = 0
+    
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+    
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def notify(self) -> None:
+        """A document was just marked pending; wake idle workers"""
+        self._wake.set()
+    
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            document = await self._claim()
+            if document is None:
+                # Nothing pending: sleep until an upload arrives, rechecking now and
+                # then for leases that lapsed in other processes
+                try:
+                    await asyncio.wait_for(self._wake.wait(), METADATA_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(document)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Metadata extraction failed for {document['document_id']}: {str(e)}")
+                await db.documents.update_one(
+                    {"document_id": document["document_id"]},
+                    {"$set": {"metadata_status": "failed"}, "$unset": {"metadata_lease": ""}}
+                )
+    
+    async def _claim(self) -> Optional[dict]:
+        """Newest pending document not leased by another worker, now leased to this one"""
+        now = datetime.now(timezone.utc)
+        return await db.documents.find_one_and_update(
+            {
+                "metadata_status": "pending",
+                "$or": [{"metadata_lease": {"$exists": False}}, {"metadata_lease": {"$lt": now}}]
+            },
+            {"$set": {"metadata_lease": now + timedelta(seconds=METADATA_LEASE_SECONDS)}},
+            projection={"_id": 0},
+            sort=[("created_at", -1)]
+        )
+    
+    async def _process(self, document: dict) -> None:
+        path = await spool_to_tempfile(open_document_stream(document)(0, None))
+        try:
+            metadata = await run_in_media_pool(extract_media_metadata, path, document["file_type"])
+        finally:
+            await asyncio.to_thread(os.unlink, path)
+        await db.documents.update_one(
+            {"document_id": document["document_id"]},
+            {"$set": {"metadata": metadata, "metadata_status": "done"}, "$unset": {"metadata_lease": ""}}
+        )
+        self.processed += 1
+    
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed
+        }
+
+metadata_worker = MetadataWorker(METADATA_WORKERS)
+
+# ============== FILE RESPONSES ==============
+
+def content_disposition(disposition: str, filename: str) -> str:
+    fallback = filename.encode('ascii', 'replace').decode('ascii').replace('"', "'")
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """(start, length) for a single 'bytes=' range, or None to send the whole file"""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, _, last = range_header[6:].strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(0, size - suffix), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None  # Malformed ranges are ignored (RFC 9110)
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end - start + 1
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+async def _primed(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pull the first chunk up front so a missing blob fails before headers are sent"""
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    async def replay():
+        if first:
+            yield first
+        async for chunk in stream:
+            yield chunk
+    return replay()
+
+async def file_stream_response(
+    request: Request,
+    open_stream: Callable[[int, Optional[int]], AsyncIterator[bytes]],
+    size: int,
+    etag: str,
+    content_type: str,
+    filename: Optional[str] = None,
+    disposition: str = "inline",
+    cache_control: str = "private, max-age=3600"
+) -> Response:
+    """Stream a stored file with ETag/304 and single-range 206 support"""
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": cache_control}
+    if filename:
+        headers["Content-Disposition"] = content_disposition(disposition, filename)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        byte_range = parse_range_header(request.headers.get("range"), size)
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        body = await _primed(open_stream(0, None))
+        return StreamingResponse(body, status_code=200, media_type=content_type, headers=headers)
+    
+    start, length = byte_range
+    headers["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+    headers["Content-Length"] = str(length)
+    body = await _primed(open_stream(start, length))
+    return StreamingResponse(body, status_code=206, media_type=content_type, headers=headers)
+
+def open_document_stream(document: dict) -> Callable[[int, Optional[int]], AsyncIterator[bytes]]:
+    """Range-capable opener for a document's bytes (blob store or legacy base64)"""
+    def opener(start: int, length: Optional[int]) -> AsyncIterator[bytes]:
+        if document.get("blob_key"):
+            return open_stored_blob(document, start, length)
+        data = base64.b64decode(document.get("file_data", ""))
+        end = len(data) if length is None else start + length
+        return iter_bytes(data[start:end])
+    return opener
+
+def sign_path(
+    path: str,
+    ttl_seconds: int = SIGNED_URL_TTL_SECONDS,
+    granularity: int = SIGNED_URL_GRANULARITY_SECONDS
+) -> str:
+    """Append an expiring HMAC signature so the path works without a bearer token"""
+    expires = -(-(int(time.time()) + ttl_seconds) // granularity) * granularity
+    signature = hmac.new(JWT_SECRET.encode('utf-8'), f"{path}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{path}?expires={expires}&signature={signature}"
+
+def verify_signed_path(path: str, expires: int, signature: str) -> bool:
+    if expires < time.time():
+        return False
+    expected = hmac.new(JWT_SECRET.encode('utf-8'), f"{path}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+async def signed_or_owner_filter(
+    path: str,
+    expires: Optional[int],
+    signature: Optional[str],
+    credentials: Optional[HTTPAuthorizationCredentials]
+) -> dict:
+    """Query restriction for a file route: none for a valid signed path, else the caller's user_id"""
+    if expires is not None and signature:
+        if not verify_signed_path(path, expires, signature):
+            raise HTTPException(status_code=403, detail="Invalid or expired link")
+        return {}
+    if credentials:
+        current_user = await get_current_user(credentials)
+        return {"user_id": current_user["user_id"]}
+    raise HTTPException(status_code=401, detail="Not authenticated")
+
+# ============== STREAMED UPLOADS ==============
+
+class SpooledUpload:
+    """File part of a streamed multipart body: spooled to disk past a threshold, hashed as it arrives"""
+    
+    def __init__(self, filename: str, content_type: str, max_size: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.max_size = max_size
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD)
+    
+    @property
+    def content_hash(self) -> str:
+        return self._sha256.hexdigest()
+    
+    def _append(self, data: bytes) -> None:
+        self._file.write(data)
+        self._sha256.update(data)
+    
+    async def append(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise HTTPException(status_code=400, detail=f"File too large (max {self.max_size // (1024 * 1024)}MB)")
+        await asyncio.to_thread(self._append, data)
+    
+    def _read_at(self, offset: int) -> bytes:
+        self._file.seek(offset)
+        return self._file.read(BLOB_CHUNK_SIZE)
+    
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Re-read the spooled bytes from the start; usable as a blob chunks factory"""
+        offset = 0
+        while True:
+            chunk = await asyncio.to_thread(self._read_at, offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+    
+    def close(self) -> None:
+        self._file.close()
+
+async def receive_multipart(
+    request: Request,
+    accept_file: Callable[[str, str], int],
+    max_body_size: int
+) -> tuple:
+    """Parse a multipart/form-data body as it streams in.
+
+    accept_file(filename, content_type) is called once the file part's headers
+    arrive and returns the size limit for it (or raises to reject the type), so
+    bad uploads are refused before their bytes are read. Returns (fields, upload);
+    the caller owns the upload and must close() it.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+        raise HTTPException(status_code=400, detail=f"File too large (max {max_body_size // (1024 * 1024)}MB)")
+    
+    # Parser callbacks are synchronous; they queue events that are handled after each write
+    events = []
+    header_field, header_value = bytearray(), bytearray()
+    
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+    
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+    
+    def on_header_end():
+        events.append(("header", (bytes(header_field).lower(), bytes(header_value))))
+        header_field.clear()
+        header_value.clear()
+    
+    def on_part_data(data: bytes, start: int, end: int):
+        events.append(("data", bytes(data[start:end])))
+    
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin": lambda: events.append(("begin", None)),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers_finished", None)),
+        "on_part_data": on_part_data,
+        "on_part_end": lambda: events.append(("end", None))
+    })
+    
+    fields: Dict[str, str] = {}
+    upload: Optional[SpooledUpload] = None
+    part_headers: Dict[bytes, bytes] = {}
+    field_name: Optional[str] = None
+    field_value = bytearray()
+    receiving_file = False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, value in events:
+                if event == "begin":
+                    part_headers, field_name, receiving_file = {}, None, False
+                    field_value.clear()
+                elif event == "header":
+                    part_headers[value[0]] = value[1]
+                elif event == "headers_finished":
+                    _, disposition = parse_options_header(part_headers.get(b"content-disposition", b""))
+                    field_name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" in disposition:
+                        if upload is not None:
+                            raise HTTPException(status_code=400, detail="Only one file per upload")
+                        filename = disposition[b"filename"].decode("utf-8", "replace")
+                        file_type = part_headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+                        upload = SpooledUpload(filename, file_type, accept_file(filename, file_type))
+                        receiving_file = True
+                elif event == "data":
+                    if receiving_file:
+                        await upload.append(value)
+                    else:
+                        field_value.extend(value)
+                        if len(field_value) > UPLOAD_MAX_FIELD_SIZE:
+                            raise HTTPException(status_code=400, detail=f"Form field {field_name} too large")
+                elif event == "end" and not receiving_file and field_name:
+                    fields[field_name] = field_value.decode("utf-8", "replace")
+            events.clear()
+        parser.finalize()
+    except MultipartParseError:
+        if upload:
+            upload.close()
+        raise HTTPException(status_code=400, detail="Malformed multipart body")
+    except BaseException:
+        if upload:
+            upload.close()
+        raise
+    return fields, upload
+
 # ============== HELPER FUNCTIONS ==============
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def bcrypt_cost(hashed: str) -> Optional[int]:
+    """Extract the cost factor from a '$2b$12$...' style hash"""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated thread pool with bounded admission.
+
+    bcrypt releases the GIL, so threads give real parallelism without the
+    event loop stalling. Once every worker is busy and the queue is full,
+    new work is rejected with 503 instead of piling up behind the pool.
+    """
+
+    def __init__(self, workers: int, queue_size: int, rounds: int):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._workers = workers
+        self._capacity = workers + queue_size
+        self._pending = 0
+        self.rejected = 0
+
+    async def _run(self, fn: Callable, *args) -> Any:
+        if self._pending >= self._capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return bcrypt_cost(hashed) != self.rounds
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self._workers,
+            "capacity": self._capacity,
+            "pending": self._pending,
+            "rejected": self.rejected,
+            "bcrypt_rounds": self.rounds
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE, BCRYPT_ROUNDS)
+
+async def rehash_password_if_needed(user: dict, password: str) -> None:
+    """Upgrade a stored hash to the configured bcrypt cost after a successful login"""
+    old_hash = user["password_hash"]
+    if not password_hasher.needs_rehash(old_hash):
+        return
+    try:
+        new_hash = await password_hasher.hash(password)
+        # Compare-and-set so a concurrent password change is never overwritten
+        await db.users.update_one(
+            {"user_id": user["user_id"], "password_hash": old_hash},
+            {"$set": {"password_hash": new_hash}}
+        )
+        invalidate_user_cache(user["user_id"])
+    except Exception as e:
+        logger.warning(f"Password rehash skipped for {user['user_id']}: {str(e)}")
+
 def create_token(user_id: str, email: str) -> str:
     payload = {
         "user_id": user_id,
@@ -279,15 +2150,19 @@ def create_token(user_id: str, email: str) -> str:
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = await decode_token(credentials.credentials)
         user_id = payload.get("user_id")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        user = await user_cache.get_or_load(
+            user_id,
+            lambda: db.users.find_one({"user_id": user_id}, {"_id": 0})
+        )
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
+        # Handlers get their own copy so the cached document stays pristine
+        return dict(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -296,7 +2171,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 # ============== AUTH ROUTES ==============
 
 @api_router.post("/auth/register", response_model=TokenResponse)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, request: Request):
+    await enforce_rate_limit(request, "register", user_data.email)
+    
     # Check if user exists
     existing = await db.users.find_one({"email": user_data.email}, {"_id": 0})
     if existing:
@@ -308,7 +2185,7 @@ async def register(user_data: UserCreate):
     user_doc = {
         "user_id": user_id,
         "email": user_data.email,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await password_hasher.hash(user_data.password),
         "full_name": user_data.full_name,
         "state": user_data.state,
         "created_at": now
@@ -330,14 +2207,22 @@ async def register(user_data: UserCreate):
     )
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+async def login(credentials: UserLogin, request: Request):
+    await enforce_rate_limit(request, "login", credentials.email)
+    
+    # One indexed read: 2FA state lives on the user document (legacy rows are folded in on demand)
+    user = await db.users.find_one({"email": credentials.email}, {"_id": 0, "photo": 0})
+    # Google-only accounts have no password hash
+    if not user or not user.get("password_hash"):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if not await password_hasher.verify(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    await clear_email_rate_limit("login", credentials.email)
+    await rehash_password_if_needed(user, credentials.password)
+    
     # Check if 2FA is enabled
-    tfa_settings = await db.two_factor_settings.find_one({"user_id": user["user_id"]})
-    if tfa_settings and tfa_settings.get("enabled", False):
+    if (await user_two_factor(user)).get("enabled", False):
         # Return indicator that 2FA is required
         raise HTTPException(
             status_code=202, 
@@ -362,47 +2247,84 @@ async def login(credentials: UserLogin):
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(current_user: dict = Depends(get_current_user)):
-    photo = current_user.get("photo", "")
     return UserResponse(
         user_id=current_user["user_id"],
         email=current_user["email"],
         full_name=current_user["full_name"],
         state=current_user["state"],
-        photo=photo,
-        created_at=current_user["created_at"]
+        created_at=current_user["created_at"],
+        **avatar_fields(current_user)
     )
 
+@api_router.post("/auth/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: dict = Depends(get_current_user)
+):
+    payload = await decode_token(credentials.credentials)
+    await revoke_token(credentials.credentials, payload["exp"])
+    return {"message": "Logged out successfully"}
+
 @api_router.put("/auth/profile")
 async def update_profile(
     profile_data: dict,
     current_user: dict = Depends(get_current_user)
 ):
     update_data = {}
+    replaced_media_id = None
     if "full_name" in profile_data and profile_data["full_name"] is not None:
         update_data["full_name"] = profile_data["full_name"]
     if "photo" in profile_data and profile_data["photo"] is not None:
-        update_data["photo"] = profile_data["photo"]
+        avatar, replaced_media_id = await resolve_avatar(
+            current_user["user_id"], "user", current_user["user_id"], profile_data["photo"], current_user
+        )
+        update_data.update(avatar)
     
     if update_data:
         await db.users.update_one(
             {"user_id": current_user["user_id"]},
             {"$set": update_data}
         )
+        invalidate_user_cache(current_user["user_id"])
+    if replaced_media_id:
+        await release_media([replaced_media_id])
     
     # Get updated user
     updated_user = await db.users.find_one(
         {"user_id": current_user["user_id"]},
-        {"_id": 0}
+        {"_id": 0, "password_hash": 0, "two_factor": 0}
     )
+    updated_user.update(avatar_fields(updated_user))
+    updated_user.pop("photo_media_id", None)
     
     return {"message": "Profile updated successfully", "user": updated_user}
 
+# ============== CHANGE TRACKING ==============
+
+async def record_deletion(user_id: str, collection: str, record_id: str) -> None:
+    """Tombstone for delta exports; every exported record also carries updated_at"""
+    now = datetime.now(timezone.utc)
+    await db.deletions.insert_one({
+        "user_id": user_id,
+        "collection": collection,
+        "record_id": record_id,
+        "deleted_at": now.isoformat(),
+        "expires_at": now + timedelta(days=DELETION_RETENTION_DAYS)
+    })
+
 # ============== CHILDREN ROUTES ==============
 
+def child_response(child: dict) -> ChildResponse:
+    # Add default values if not present
+    if "color" not in child:
+        child["color"] = "#3B82F6"
+    return ChildResponse(**{**child, **avatar_fields(child)})
+
 @api_router.post("/children", response_model=ChildResponse)
 async def create_child(child_data: ChildCreate, current_user: dict = Depends(get_current_user)):
     child_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
+    avatar, _ = await resolve_avatar(current_user["user_id"], "child", child_id, child_data.photo, {})
     
     child_doc = {
         "child_id": child_id,
@@ -411,13 +2333,14 @@ async def create_child(child_data: ChildCreate, current_user: dict = Depends(get
         "date_of_birth": child_data.date_of_birth,
         "notes": child_data.notes or "",
         "color": child_data.color or "#3B82F6",
-        "photo": child_data.photo or "",
-        "created_at": now
+        **avatar,
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.children.insert_one(child_doc)
     
-    return ChildResponse(**child_doc)
+    return child_response(child_doc)
 
 @api_router.get("/children", response_model=List[ChildResponse])
 async def get_children(current_user: dict = Depends(get_current_user)):
@@ -425,13 +2348,7 @@ async def get_children(current_user: dict = Depends(get_current_user)):
         {"user_id": current_user["user_id"]}, 
         {"_id": 0}
     ).to_list(100)
-    # Add default values if not present
-    for child in children:
-        if "color" not in child:
-            child["color"] = "#3B82F6"
-        if "photo" not in child:
-            child["photo"] = ""
-    return [ChildResponse(**child) for child in children]
+    return [child_response(child) for child in children]
 
 @api_router.put("/children/{child_id}", response_model=ChildResponse)
 async def update_child(child_id: str, child_data: ChildCreate, current_user: dict = Depends(get_current_user)):
@@ -444,39 +2361,56 @@ async def update_child(child_id: str, child_data: ChildCreate, current_user: dic
     if not existing_child:
         raise HTTPException(status_code=404, detail="Child not found")
     
+    avatar, replaced_media_id = await resolve_avatar(
+        current_user["user_id"], "child", child_id, child_data.photo, existing_child
+    )
+    
     # Update fields
     update_data = {
         "name": child_data.name,
         "date_of_birth": child_data.date_of_birth,
         "notes": child_data.notes or "",
         "color": child_data.color or "#3B82F6",
-        "photo": child_data.photo or ""
+        **avatar,
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.children.update_one(
         {"child_id": child_id, "user_id": current_user["user_id"]},
         {"$set": update_data}
     )
+    if replaced_media_id:
+        await release_media([replaced_media_id])
     
     existing_child.update(update_data)
-    return ChildResponse(**existing_child)
+    return child_response(existing_child)
 
 @api_router.delete("/children/{child_id}")
 async def delete_child(child_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.children.delete_one({
-        "child_id": child_id, 
-        "user_id": current_user["user_id"]
-    })
-    if result.deleted_count == 0:
+    child = await db.children.find_one_and_delete(
+        {"child_id": child_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "photo_media_id": 1}
+    )
+    if child is None:
         raise HTTPException(status_code=404, detail="Child not found")
+    await record_deletion(current_user["user_id"], "children", child_id)
+    if child.get("photo_media_id"):
+        await release_media([child["photo_media_id"]])
     return {"message": "Child deleted successfully"}
 
 # ============== CONTACT ROUTES ==============
 
+def contact_response(contact: dict) -> ContactResponse:
+    # Add default values if not present
+    if "phones" not in contact:
+        contact["phones"] = []
+    return ContactResponse(**{**contact, **avatar_fields(contact)})
+
 @api_router.post("/contacts", response_model=ContactResponse)
 async def create_contact(contact_data: ContactCreate, current_user: dict = Depends(get_current_user)):
     contact_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
+    avatar, _ = await resolve_avatar(current_user["user_id"], "contact", contact_id, contact_data.photo, {})
     
     contact_doc = {
         "contact_id": contact_id,
@@ -486,14 +2420,14 @@ async def create_contact(contact_data: ContactCreate, current_user: dict = Depen
         "phones": [phone.dict() for phone in contact_data.phones],
         "email": contact_data.email or "",
         "notes": contact_data.notes or "",
-        "photo": contact_data.photo or "",
+        **avatar,
         "created_at": now,
         "updated_at": now
     }
     
     await db.contacts.insert_one(contact_doc)
     
-    return ContactResponse(**contact_doc)
+    return contact_response(contact_doc)
 
 @api_router.get("/contacts", response_model=List[ContactResponse])
 async def get_contacts(current_user: dict = Depends(get_current_user)):
@@ -501,13 +2435,7 @@ async def get_contacts(current_user: dict = Depends(get_current_user)):
         {"user_id": current_user["user_id"]}, 
         {"_id": 0}
     ).to_list(1000)
-    # Add default values if not present
-    for contact in contacts:
-        if "photo" not in contact:
-            contact["photo"] = ""
-        if "phones" not in contact:
-            contact["phones"] = []
-    return [ContactResponse(**contact) for contact in contacts]
+    return [contact_response(contact) for contact in contacts]
 
 @api_router.get("/contacts/{contact_id}", response_model=ContactResponse)
 async def get_contact(contact_id: str, current_user: dict = Depends(get_current_user)):
@@ -519,12 +2447,7 @@ async def get_contact(contact_id: str, current_user: dict = Depends(get_current_
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
     
-    if "photo" not in contact:
-        contact["photo"] = ""
-    if "phones" not in contact:
-        contact["phones"] = []
-    
-    return ContactResponse(**contact)
+    return contact_response(contact)
 
 @api_router.put("/contacts/{contact_id}", response_model=ContactResponse)
 async def update_contact(contact_id: str, contact_data: ContactCreate, current_user: dict = Depends(get_current_user)):
@@ -537,6 +2460,9 @@ async def update_contact(contact_id: str, contact_data: ContactCreate, current_u
         raise HTTPException(status_code=404, detail="Contact not found")
     
     now = datetime.now(timezone.utc).isoformat()
+    avatar, replaced_media_id = await resolve_avatar(
+        current_user["user_id"], "contact", contact_id, contact_data.photo, existing_contact
+    )
     
     update_data = {
         "name": contact_data.name,
@@ -544,7 +2470,7 @@ async def update_contact(contact_id: str, contact_data: ContactCreate, current_u
         "phones": [phone.dict() for phone in contact_data.phones],
         "email": contact_data.email or "",
         "notes": contact_data.notes or "",
-        "photo": contact_data.photo or "",
+        **avatar,
         "updated_at": now
     }
     
@@ -552,26 +2478,80 @@ async def update_contact(contact_id: str, contact_data: ContactCreate, current_u
         {"contact_id": contact_id, "user_id": current_user["user_id"]},
         {"$set": update_data}
     )
+    if replaced_media_id:
+        await release_media([replaced_media_id])
     
     existing_contact.update(update_data)
-    return ContactResponse(**existing_contact)
+    return contact_response(existing_contact)
 
 @api_router.delete("/contacts/{contact_id}")
 async def delete_contact(contact_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.contacts.delete_one({
-        "contact_id": contact_id, 
-        "user_id": current_user["user_id"]
-    })
-    if result.deleted_count == 0:
+    contact = await db.contacts.find_one_and_delete(
+        {"contact_id": contact_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "photo_media_id": 1}
+    )
+    if contact is None:
         raise HTTPException(status_code=404, detail="Contact not found")
+    await record_deletion(current_user["user_id"], "contacts", contact_id)
+    if contact.get("photo_media_id"):
+        await release_media([contact["photo_media_id"]])
     return {"message": "Contact deleted successfully"}
 
 # ============== JOURNAL ROUTES ==============
 
+def journal_response(journal: dict) -> JournalResponse:
+    """API shape of a journal record; photo references become signed variant paths"""
+    # Add default values for missing fields (backward compatibility)
+    if "content" not in journal:
+        journal["content"] = journal.get("entry", "")
+    if "location" not in journal:
+        journal["location"] = ""
+    if "updated_at" not in journal:
+        journal["updated_at"] = journal.get("created_at", "")
+    photo_media = [
+        JournalPhoto(**ref, **media_urls(ref["media_id"]))
+        for ref in journal.get("photo_media", [])
+    ]
+    return JournalResponse(**{
+        **journal,
+        "photos": [photo.preview_url for photo in photo_media],
+        "photo_media": photo_media
+    })
+
+async def resolve_journal_photos(user_id: str, journal_id: str, photos: List[str], current: List[dict]) -> tuple:
+    """Map a submitted photo list onto media references.
+
+    Paths of photos the journal already has are kept, anything else is
+    decoded and stored as new media. Returns (references, released media ids).
+    """
+    existing = {ref["media_id"]: ref for ref in current}
+    refs = []
+    try:
+        for photo in photos:
+            match = None if photo.startswith("data:") else MEDIA_PATH_PATTERN.search(photo)
+            if match:
+                ref = existing.get(match.group(1))
+                if ref and ref not in refs:
+                    refs.append(ref)
+                continue
+            try:
+                data = decode_data_url(photo)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Photo is not a valid data URL")
+            refs.append(await store_media(user_id, "journal", journal_id, data))
+    except Exception:
+        await release_media([ref["media_id"] for ref in refs if ref["media_id"] not in existing])
+        raise
+    kept = {ref["media_id"] for ref in refs}
+    return refs, [media_id for media_id in existing if media_id not in kept]
+
 @api_router.post("/journals", response_model=JournalResponse)
 async def create_journal(journal_data: JournalCreate, current_user: dict = Depends(get_current_user)):
     journal_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
+    photo_media, _ = await resolve_journal_photos(
+        current_user["user_id"], journal_id, journal_data.photos or [], []
+    )
     
     journal_doc = {
         "journal_id": journal_id,
@@ -582,14 +2562,14 @@ async def create_journal(journal_data: JournalCreate, current_user: dict = Depen
         "children_involved": journal_data.children_involved,
         "mood": journal_data.mood or "neutral",
         "location": journal_data.location or "",
-        "photos": journal_data.photos or [],
+        "photo_media": photo_media,
         "created_at": now,
         "updated_at": now
     }
     
     await db.journals.insert_one(journal_doc)
     
-    return JournalResponse(**journal_doc)
+    return journal_response(journal_doc)
 
 # Pagination response model
 class PaginatedResponse(BaseModel):
@@ -615,43 +2595,32 @@ async def get_journals(
     
     journals = await db.journals.find(
         query, 
-        {"_id": 0}
+        {"_id": 0, "photos": 0}
     ).sort("date", -1).skip(skip).limit(page_size).to_list(page_size)
     
-    # Add default values for missing fields (backward compatibility)
-    for journal in journals:
-        if "photos" not in journal:
-            journal["photos"] = []
-        if "content" not in journal:
-            journal["content"] = journal.get("entry", "")
-        if "location" not in journal:
-            journal["location"] = ""
-        if "updated_at" not in journal:
-            journal["updated_at"] = journal.get("created_at", "")
-    return [JournalResponse(**journal) for journal in journals]
+    return [journal_response(journal) for journal in journals]
 
 @api_router.get("/journals/{journal_id}", response_model=JournalResponse)
 async def get_journal(journal_id: str, current_user: dict = Depends(get_current_user)):
     journal = await db.journals.find_one(
         {"journal_id": journal_id, "user_id": current_user["user_id"]}, 
-        {"_id": 0}
+        {"_id": 0, "photos": 0}
     )
     if not journal:
         raise HTTPException(status_code=404, detail="Journal not found")
-    # Add default values for missing fields
-    if "photos" not in journal:
-        journal["photos"] = []
-    if "content" not in journal:
-        journal["content"] = journal.get("entry", "")
-    if "location" not in journal:
-        journal["location"] = ""
-    if "updated_at" not in journal:
-        journal["updated_at"] = journal.get("created_at", "")
-    return JournalResponse(**journal)
+    return journal_response(journal)
 
 @api_router.put("/journals/{journal_id}", response_model=JournalResponse)
 async def update_journal(journal_id: str, journal_data: JournalCreate, current_user: dict = Depends(get_current_user)):
     now = datetime.now(timezone.utc).isoformat()
+    query = {"journal_id": journal_id, "user_id": current_user["user_id"]}
+    
+    current = await db.journals.find_one(query, {"_id": 0, "photo_media": 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Journal not found")
+    photo_media, released = await resolve_journal_photos(
+        current_user["user_id"], journal_id, journal_data.photos or [], current.get("photo_media", [])
+    )
     
     update_doc = {
         "title": journal_data.title,
@@ -660,36 +2629,146 @@ async def update_journal(journal_id: str, journal_data: JournalCreate, current_u
         "children_involved": journal_data.children_involved,
         "mood": journal_data.mood or "neutral",
         "location": journal_data.location or "",
-        "photos": journal_data.photos or [],
+        "photo_media": photo_media,
         "updated_at": now
     }
     
-    result = await db.journals.update_one(
-        {"journal_id": journal_id, "user_id": current_user["user_id"]},
-        {"$set": update_doc}
+    journal = await db.journals.find_one_and_update(
+        query,
+        {"$set": update_doc},
+        projection={"_id": 0, "photos": 0},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if journal is None:
+        # Deleted while the photos were being stored
+        kept = {ref["media_id"] for ref in current.get("photo_media", [])}
+        await release_media([ref["media_id"] for ref in photo_media if ref["media_id"] not in kept])
         raise HTTPException(status_code=404, detail="Journal not found")
     
-    journal = await db.journals.find_one(
-        {"journal_id": journal_id}, 
-        {"_id": 0}
+    await release_media(released)
+    return journal_response(journal)
+
+@api_router.post("/journals/{journal_id}/photos", response_model=JournalResponse)
+async def add_journal_photo(
+    journal_id: str,
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    query = {"journal_id": journal_id, "user_id": current_user["user_id"]}
+    if not await db.journals.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Journal not found")
+    
+    # One byte past the limit is enough for store_media to reject an oversized photo
+    ref = await store_media(current_user["user_id"], "journal", journal_id, await file.read(MEDIA_MAX_SIZE + 1))
+    journal = await db.journals.find_one_and_update(
+        query,
+        {
+            "$push": {"photo_media": ref},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        projection={"_id": 0, "photos": 0},
+        return_document=ReturnDocument.AFTER
     )
-    if "photos" not in journal:
-        journal["photos"] = []
-    return JournalResponse(**journal)
+    if journal is None:
+        await release_media([ref["media_id"]])
+        raise HTTPException(status_code=404, detail="Journal not found")
+    return journal_response(journal)
+
+@api_router.delete("/journals/{journal_id}/photos/{media_id}", response_model=JournalResponse)
+async def remove_journal_photo(journal_id: str, media_id: str, current_user: dict = Depends(get_current_user)):
+    journal = await db.journals.find_one_and_update(
+        {"journal_id": journal_id, "user_id": current_user["user_id"], "photo_media.media_id": media_id},
+        {
+            "$pull": {"photo_media": {"media_id": media_id}},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        projection={"_id": 0, "photos": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if journal is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    await release_media([media_id])
+    return journal_response(journal)
 
 @api_router.delete("/journals/{journal_id}")
 async def delete_journal(journal_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.journals.delete_one({
-        "journal_id": journal_id, 
-        "user_id": current_user["user_id"]
-    })
-    if result.deleted_count == 0:
+    journal = await db.journals.find_one_and_delete(
+        {"journal_id": journal_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "photo_media": 1}
+    )
+    if journal is None:
         raise HTTPException(status_code=404, detail="Journal not found")
+    await record_deletion(current_user["user_id"], "journals", journal_id)
+    await release_media([ref["media_id"] for ref in journal.get("photo_media", [])])
     return {"message": "Journal deleted successfully"}
 
+# ============== MEDIA ROUTES ==============
+
+async def find_accessible_media(
+    media_id: str,
+    path: str,
+    expires: Optional[int],
+    signature: Optional[str],
+    credentials: Optional[HTTPAuthorizationCredentials]
+) -> dict:
+    query = {"media_id": media_id, **await signed_or_owner_filter(path, expires, signature, credentials)}
+    media = await db.media.find_one(query, {"_id": 0})
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return media
+
+@api_router.get("/media/{media_id}/content")
+async def stream_media_content(
+    media_id: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Original bytes of a media object, as uploaded"""
+    media = await find_accessible_media(media_id, f"/media/{media_id}/content", expires, signature, credentials)
+    try:
+        return await file_stream_response(
+            request,
+            lambda start, length: open_stored_blob(media, start, length),
+            size=media["size"],
+            etag=f'"{media["content_hash"]}"',
+            content_type=media["content_type"],
+            cache_control="private, max-age=31536000, immutable"
+        )
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Media file not found")
+
+@api_router.get("/media/{media_id}/variants/{variant}")
+async def get_media_variant(
+    media_id: str,
+    variant: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """WebP thumbnail/preview (or square avatar crop) of a media object"""
+    if variant_spec(variant) is None:
+        raise HTTPException(status_code=404, detail="Unknown variant")
+    media = await find_accessible_media(
+        media_id, f"/media/{media_id}/variants/{variant}", expires, signature, credentials
+    )
+    
+    etag = f'"{media["content_hash"]}-{variant}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    try:
+        record = await ensure_image_variant(media["content_hash"], variant, lambda: read_media_bytes(media))
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Media file not found")
+    except Exception as e:
+        logger.warning(f"Could not render {variant} for media {media_id}: {str(e)}")
+        raise HTTPException(status_code=422, detail="Image could not be processed")
+    return await image_variant_response(request, record)
+
 # ============== VIOLATIONS ROUTES ==============
 
 @api_router.post("/violations", response_model=ViolationResponse)
@@ -707,7 +2786,8 @@ async def create_violation(violation_data: ViolationCreate, current_user: dict =
         "severity": violation_data.severity,
         "witnesses": violation_data.witnesses or "",
         "evidence_notes": violation_data.evidence_notes or "",
-        "created_at": now
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.violations.insert_one(violation_doc)
@@ -798,87 +2878,308 @@ async def delete_violation(violation_id: str, current_user: dict = Depends(get_c
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Violation not found")
+    await record_deletion(current_user["user_id"], "violations", violation_id)
     return {"message": "Violation deleted successfully"}
 
 # ============== DOCUMENTS ROUTES ==============
 
-@api_router.post("/documents", response_model=DocumentResponse)
-async def upload_document(
-    file: UploadFile = File(...),
-    category: str = Form(...),
-    description: str = Form(""),
-    current_user: dict = Depends(get_current_user)
-):
-    # Validate file type
-    allowed_types = [
-        # Documents
-        "application/pdf",
-        "application/msword",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        # Images
-        "image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp",
-        # Videos
-        "video/mp4", "video/mpeg", "video/quicktime", "video/x-msvideo", 
-        "video/webm", "video/x-ms-wmv", "video/3gpp",
-        # Audio
-        "audio/mpeg", "audio/mp3", "audio/wav", "audio/ogg", "audio/aac",
-        "audio/x-m4a", "audio/mp4", "audio/webm"
-    ]
-    
-    if file.content_type not in allowed_types:
+DOCUMENT_TYPES = [
+    # Documents
+    "application/pdf",
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    # Images
+    "image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp",
+    # Videos
+    "video/mp4", "video/mpeg", "video/quicktime", "video/x-msvideo", 
+    "video/webm", "video/x-ms-wmv", "video/3gpp",
+    # Audio
+    "audio/mpeg", "audio/mp3", "audio/wav", "audio/ogg", "audio/aac",
+    "audio/x-m4a", "audio/mp4", "audio/webm"
+]
+# Max file size: 50MB for videos/audio, 10MB for others
+DOCUMENT_MEDIA_MAX_SIZE = 50 * 1024 * 1024
+DOCUMENT_MAX_SIZE = 10 * 1024 * 1024
+
+def document_size_limit(filename: str, content_type: str) -> int:
+    """Validate an upload's type as soon as its part headers arrive and return its size limit"""
+    if content_type not in DOCUMENT_TYPES:
         raise HTTPException(status_code=400, detail="File type not allowed. Supported: PDF, Images, Word docs, Videos, Audio")
-    
-    # Read file content
-    file_content = await file.read()
-    file_size = len(file_content)
-    
-    # Max file size: 50MB for videos/audio, 10MB for others
-    max_size = 50 * 1024 * 1024 if file.content_type.startswith(("video/", "audio/")) else 10 * 1024 * 1024
-    max_size_mb = 50 if file.content_type.startswith(("video/", "audio/")) else 10
-    if file_size > max_size:
-        raise HTTPException(status_code=400, detail=f"File too large (max {max_size_mb}MB)")
-    
-    document_id = str(uuid.uuid4())
+    return DOCUMENT_MEDIA_MAX_SIZE if content_type.startswith(("video/", "audio/")) else DOCUMENT_MAX_SIZE
+
+async def create_document_record(user_id: str, filename: str, content_type: str, blob: dict, category: str, description: str) -> dict:
+    """Insert the db.documents row for a stored blob and queue its background processing"""
     now = datetime.now(timezone.utc).isoformat()
-    
-    # Store file as base64
-    file_base64 = base64.b64encode(file_content).decode('utf-8')
-    
     document_doc = {
-        "document_id": document_id,
-        "user_id": current_user["user_id"],
-        "filename": file.filename,
-        "file_type": file.content_type,
-        "file_size": file_size,
-        "file_data": file_base64,
+        "document_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "filename": filename,
+        "file_type": content_type,
+        "file_size": blob["size"],
+        "content_hash": blob["_id"],
+        **blob_reference(blob),
+        "compression_ratio": compression_ratio(blob),
         "category": category,
         "description": description,
-        "created_at": now
+        "metadata_status": "pending",
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.documents.insert_one(document_doc)
     
-    return DocumentResponse(
-        document_id=document_id,
-        user_id=current_user["user_id"],
-        filename=file.filename,
-        file_type=file.content_type,
-        file_size=file_size,
-        category=category,
-        description=description,
-        created_at=now
+    metadata_worker.notify()
+    if content_type.startswith("image/"):
+        generate_image_variants(document_doc["content_hash"], lambda: read_document_bytes(document_doc))
+    return document_doc
+
+@api_router.post("/documents", response_model=DocumentResponse)
+async def upload_document(request: Request, current_user: dict = Depends(get_current_user)):
+    """Multipart upload (file, category, description), consumed as it streams in.
+
+    Type and size limits are enforced while the body is read, the file is
+    spooled rather than buffered, and it is hashed on the way through.
+    """
+    fields, upload = await receive_multipart(request, document_size_limit, DOCUMENT_MEDIA_MAX_SIZE + UPLOAD_MAX_FIELD_SIZE)
+    try:
+        if upload is None:
+            raise HTTPException(status_code=422, detail="Field required: file")
+        if "category" not in fields:
+            raise HTTPException(status_code=422, detail="Field required: category")
+        
+        # Content-addressed: identical bytes are stored once and reference-counted
+        blob = await acquire_content_blob(upload.content_hash, upload.size, upload.content_type, upload.chunks)
+    finally:
+        if upload:
+            upload.close()
+    
+    document_doc = await create_document_record(
+        current_user["user_id"], upload.filename, upload.content_type, blob,
+        fields["category"], fields.get("description", "")
     )
+    return document_response(document_doc)
+
+def document_response(doc: dict) -> DocumentResponse:
+    """API shape of a document record, with signed variant URLs for images"""
+    response = DocumentResponse(**doc)
+    if doc["file_type"].startswith("image/"):
+        base = f"/documents/{doc['document_id']}/variants"
+        response.thumbnail_url = sign_path(f"{base}/thumb")
+        response.preview_url = sign_path(f"{base}/preview")
+    return response
+
+async def find_accessible_document(
+    document_id: str,
+    path: str,
+    expires: Optional[int],
+    signature: Optional[str],
+    credentials: Optional[HTTPAuthorizationCredentials],
+    projection: Optional[dict] = None
+) -> dict:
+    """Load a document for a bearer-token owner or a valid signed path"""
+    query = {"document_id": document_id, **await signed_or_owner_filter(path, expires, signature, credentials)}
+    document = await db.documents.find_one(query, projection or {"_id": 0})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+# Short names accepted by the type filter; anything containing "/" is matched as an exact MIME type
+DOCUMENT_TYPE_FILTERS = {
+    "image": {"$regex": "^image/"},
+    "video": {"$regex": "^video/"},
+    "audio": {"$regex": "^audio/"},
+    "pdf": "application/pdf",
+    "word": {"$in": [
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    ]},
+}
+DOCUMENT_PAGE_SIZE_MAX = 100
+
+def next_day(date: str) -> str:
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def checked_filter_date(value: str) -> str:
+    """The value unchanged once it parses as YYYY-MM-DD or an ISO timestamp (ValueError otherwise)"""
+    if len(value) == 10:
+        datetime.strptime(value, "%Y-%m-%d")
+    else:
+        parse_iso_datetime(value)
+    return value
+
+def document_filter_query(
+    user_id: str,
+    type: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    q: Optional[str]
+) -> Dict[str, Any]:
+    """date_from/date_to are inclusive YYYY-MM-DD dates (or ISO timestamps) on created_at"""
+    query: Dict[str, Any] = {"user_id": user_id}
+    if type:
+        if "/" not in type and type not in DOCUMENT_TYPE_FILTERS:
+            raise HTTPException(status_code=400, detail=f"Unknown type filter: {type}")
+        query["file_type"] = type if "/" in type else DOCUMENT_TYPE_FILTERS[type]
+    if date_from or date_to:
+        try:
+            created_at = {}
+            if date_from:
+                created_at["$gte"] = checked_filter_date(date_from)
+            if date_to:
+                # A bare date covers the whole day
+                date_to = checked_filter_date(date_to)
+                created_at.update({"$lt": next_day(date_to)} if len(date_to) == 10 else {"$lte": date_to})
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+        query["created_at"] = created_at
+    if q:
+        pattern = {"$regex": re.escape(q), "$options": "i"}
+        query["$or"] = [{"filename": pattern}, {"description": pattern}]
+    return query
 
 @api_router.get("/documents", response_model=List[DocumentResponse])
-async def get_documents(current_user: dict = Depends(get_current_user)):
+async def get_documents(
+    current_user: dict = Depends(get_current_user),
+    category: Optional[str] = None,
+    type: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    q: Optional[str] = None
+):
+    """Newest first as a plain list (up to 1000), as before paging was added; the
+    documents screen uses /documents/page instead"""
+    query = document_filter_query(current_user["user_id"], type, date_from, date_to, q)
+    if category:
+        query["category"] = category
     documents = await db.documents.find(
-        {"user_id": current_user["user_id"]}, 
-        {"_id": 0, "file_data": 0}
+        query, {"_id": 0, "file_data": 0, "metadata_lease": 0}
     ).sort("created_at", -1).to_list(1000)
-    return [DocumentResponse(**doc) for doc in documents]
+    return [document_response(doc) for doc in documents]
+
+@api_router.get("/documents/page", response_model=DocumentPage)
+async def get_documents_page(
+    current_user: dict = Depends(get_current_user),
+    page: int = 1,
+    page_size: int = 24,
+    category: Optional[str] = None,
+    type: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    q: Optional[str] = None
+):
+    """Newest first, one page at a time, with per-category counts for the filter UI"""
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), DOCUMENT_PAGE_SIZE_MAX)
+    
+    query = document_filter_query(current_user["user_id"], type, date_from, date_to, q)
+    page_query = {**query, "category": category} if category else query
+    
+    # The page itself walks the (user_id, created_at) index; the counts come from one $facet pass
+    items, counts = await asyncio.gather(
+        db.documents.find(page_query, {"_id": 0, "file_data": 0, "metadata_lease": 0})
+            .sort("created_at", -1)
+            .skip((page - 1) * page_size)
+            .limit(page_size)
+            .to_list(page_size),
+        db.documents.aggregate([
+            {"$match": query},
+            {"$facet": {
+                "total": [{"$match": {"category": category}} if category else {"$match": {}}, {"$count": "count"}],
+                "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}]
+            }}
+        ]).to_list(1)
+    )
+    total = counts[0]["total"][0]["count"] if counts[0]["total"] else 0
+    return DocumentPage(
+        items=[document_response(doc) for doc in items],
+        total=total,
+        page=page,
+        page_size=page_size,
+        total_pages=-(-total // page_size),
+        facets={facet["_id"]: facet["count"] for facet in counts[0]["categories"] if facet["_id"]}
+    )
+
+@api_router.get("/documents/{document_id}/content")
+async def stream_document_content(
+    document_id: str,
+    request: Request,
+    download: bool = False,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Raw file bytes with Range/206 support; authorised by bearer token or signed URL"""
+    document = await find_accessible_document(
+        document_id, f"/documents/{document_id}/content", expires, signature, credentials
+    )
+    
+    try:
+        return await file_stream_response(
+            request,
+            open_document_stream(document),
+            size=document["file_size"],
+            etag=f'"{document.get("content_hash") or document["document_id"]}"',
+            content_type=document["file_type"],
+            filename=document["filename"],
+            disposition="attachment" if download else "inline"
+        )
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Document file not found")
+
+@api_router.get("/documents/{document_id}/variants/{variant}")
+async def get_document_variant(
+    document_id: str,
+    variant: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """WebP thumbnail/preview of an image document, rendered on first request if missing"""
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="Unknown variant")
+    document = await find_accessible_document(
+        document_id, f"/documents/{document_id}/variants/{variant}", expires, signature, credentials,
+        projection={"_id": 0, "file_data": 0}
+    )
+    if not document["file_type"].startswith("image/"):
+        raise HTTPException(status_code=404, detail="No preview for this file type")
+    
+    source_id = document.get("content_hash") or document["document_id"]
+    etag = f'"{source_id}-{variant}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    async def read_source() -> bytes:
+        full = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
+        return await read_document_bytes(full)
+    
+    try:
+        record = await ensure_image_variant(source_id, variant, read_source)
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Document file not found")
+    except Exception as e:
+        logger.warning(f"Could not render {variant} for {document_id}: {str(e)}")
+        raise HTTPException(status_code=422, detail="Image could not be processed")
+    return await image_variant_response(request, record)
+
+@api_router.get("/documents/{document_id}/stream-url")
+async def get_document_stream_url(document_id: str, current_user: dict = Depends(get_current_user)):
+    """Short-lived signed path for media elements, which cannot send a bearer header"""
+    document = await db.documents.find_one(
+        {"document_id": document_id, "user_id": current_user["user_id"]},
+        {"_id": 1}
+    )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {
+        "path": sign_path(f"/documents/{document_id}/content"),
+        "expires_in": SIGNED_URL_TTL_SECONDS
+    }
 
 @api_router.get("/documents/{document_id}/download")
 async def download_document(document_id: str, current_user: dict = Depends(get_current_user)):
+    """Legacy base64-in-JSON download; prefer /documents/{id}/content"""
     document = await db.documents.find_one(
         {"document_id": document_id, "user_id": current_user["user_id"]}, 
         {"_id": 0}
@@ -886,22 +3187,228 @@ async def download_document(document_id: str, current_user: dict = Depends(get_c
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
+    try:
+        file_content = await read_document_bytes(document)
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Document file not found")
+    
     return {
         "filename": document["filename"],
         "file_type": document["file_type"],
-        "file_data": document["file_data"]
+        "file_data": base64.b64encode(file_content).decode('utf-8')
     }
 
 @api_router.delete("/documents/{document_id}")
 async def delete_document(document_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.documents.delete_one({
-        "document_id": document_id, 
-        "user_id": current_user["user_id"]
-    })
-    if result.deleted_count == 0:
+    document = await db.documents.find_one_and_delete(
+        {"document_id": document_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "content_hash": 1, "blob_store": 1, "blob_key": 1}
+    )
+    if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    await record_deletion(current_user["user_id"], "documents", document_id)
+    await release_document_file(document)
     return {"message": "Document deleted successfully"}
 
+# ============== RESUMABLE UPLOADS ==============
+
+def upload_chunk_key(upload_id: str, index: int) -> str:
+    return f"uploads/{upload_id}/{index}"
+
+def upload_chunk_length(session: dict, index: int) -> int:
+    """Every chunk is chunk_size bytes except the last"""
+    if index < session["total_chunks"] - 1:
+        return session["chunk_size"]
+    return session["size"] - session["chunk_size"] * (session["total_chunks"] - 1)
+
+def upload_session_response(session: dict) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        **session,
+        received_chunks=sorted(int(index) for index in session.get("chunks", {})),
+        expires_at=session["expires_at"].isoformat()
+    )
+
+async def assembled_upload(session: dict) -> AsyncIterator[bytes]:
+    """The uploaded file, read back chunk by chunk in order"""
+    store = get_blob_store(session["blob_store"])
+    for index in range(session["total_chunks"]):
+        async for piece in store.open(upload_chunk_key(session["upload_id"], index)):
+            yield piece
+
+async def delete_upload_chunks(session: dict) -> None:
+    """Every chunk key the session could have written, recorded or not: a chunk is
+    only added to session.chunks after its bytes are stored, so a write cut short
+    (or still running) would otherwise leak its blob"""
+    store = get_blob_store(session["blob_store"])
+    for index in range(session["total_chunks"]):
+        await store.delete(upload_chunk_key(session["upload_id"], index))
+
+async def sweep_upload_sessions() -> None:
+    """Delete sessions idle past their expiry, together with their chunks"""
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            # find_one_and_delete claims each session, so concurrent workers never double-sweep
+            while session := await db.upload_sessions.find_one_and_delete({"expires_at": {"$lt": now}}):
+                await delete_upload_chunks(session)
+                logger.info(f"Swept abandoned upload {session['upload_id']}")
+        except Exception as e:
+            logger.warning(f"Upload sweep failed: {str(e)}")
+        await asyncio.sleep(UPLOAD_SWEEP_INTERVAL_SECONDS)
+
+@api_router.post("/uploads", response_model=UploadSessionResponse)
+async def create_upload_session(session_data: UploadSessionCreate, current_user: dict = Depends(get_current_user)):
+    """Start a resumable upload; the file is then sent as numbered chunks"""
+    max_size = document_size_limit(session_data.filename, session_data.content_type)
+    if session_data.size > max_size:
+        raise HTTPException(status_code=400, detail=f"File too large (max {max_size // (1024 * 1024)}MB)")
+    if session_data.size <= 0:
+        raise HTTPException(status_code=400, detail="File is empty")
+    
+    now = datetime.now(timezone.utc)
+    session = {
+        "upload_id": str(uuid.uuid4()),
+        "user_id": current_user["user_id"],
+        "filename": session_data.filename,
+        "content_type": session_data.content_type,
+        "size": session_data.size,
+        "category": session_data.category,
+        "description": session_data.description or "",
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "total_chunks": -(-session_data.size // UPLOAD_CHUNK_SIZE),
+        "blob_store": blob_store.name,
+        "chunks": {},
+        "status": "open",
+        "created_at": now.isoformat(),
+        "expires_at": now + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+    }
+    await db.upload_sessions.insert_one(session)
+    return upload_session_response(session)
+
+@api_router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str, current_user: dict = Depends(get_current_user)):
+    """Which chunks have arrived, so an interrupted client can resume"""
+    session = await db.upload_sessions.find_one(
+        {"upload_id": upload_id, "user_id": current_user["user_id"]}, {"_id": 0}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload_session_response(session)
+
+@api_router.put("/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Store one chunk; X-Chunk-SHA256 (hex) must match its bytes. Re-sending a chunk replaces it."""
+    expected_sha256 = (request.headers.get("x-chunk-sha256") or "").lower()
+    if not expected_sha256:
+        raise HTTPException(status_code=400, detail="X-Chunk-SHA256 header required")
+    # Extending the expiry up front keeps the sweeper off a session while a chunk is being written
+    session = await db.upload_sessions.find_one_and_update(
+        {"upload_id": upload_id, "user_id": current_user["user_id"], "status": "open"},
+        {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)}},
+        projection={"_id": 0}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if not 0 <= index < session["total_chunks"]:
+        raise HTTPException(status_code=400, detail="Chunk index out of range")
+    
+    expected_length = upload_chunk_length(session, index)
+    sha256 = hashlib.sha256()
+    received = 0
+    
+    async def body() -> AsyncIterator[bytes]:
+        nonlocal received
+        async for piece in request.stream():
+            received += len(piece)
+            if received > expected_length:
+                raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected_length} bytes")
+            sha256.update(piece)
+            yield piece
+    
+    store = get_blob_store(session["blob_store"])
+    key = upload_chunk_key(upload_id, index)
+    try:
+        await store.put(key, body(), "application/octet-stream")
+        if received != expected_length:
+            raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected_length} bytes")
+        if not hmac.compare_digest(sha256.hexdigest(), expected_sha256):
+            raise HTTPException(status_code=400, detail="Checksum mismatch")
+    except BaseException:
+        # A rejected re-send has overwritten any earlier copy, so the chunk is gone either way
+        await store.delete(key)
+        await db.upload_sessions.update_one({"upload_id": upload_id}, {"$unset": {f"chunks.{index}": ""}})
+        raise
+    
+    await db.upload_sessions.update_one(
+        {"upload_id": upload_id},
+        {"$set": {
+            f"chunks.{index}": {"size": received, "sha256": expected_sha256},
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+        }}
+    )
+    return {"upload_id": upload_id, "index": index, "size": received}
+
+@api_router.post("/uploads/{upload_id}/complete", response_model=DocumentResponse)
+async def complete_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    """Assemble the chunks into a content-addressed blob and create the document"""
+    # Leaving "open" stops chunk writes and a second finalize; the fresh expiry keeps
+    # the sweeper off it while assembling (and cleans up if this worker dies)
+    session = await db.upload_sessions.find_one_and_update(
+        {"upload_id": upload_id, "user_id": current_user["user_id"], "status": "open"},
+        {"$set": {
+            "status": "assembling",
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    missing = [index for index in range(session["total_chunks"]) if str(index) not in session["chunks"]]
+    if missing:
+        await db.upload_sessions.update_one({"upload_id": upload_id}, {"$set": {"status": "open"}})
+        raise HTTPException(status_code=400, detail=f"Missing chunks: {missing[:20]}")
+    
+    try:
+        sha256 = hashlib.sha256()
+        async for piece in assembled_upload(session):
+            await asyncio.to_thread(sha256.update, piece)
+        blob = await acquire_content_blob(
+            sha256.hexdigest(), session["size"], session["content_type"], lambda: assembled_upload(session)
+        )
+    except Exception:
+        await db.upload_sessions.update_one({"upload_id": upload_id}, {"$set": {"status": "open"}})
+        raise
+    
+    try:
+        document_doc = await create_document_record(
+            current_user["user_id"], session["filename"], session["content_type"], blob,
+            session["category"], session["description"]
+        )
+    except Exception:
+        # Hand back the reference taken above; the chunks stay so the client can retry
+        await release_content_blob(blob["_id"])
+        await db.upload_sessions.update_one({"upload_id": upload_id}, {"$set": {"status": "open"}})
+        raise
+    await delete_upload_chunks(session)
+    await db.upload_sessions.delete_one({"upload_id": upload_id})
+    return document_response(document_doc)
+
+@api_router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    session = await db.upload_sessions.find_one_and_delete(
+        {"upload_id": upload_id, "user_id": current_user["user_id"], "status": "open"}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    await delete_upload_chunks(session)
+    return {"message": "Upload cancelled"}
+
 # ============== CALENDAR ROUTES ==============
 
 @api_router.post("/calendar", response_model=CalendarEventResponse)
@@ -925,14 +3432,15 @@ async def create_calendar_event(event_data: CalendarEventCreate, current_user: d
         "custom_color": event_data.custom_color or "",
         "exception_dates": event_data.exception_dates or [],
         "parent_event_id": event_data.parent_event_id or "",
-        "created_at": now
+        "created_at": now,
+        "updated_at": now
     }
     
     # If creating single instance exception, add date to parent's exception_dates
     if event_data.parent_event_id:
         await db.calendar_events.update_one(
             {"event_id": event_data.parent_event_id, "user_id": current_user["user_id"]},
-            {"$addToSet": {"exception_dates": event_data.start_date}}
+            {"$addToSet": {"exception_dates": event_data.start_date}, "$set": {"updated_at": now}}
         )
     
     await db.calendar_events.insert_one(event_doc)
@@ -972,7 +3480,8 @@ async def update_calendar_event(event_id: str, event_data: CalendarEventCreate,
         "recurring": event_data.recurring or False,
         "recurrence_pattern": event_data.recurrence_pattern or "",
         "recurrence_end_date": event_data.recurrence_end_date or "",
-        "custom_color": event_data.custom_color or ""
+        "custom_color": event_data.custom_color or "",
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
     # Don't overwrite exception_dates on normal update
@@ -1009,6 +3518,7 @@ async def delete_calendar_event(event_id: str, current_user: dict = Depends(get_
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Event not found")
+    await record_deletion(current_user["user_id"], "calendar_events", event_id)
     return {"message": "Event deleted successfully"}
 
 # ============== STATE LAWS ROUTES ==============
@@ -1321,13 +3831,10 @@ async def get_parental_alienation_resources():
 @api_router.post("/send-email")
 async def send_email(request: EmailRequest, current_user: dict = Depends(get_current_user)):
     try:
-        import resend
-        
         resend_api_key = os.environ.get('RESEND_API_KEY')
         if not resend_api_key:
             raise HTTPException(status_code=500, detail="Email service not configured")
         
-        resend.api_key = resend_api_key
         sender_email = os.environ.get('SENDER_EMAIL', 'onboarding@resend.dev')
         
         # Build email content based on content_type
@@ -1368,15 +3875,13 @@ async def send_email(request: EmailRequest, current_user: dict = Depends(get_cur
             "html": html_content
         }
         
-        email = await asyncio.to_thread(resend.Emails.send, params)
+        email = await send_resend_email(params)
         
         return {
             "status": "success",
             "message": f"Email sent to {request.recipient_email}",
             "email_id": email.get("id")
         }
-    except ImportError:
-        raise HTTPException(status_code=500, detail="Email service not available")
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
@@ -1405,7 +3910,7 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     # Get recent journals
     recent_journals = await db.journals.find(
         {"user_id": user_id},
-        {"_id": 0}
+        {"_id": 0, "photos": 0, "photo_media": 0}
     ).sort("created_at", -1).limit(5).to_list(5)
     
     # Get recent violations
@@ -1430,32 +3935,712 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
 
 # ============== EXPORT ROUTES ==============
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def wants_ndjson(request: Request, format: Optional[str]) -> bool:
+    if format:
+        if format not in ("json", "ndjson"):
+            raise HTTPException(status_code=400, detail="format must be json or ndjson")
+        return format == "ndjson"
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def encoded_batches(cursor, batch_size: int) -> AsyncIterator[List[bytes]]:
+    """JSON-encoded cursor rows, batch_size records at a time"""
+    batch = []
+    async for record in cursor.batch_size(batch_size):
+        batch.append(json.dumps(record, default=str).encode("utf-8"))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def export_records_response(
+    request: Request,
+    key: str,
+    cursor,
+    format: Optional[str],
+    batch_size: int
+) -> StreamingResponse:
+    """Stream every matching row, as NDJSON (one record per line) or as the
+    {key: [...], exported_at} JSON object the export buttons download"""
+    batch_size = min(max(batch_size, 1), EXPORT_MAX_BATCH_SIZE)
+    if wants_ndjson(request, format):
+        async def ndjson():
+            async for batch in encoded_batches(cursor, batch_size):
+                yield b"".join(line + b"\n" for line in batch)
+        return StreamingResponse(ndjson(), media_type=NDJSON_MEDIA_TYPE, headers={"Cache-Control": "no-store"})
+    
+    async def envelope():
+        exported_at = json.dumps(datetime.now(timezone.utc).isoformat())
+        yield f'{{"exported_at": {exported_at}, "{key}": ['.encode("utf-8")
+        separator = b""
+        async for batch in encoded_batches(cursor, batch_size):
+            yield separator + b", ".join(batch)
+            separator = b", "
+        yield b"]}"
+    return StreamingResponse(envelope(), media_type="application/json", headers={"Cache-Control": "no-store"})
+
 @api_router.get("/export/journals")
-async def export_journals(current_user: dict = Depends(get_current_user)):
-    journals = await db.journals.find(
+async def export_journals(
+    request: Request,
+    format: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    current_user: dict = Depends(get_current_user)
+):
+    """All journals, newest first; NDJSON with format=ndjson or Accept: application/x-ndjson"""
+    journals = db.journals.find(
         {"user_id": current_user["user_id"]},
-        {"_id": 0}
-    ).sort("date", -1).to_list(1000)
-    
-    return {"journals": journals, "exported_at": datetime.now(timezone.utc).isoformat()}
+        {"_id": 0, "photos": 0}
+    ).sort("date", -1)
+    return export_records_response(request, "journals", journals, format, batch_size)
 
 @api_router.get("/export/violations")
-async def export_violations(current_user: dict = Depends(get_current_user)):
-    violations = await db.violations.find(
+async def export_violations(
+    request: Request,
+    format: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    current_user: dict = Depends(get_current_user)
+):
+    """All violations, newest first; NDJSON with format=ndjson or Accept: application/x-ndjson"""
+    violations = db.violations.find(
         {"user_id": current_user["user_id"]},
         {"_id": 0}
-    ).sort("date", -1).to_list(1000)
+    ).sort("date", -1)
+    return export_records_response(request, "violations", violations, format, batch_size)
+
+# ============== TABULAR EXPORT ==============
+
+# Flat columns per dataset as (name, type); types drive the Parquet schema.
+# "children" holds the children's names, and photos are left out entirely.
+TABLE_EXPORTS = {
+    "journals": {
+        "collection": "journals",
+        "sort": "date",
+        "columns": [
+            ("journal_id", "string"), ("date", "date"), ("title", "string"), ("content", "string"),
+            ("children", "string"), ("mood", "string"), ("location", "string"), ("photo_count", "int"),
+            ("created_at", "timestamp"), ("updated_at", "timestamp")
+        ]
+    },
+    "violations": {
+        "collection": "violations",
+        "sort": "date",
+        "columns": [
+            ("violation_id", "string"), ("date", "date"), ("title", "string"), ("description", "string"),
+            ("violation_type", "string"), ("severity", "string"), ("witnesses", "string"),
+            ("evidence_notes", "string"), ("created_at", "timestamp"), ("updated_at", "timestamp")
+        ]
+    },
+    "calendar": {
+        "collection": "calendar_events",
+        "sort": "start_date",
+        "columns": [
+            ("event_id", "string"), ("title", "string"), ("start_date", "timestamp"), ("end_date", "timestamp"),
+            ("event_type", "string"), ("children", "string"), ("location", "string"), ("notes", "string"),
+            ("recurring", "bool"), ("recurrence_pattern", "string"), ("recurrence_end_date", "date"),
+            ("created_at", "timestamp"), ("updated_at", "timestamp")
+        ]
+    }
+}
+
+def render_csv_batch(rows: List[dict], names: List[str], header: bool) -> bytes:
+    """Runs in the media pool"""
+    import pandas as pd  # Only the worker processes pay for loading pandas
+    return pd.DataFrame(rows, columns=names).to_csv(index=False, header=header).encode("utf-8")
+
+def render_parquet_table(source: str, destination: str, columns: List[tuple]) -> int:
+    """Convert spooled NDJSON rows into a typed Parquet file, one row group per batch.
+
+    Runs in the media pool; returns the number of rows written.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    arrow_types = {
+        "string": pa.string(),
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us", tz="UTC")
+    }
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns])
+    names = [name for name, _ in columns]
+    
+    def frames():
+        with open(source, encoding="utf-8") as handle:
+            batch = []
+            for line in handle:
+                batch.append(json.loads(line))
+                if len(batch) >= TABLE_EXPORT_BATCH_SIZE:
+                    yield pd.DataFrame(batch, columns=names)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=names)
+    
+    rows = 0
+    with pq.ParquetWriter(destination, schema) as writer:
+        for frame in frames():
+            for name, kind in columns:
+                if kind == "string":
+                    frame[name] = frame[name].astype("string")
+                elif kind == "date":
+                    frame[name] = pd.to_datetime(frame[name], errors="coerce", format="ISO8601", utc=True).dt.tz_localize(None)
+                elif kind == "timestamp":
+                    frame[name] = pd.to_datetime(frame[name], errors="coerce", format="ISO8601", utc=True)
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            writer.write_table(table.cast(schema, safe=False))
+            rows += len(frame)
+        if rows == 0:
+            writer.write_table(schema.empty_table())
+    return rows
+
+def table_row(record: dict, columns: List[tuple], child_names: Dict[str, str]) -> dict:
+    row = {name: record.get(name) for name, _ in columns}
+    if "children" in row:
+        row["children"] = "; ".join(child_names.get(child_id, child_id) for child_id in record.get("children_involved", []))
+    if "photo_count" in row:
+        row["photo_count"] = len(record.get("photo_media", []))
+    return row
+
+async def table_batches(dataset: str, user_id: str) -> AsyncIterator[List[dict]]:
+    """Flattened rows of a dataset, newest first, TABLE_EXPORT_BATCH_SIZE at a time"""
+    spec = TABLE_EXPORTS[dataset]
+    children = await db.children.find({"user_id": user_id}, {"_id": 0, "child_id": 1, "name": 1}).to_list(1000)
+    child_names = {child["child_id"]: child["name"] for child in children}
+    projection = {"_id": 0, **{name: 1 for name, _ in spec["columns"]}, "children_involved": 1}
+    projection.pop("children", None)
+    if projection.pop("photo_count", None):
+        projection["photo_media.media_id"] = 1
+    
+    cursor = db[spec["collection"]].find({"user_id": user_id}, projection).sort(spec["sort"], -1)
+    batch = []
+    async for record in cursor.batch_size(TABLE_EXPORT_BATCH_SIZE):
+        batch.append(table_row(record, spec["columns"], child_names))
+        if len(batch) >= TABLE_EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_table_csv(dataset: str, user_id: str) -> AsyncIterator[bytes]:
+    names = [name for name, _ in TABLE_EXPORTS[dataset]["columns"]]
+    yield b"\xef\xbb\xbf"  # UTF-8 BOM so spreadsheet apps pick the right encoding
+    header = True
+    async for rows in table_batches(dataset, user_id):
+        yield await run_in_media_pool(render_csv_batch, rows, names, header)
+        header = False
+    if header:
+        yield await run_in_media_pool(render_csv_batch, [], names, True)
+
+async def stream_file_and_unlink(path: str) -> AsyncIterator[bytes]:
+    try:
+        handle = await asyncio.to_thread(open, path, "rb")
+        try:
+            while chunk := await asyncio.to_thread(handle.read, BLOB_CHUNK_SIZE):
+                yield chunk
+        finally:
+            handle.close()
+    finally:
+        await asyncio.to_thread(os.unlink, path)
+
+async def build_table_parquet(dataset: str, user_id: str) -> str:
+    """Spool the rows as NDJSON, then convert them in the media pool; returns the Parquet path"""
+    async def lines():
+        async for rows in table_batches(dataset, user_id):
+            yield b"".join(json.dumps(row, default=str).encode("utf-8") + b"\n" for row in rows)
+    
+    source = await spool_to_tempfile(lines())
+    destination = await asyncio.to_thread(lambda: tempfile.NamedTemporaryFile(suffix=".parquet", delete=False).name)
+    try:
+        await run_in_media_pool(render_parquet_table, source, destination, TABLE_EXPORTS[dataset]["columns"])
+    except BaseException:
+        await asyncio.to_thread(os.unlink, destination)
+        raise
+    finally:
+        await asyncio.to_thread(os.unlink, source)
+    return destination
+
+@api_router.get("/export/tables/{dataset}")
+async def export_table(dataset: str, format: str = "csv", current_user: dict = Depends(get_current_user)):
+    """journals, violations or calendar as flat CSV (streamed) or typed Parquet, for
+    spreadsheets and pandas. Children appear by name; photos are not included."""
+    if dataset not in TABLE_EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    filename = f"{dataset}-export-{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.{format}"
+    headers = {"Content-Disposition": content_disposition("attachment", filename), "Cache-Control": "no-store"}
+    
+    if format == "csv":
+        return StreamingResponse(
+            stream_table_csv(dataset, current_user["user_id"]),
+            media_type="text/csv; charset=utf-8",
+            headers=headers
+        )
+    if format == "parquet":
+        path = await build_table_parquet(dataset, current_user["user_id"])
+        headers["Content-Length"] = str(os.path.getsize(path))
+        return StreamingResponse(
+            stream_file_and_unlink(path),
+            media_type="application/vnd.apache.parquet",
+            headers=headers
+        )
+    raise HTTPException(status_code=400, detail="format must be csv or parquet")
+
+# ============== EXHIBIT PACKETS ==============
+
+def render_jpeg_thumbnail(data: bytes, max_dimension: int, quality: int) -> tuple:
+    """(jpeg, width, height) for embedding in a PDF; transparency is flattened onto white.
+
+    Runs in the media pool.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel("A"))
+            image = flattened
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+        return output.getvalue(), image.width, image.height
+
+@functools.lru_cache(maxsize=None)
+def font_codepoints(path: str) -> frozenset:
+    """Code points a TrueType font has glyphs for (cached per worker process)"""
+    with TTFont(path, lazy=True) as font:
+        return frozenset(font.getBestCmap())
+
+def exhibit_fonts() -> List[str]:
+    """Regular, bold, then fallback font files, in the order they are registered"""
+    return [EXHIBIT_FONT_PATH, EXHIBIT_BOLD_FONT_PATH, *EXHIBIT_FALLBACK_FONT_PATHS]
+
+def drawable_codepoints() -> frozenset:
+    regular, bold, *fallbacks = exhibit_fonts()
+    covered = font_codepoints(regular) & font_codepoints(bold)
+    for path in fallbacks:
+        covered |= font_codepoints(path)
+    return covered
+
+def printable_text(text: str, covered: frozenset) -> tuple:
+    """(text, substitutions): characters no configured font can draw are written as
+    [U+XXXX] so the exhibit still records exactly what was entered"""
+    output = []
+    substitutions = 0
+    for char in text or "":
+        if char in "\n\t" or ord(char) in covered:
+            output.append(char)
+        else:
+            output.append(f"[U+{ord(char):04X}]")
+            substitutions += 1
+    return "".join(output), substitutions
+
+class ExhibitPacketPdf(FPDF):
+    """US Letter pages with a title / "Page i of N" / Bates number footer"""
+    
+    MARGIN = 54
+    BOTTOM = 72  # Body text stops here; the footer sits below
+    TOC_HEADER = 150  # Cover block above the first contents line
+    TOC_LINE = 14
     
-    return {"violations": violations, "exported_at": datetime.now(timezone.utc).isoformat()}
+    def __init__(self, title: str, bates_prefix: str, bates_start: int):
+        super().__init__(orientation="P", unit="pt", format="letter")
+        self.packet_title = title
+        self.bates_prefix = bates_prefix
+        self.bates_start = bates_start
+        self.set_margins(self.MARGIN, self.MARGIN, self.MARGIN)
+        self.set_auto_page_break(True, margin=self.BOTTOM)
+        regular, bold, *fallbacks = exhibit_fonts()
+        self.add_font("ExhibitSans", "", regular)
+        self.add_font("ExhibitSans", "B", bold)
+        for index, path in enumerate(fallbacks):
+            self.add_font(f"ExhibitFallback{index}", "", path)
+        if fallbacks:
+            self.set_fallback_fonts([f"ExhibitFallback{i}" for i in range(len(fallbacks))], exact_match=False)
+    
+    def bates(self, page: int) -> str:
+        return f"{self.bates_prefix}{self.bates_start + page - 1:06d}"
+    
+    def footer(self):
+        self.set_y(-self.MARGIN + 8)
+        self.set_text_color(113, 128, 150)
+        self.set_font("ExhibitSans", size=8)
+        self.cell(0, 10, self.packet_title[:60], align="L")
+        self.set_x(self.l_margin)
+        self.cell(0, 10, f"Page {self.page_no()} of {{nb}}", align="C")
+        self.set_x(self.l_margin)
+        self.set_text_color(0, 0, 0)
+        self.set_font("ExhibitSans", "B", 9)
+        self.cell(0, 10, self.bates(self.page_no()), align="R")
+    
+    @classmethod
+    def toc_pages(cls, entries: int) -> int:
+        """Pages the cover and contents take; fixed before the body is laid out so the
+        Bates number drawn in each footer never shifts"""
+        usable = 792 - cls.MARGIN - cls.BOTTOM
+        first = int((usable - cls.TOC_HEADER) // cls.TOC_LINE)
+        rest = int(usable // cls.TOC_LINE)
+        return 1 + max(0, -(-(entries - first) // rest))
+    
+    def heading(self, text: str, size: float, bold: bool = True, gray: bool = False) -> None:
+        self.set_font("ExhibitSans", "B" if bold else "", size)
+        self.set_text_color(*((113, 128, 150) if gray else (26, 32, 44)))
+        self.multi_cell(0, size * 1.35, text, align="L", new_x="LMARGIN", new_y="NEXT")
+    
+    def paragraph(self, text: str, size: float = 10) -> None:
+        self.set_font("ExhibitSans", "", size)
+        self.set_text_color(26, 32, 44)
+        self.multi_cell(0, size * 1.4, text, align="L", new_x="LMARGIN", new_y="NEXT")
+    
+    def rule(self) -> None:
+        self.ln(4)
+        self.set_draw_color(204, 214, 224)
+        self.line(self.l_margin, self.get_y(), self.w - self.r_margin, self.get_y())
+        self.ln(6)
+    
+    def photo_grid(self, photos: List[tuple], box: float, columns: int) -> None:
+        """Thumbnails fitted into box x box cells, wrapping onto new pages"""
+        gap = (self.epw - columns * box) / max(columns - 1, 1)
+        for row_start in range(0, len(photos), columns):
+            if self.get_y() + box > self.page_break_trigger:
+                self.add_page()
+            top = self.get_y()
+            for column, (jpeg, width, height) in enumerate(photos[row_start:row_start + columns]):
+                scale = min(box / width, box / height)
+                w, h = width * scale, height * scale
+                x = self.l_margin + column * (box + gap) + (box - w) / 2
+                self.image(io.BytesIO(jpeg), x=x, y=top + (box - h), w=w, h=h)
+            self.set_y(top + box + 8)
+    
+    def contents(self, outline: list) -> None:
+        """Cover and table of contents, drawn once every exhibit's page is known"""
+        self.set_y(self.MARGIN + 24)
+        self.set_font("ExhibitSans", "B", 20)
+        self.set_text_color(26, 32, 44)
+        self.cell(0, 28, self.fit(self.packet_title, self.epw), new_x="LMARGIN", new_y="NEXT")
+        self.set_font("ExhibitSans", "", 10)
+        self.set_text_color(113, 128, 150)
+        for line in self.cover_lines + [
+            f"Bates range: {self.bates(1)} - {self.bates(self.pages_count)} ({self.pages_count} pages)"
+        ]:
+            self.cell(0, 14, self.fit(line, self.epw), new_x="LMARGIN", new_y="NEXT")
+        self.ln(12)
+        self.set_font("ExhibitSans", "B", 13)
+        self.set_text_color(26, 32, 44)
+        self.cell(0, 18, "Table of Contents", new_x="LMARGIN", new_y="NEXT")
+        self.rule()
+        self.set_y(self.MARGIN + self.TOC_HEADER)
+        for section in outline:
+            if self.get_y() + self.TOC_LINE > self.page_break_trigger:
+                self.add_page()
+                self.set_y(self.MARGIN)
+            reference = f"p. {section.page_number}   {self.bates(section.page_number)}"
+            self.set_font("ExhibitSans", "", 10)
+            reference_width = self.get_string_width(reference)
+            self.set_text_color(26, 32, 44)
+            self.cell(
+                self.epw - reference_width - 12, self.TOC_LINE,
+                self.fit(section.name, self.epw - reference_width - 12), link=self.add_link(page=section.page_number)
+            )
+            self.set_text_color(113, 128, 150)
+            self.cell(reference_width + 12, self.TOC_LINE, reference, align="R", new_x="LMARGIN", new_y="NEXT")
+    
+    def fit(self, text: str, width: float) -> str:
+        """Shortened with an ellipsis to stay on one line"""
+        if self.get_string_width(text) <= width:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.get_string_width(text[:middle] + "...") <= width:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low] + "..."
+
+def render_exhibit_packet(packet: dict) -> dict:
+    """Cover page with table of contents, then one exhibit per record starting on
+    its own page; every page carries a Bates number. Runs in the media pool.
+
+    Returns the PDF bytes and how many characters had to be written as [U+XXXX]
+    because none of the configured fonts can draw them.
+    """
+    covered = drawable_codepoints()
+    substituted = 0
+    
+    def text(value: str) -> str:
+        nonlocal substituted
+        value, count = printable_text(value, covered)
+        substituted += count
+        return value
+    
+    pdf = ExhibitPacketPdf(text(packet["title"]), packet["bates_prefix"], packet["bates_start"])
+    pdf.set_title(pdf.packet_title)
+    pdf.set_author(text(packet["prepared_by"]))
+    pdf.set_creator("CustodyKeeper")
+    pdf.cover_lines = [f"Prepared by: {text(packet['prepared_by'])}", f"Generated: {packet['generated_at']}"]
+    pdf.add_page()
+    pdf.insert_toc_placeholder(
+        ExhibitPacketPdf.contents,
+        pages=ExhibitPacketPdf.toc_pages(len(packet["exhibits"])),
+        reset_page_indices=False
+    )
+    
+    for number, exhibit in enumerate(packet["exhibits"], start=1):
+        before = substituted
+        title = text(exhibit["title"])
+        meta = [(label, text(value)) for label, value in exhibit["meta"] if value]
+        sections = [(heading, text(body)) for heading, body in exhibit["sections"] if body]
+        if number > 1:  # The contents placeholder already broke onto a fresh page for the first
+            pdf.add_page()
+        pdf.start_section(f"Exhibit {number}. {exhibit['date_label']}  {title}")
+        pdf.heading(f"EXHIBIT {number}", 9, gray=True)
+        pdf.heading(title, 16)
+        pdf.heading(exhibit["kind"], 10, bold=False, gray=True)
+        pdf.rule()
+        if substituted > before:
+            pdf.heading(
+                f"Note: {substituted - before} character(s) in this exhibit cannot be drawn with the "
+                "installed fonts and are shown as [U+XXXX] code points.", 9, bold=False, gray=True
+            )
+            pdf.ln(4)
+        for label, value in meta:
+            pdf.paragraph(f"{label}: {value}")
+        for heading, body in sections:
+            pdf.ln(6)
+            pdf.heading(heading, 11)
+            pdf.paragraph(body)
+        if exhibit["photos"]:
+            pdf.ln(6)
+            pdf.heading(f"Photos ({len(exhibit['photos'])})", 11)
+            pdf.photo_grid(exhibit["photos"], EXHIBIT_THUMBNAIL_POINTS, 3)
+    
+    return {"pdf": bytes(pdf.output()), "substituted": substituted}
+
+def exhibit_date_label(value: str) -> str:
+    try:
+        return datetime.fromisoformat(value[:10]).strftime("%B %d, %Y").replace(" 0", " ")
+    except (ValueError, TypeError):
+        return value or ""
+
+async def collect_exhibits(user_id: str, packet_request: ExhibitPacketRequest) -> List[dict]:
+    """Selected journals, violations and events as render-ready exhibits in date order.
+
+    Photos are listed as media records here; their bytes are only read on a cache miss.
+    """
+    children = await db.children.find({"user_id": user_id}, {"_id": 0, "child_id": 1, "name": 1}).to_list(1000)
+    child_names = {child["child_id"]: child["name"] for child in children}
+    
+    def names(ids: List[str]) -> str:
+        return ", ".join(child_names.get(child_id, "Unknown") for child_id in ids or [])
+    
+    exhibits = []
+    if packet_request.journal_ids:
+        async for journal in db.journals.find(
+            {"user_id": user_id, "journal_id": {"$in": packet_request.journal_ids}}, {"_id": 0, "photos": 0}
+        ):
+            photos = []
+            refs = [ref["media_id"] for ref in journal.get("photo_media", [])]
+            if refs and packet_request.include_photos:
+                media = {
+                    m["media_id"]: m async for m in db.media.find({"media_id": {"$in": refs}}, {"_id": 0})
+                }
+                photos = [media[media_id] for media_id in refs if media_id in media]
+            exhibits.append({
+                "kind": "Journal Entry",
+                "record_id": journal["journal_id"],
+                "title": journal.get("title", ""),
+                "date": journal.get("date", ""),
+                "meta": [
+                    ("Date", exhibit_date_label(journal.get("date", ""))),
+                    ("Children", names(journal.get("children_involved"))),
+                    ("Mood", journal.get("mood", "")),
+                    ("Location", journal.get("location", ""))
+                ],
+                "sections": [("Entry", journal.get("content", ""))],
+                "photos": photos
+            })
+    if packet_request.violation_ids:
+        async for violation in db.violations.find(
+            {"user_id": user_id, "violation_id": {"$in": packet_request.violation_ids}}, {"_id": 0}
+        ):
+            exhibits.append({
+                "kind": "Violation Record",
+                "record_id": violation["violation_id"],
+                "title": violation.get("title", ""),
+                "date": violation.get("date", ""),
+                "meta": [
+                    ("Date", exhibit_date_label(violation.get("date", ""))),
+                    ("Type", violation.get("violation_type", "").replace("_", " ").title()),
+                    ("Severity", violation.get("severity", "").title()),
+                    ("Witnesses", violation.get("witnesses", ""))
+                ],
+                "sections": [
+                    ("Description", violation.get("description", "")),
+                    ("Evidence Notes", violation.get("evidence_notes", ""))
+                ],
+                "photos": []
+            })
+    if packet_request.event_ids:
+        async for event in db.calendar_events.find(
+            {"user_id": user_id, "event_id": {"$in": packet_request.event_ids}}, {"_id": 0}
+        ):
+            exhibits.append({
+                "kind": "Calendar Event",
+                "record_id": event["event_id"],
+                "title": event.get("title", ""),
+                "date": event.get("start_date", ""),
+                "meta": [
+                    ("Starts", event.get("start_date", "").replace("T", " ")),
+                    ("Ends", event.get("end_date", "").replace("T", " ")),
+                    ("Type", event.get("event_type", "").replace("_", " ").title()),
+                    ("Children", names(event.get("children_involved"))),
+                    ("Location", event.get("location", ""))
+                ],
+                "sections": [("Notes", event.get("notes", ""))],
+                "photos": []
+            })
+    for exhibit in exhibits:
+        exhibit["date_label"] = exhibit_date_label(exhibit["date"])
+    exhibits.sort(key=lambda exhibit: (exhibit["date"], exhibit["kind"], exhibit["record_id"]))
+    return exhibits
+
+def exhibit_cache_key(user_id: str, packet: dict) -> str:
+    """Hash of everything that affects the rendered bytes (photos by content hash)"""
+    fingerprint = {
+        **packet,
+        "version": EXHIBIT_RENDER_VERSION,
+        "fonts": exhibit_fonts(),
+        "user_id": user_id,
+        "exhibits": [
+            {**exhibit, "photos": [photo["content_hash"] for photo in exhibit["photos"]]}
+            for exhibit in packet["exhibits"]
+        ]
+    }
+    digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"exhibits/{digest}.pdf"
+
+_exhibit_inflight: Dict[str, asyncio.Future] = {}
+
+async def ensure_exhibit_packet(user_id: str, packet: dict) -> dict:
+    """Cached packet for these exact inputs, rendered in the media pool on a miss"""
+    key = exhibit_cache_key(user_id, packet)
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=EXHIBIT_CACHE_TTL_SECONDS)
+    record = await db.exhibit_packets.find_one_and_update(
+        {"_id": key}, {"$set": {"expires_at": expires_at}}, return_document=ReturnDocument.AFTER
+    )
+    if record:
+        return record
+    if key not in _exhibit_inflight:
+        async def render():
+            try:
+                exhibits = []
+                for exhibit in packet["exhibits"]:
+                    photos = []
+                    for media in exhibit["photos"]:
+                        try:
+                            photos.append(await run_in_media_pool(
+                                render_jpeg_thumbnail, await read_media_bytes(media),
+                                EXHIBIT_THUMBNAIL_PX, IMAGE_VARIANT_QUALITY
+                            ))
+                        except BlobNotFound:
+                            logger.warning(f"Exhibit photo {media['media_id']} is missing")
+                    exhibits.append({**exhibit, "photos": photos})
+                rendered = await run_in_media_pool(render_exhibit_packet, {**packet, "exhibits": exhibits})
+                pdf = rendered["pdf"]
+                await blob_store.put(key, iter_bytes(pdf), "application/pdf")
+                packet_record = {
+                    "_id": key,
+                    "user_id": user_id,
+                    "blob_store": blob_store.name,
+                    "size": len(pdf),
+                    "substituted_characters": rendered["substituted"],
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "expires_at": expires_at
+                }
+                await db.exhibit_packets.replace_one({"_id": key}, packet_record, upsert=True)
+                return packet_record
+            finally:
+                _exhibit_inflight.pop(key, None)
+        _exhibit_inflight[key] = asyncio.ensure_future(render())
+    return await asyncio.shield(_exhibit_inflight[key])
+
+@api_router.post("/exhibits/packet")
+async def create_exhibit_packet(
+    packet_request: ExhibitPacketRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Court exhibit bundle (PDF) for the selected records: table of contents, one
+    exhibit per record in date order, photo thumbnails and Bates-numbered pages.
+
+    Identical inputs are served from the cache without re-rendering.
+    """
+    selected = len(packet_request.journal_ids) + len(packet_request.violation_ids) + len(packet_request.event_ids)
+    if selected == 0:
+        raise HTTPException(status_code=400, detail="Select at least one record")
+    if selected > EXHIBIT_MAX_RECORDS:
+        raise HTTPException(status_code=400, detail=f"At most {EXHIBIT_MAX_RECORDS} records per packet")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{0,12}", packet_request.bates_prefix) or packet_request.bates_start < 0:
+        raise HTTPException(status_code=400, detail="Invalid Bates numbering")
+    
+    exhibits = await collect_exhibits(current_user["user_id"], packet_request)
+    if not exhibits:
+        raise HTTPException(status_code=404, detail="None of the selected records were found")
+    missing_fonts = [path for path in exhibit_fonts() if not os.path.isfile(path)]
+    if missing_fonts:
+        logger.error(f"Exhibit fonts not found: {', '.join(missing_fonts)}")
+        raise HTTPException(status_code=503, detail="Exhibit packets are unavailable on this server")
+    packet = {
+        "title": packet_request.title or "Exhibit Packet",
+        "prepared_by": current_user.get("full_name", ""),
+        "bates_prefix": packet_request.bates_prefix,
+        "bates_start": packet_request.bates_start,
+        # Day granularity and part of the cache key, so a cached cover never shows a stale date
+        "generated_at": datetime.now(timezone.utc).strftime("%B %d, %Y"),
+        "exhibits": exhibits
+    }
+    record = await ensure_exhibit_packet(current_user["user_id"], packet)
+    store = get_blob_store(record["blob_store"])
+    filename = f"{export_name(packet['title'])}-{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.pdf"
+    try:
+        response = await file_stream_response(
+            request,
+            lambda start, length: store.open(record["_id"], start, length),
+            size=record["size"],
+            etag=f'"{record["_id"].split("/")[-1][:-4]}"',
+            content_type="application/pdf",
+            filename=filename,
+            disposition="attachment",
+            cache_control="private, no-store"
+        )
+    except BlobNotFound:
+        await db.exhibit_packets.delete_one({"_id": record["_id"]})
+        raise HTTPException(status_code=503, detail="Packet cache was cleared; please retry")
+    # Characters no configured font could draw are printed as [U+XXXX]; the client warns about them
+    response.headers["X-Exhibit-Substituted-Characters"] = str(record.get("substituted_characters", 0))
+    return response
 
 # ============== SHARING ROUTES ==============
 
+def share_token_response(token: dict) -> ShareTokenResponse:
+    """expires_at is stored as a BSON datetime for the TTL index; the API keeps ISO strings"""
+    expires_at = token["expires_at"]
+    if isinstance(expires_at, datetime):
+        token = {**token, "expires_at": expires_at.isoformat()}
+    if "permission_level" not in token:
+        token["permission_level"] = "read_only"
+    return ShareTokenResponse(**token)
+
 @api_router.post("/share/tokens", response_model=ShareTokenResponse)
 async def create_share_token(token_data: ShareTokenCreate, current_user: dict = Depends(get_current_user)):
     token_id = str(uuid.uuid4())
     share_token = secrets.token_urlsafe(32)
     now = datetime.now(timezone.utc)
-    expires_at = (now + timedelta(days=token_data.expires_days)).isoformat()
+    expires_at = now + timedelta(days=token_data.expires_days)
     
     token_doc = {
         "token_id": token_id,
@@ -1474,7 +4659,7 @@ async def create_share_token(token_data: ShareTokenCreate, current_user: dict =
     
     await db.share_tokens.insert_one(token_doc)
     
-    return ShareTokenResponse(**token_doc)
+    return share_token_response(token_doc)
 
 @api_router.get("/share/tokens", response_model=List[ShareTokenResponse])
 async def get_share_tokens(current_user: dict = Depends(get_current_user)):
@@ -1482,11 +4667,7 @@ async def get_share_tokens(current_user: dict = Depends(get_current_user)):
         {"user_id": current_user["user_id"]},
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
-    # Add default permission_level for old tokens
-    for token in tokens:
-        if "permission_level" not in token:
-            token["permission_level"] = "read_only"
-    return [ShareTokenResponse(**token) for token in tokens]
+    return [share_token_response(token) for token in tokens]
 
 @api_router.delete("/share/tokens/{token_id}")
 async def revoke_share_token(token_id: str, current_user: dict = Depends(get_current_user)):
@@ -1494,78 +4675,121 @@ async def revoke_share_token(token_id: str, current_user: dict = Depends(get_cur
         {"token_id": token_id, "user_id": current_user["user_id"]},
         {"$set": {"is_active": False}}
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Token not found")
-    return {"message": "Share token revoked"}
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Token not found")
+    return {"message": "Share token revoked"}
+
+# Sections of the public shared view: the token flag that enables each (None = always
+# included), its collection and sort, and the fields the view shows
+SHARED_SECTIONS = {
+    "children": {
+        "flag": None,
+        "collection": "children",
+        "sort": None,
+        "fields": ["child_id", "name", "color"]
+    },
+    "journals": {
+        "flag": "include_journals",
+        "collection": "journals",
+        "sort": ("date", -1),
+        "fields": [
+            "journal_id", "user_id", "title", "content", "entry", "date", "children_involved",
+            "mood", "location", "photo_media", "created_at", "updated_at"
+        ]
+    },
+    "violations": {
+        "flag": "include_violations",
+        "collection": "violations",
+        "sort": ("date", -1),
+        "fields": [
+            "violation_id", "user_id", "title", "description", "date", "violation_type",
+            "severity", "witnesses", "evidence_notes", "created_at"
+        ]
+    },
+    "documents": {
+        "flag": "include_documents",
+        "collection": "documents",
+        "sort": ("created_at", -1),
+        "fields": [
+            "document_id", "user_id", "filename", "file_type", "file_size", "category",
+            "description", "created_at", "metadata", "metadata_status"
+        ]
+    },
+    "events": {
+        "flag": "include_calendar",
+        "collection": "calendar_events",
+        "sort": ("start_date", 1),
+        "fields": [
+            "event_id", "user_id", "title", "start_date", "end_date", "event_type",
+            "children_involved", "notes", "location", "recurring", "recurrence_pattern",
+            "recurrence_end_date", "custom_color", "created_at", "exception_dates", "parent_event_id"
+        ]
+    }
+}
+
+async def load_shared_section(user_id: str, key: str) -> list:
+    spec = SHARED_SECTIONS[key]
+    cursor = db[spec["collection"]].find(
+        {"user_id": user_id},
+        {"_id": 0, **{field: 1 for field in spec["fields"]}},
+        max_time_ms=int(SHARED_VIEW_TIMEOUT_SECONDS * 1000)
+    )
+    if spec["sort"]:
+        cursor = cursor.sort(*spec["sort"])
+    rows = await cursor.to_list(SHARED_VIEW_LIMIT)
+    if key == "journals":
+        return [journal_response(journal).model_dump() for journal in rows]
+    if key == "events":
+        for event in rows:
+            event.setdefault("custom_color", "")
+            event.setdefault("recurrence_pattern", "")
+            event.setdefault("recurrence_end_date", "")
+    return rows
+
+async def shared_section_or_none(user_id: str, key: str) -> Optional[list]:
+    """One section of a shared view, or None if it failed or exceeded its time budget"""
+    try:
+        return await asyncio.wait_for(load_shared_section(user_id, key), SHARED_VIEW_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"Shared view section {key} timed out for user {user_id}")
+    except Exception as e:
+        logger.error(f"Shared view section {key} failed for user {user_id}: {e}")
+    return None
 
 # Public shared view (no auth required)
 @api_router.get("/shared/{share_token}")
 async def get_shared_data(share_token: str):
+    """Everything the share token grants, with the sections read concurrently.
+
+    A section that fails or times out comes back empty and is listed under
+    "unavailable" so the rest of the view still loads.
+    """
     token = await db.share_tokens.find_one(
-        {"share_token": share_token, "is_active": True},
+        {
+            "share_token": share_token,
+            "is_active": True,
+            "expires_at": {"$gt": datetime.now(timezone.utc)}
+        },
         {"_id": 0}
     )
     
     if not token:
         raise HTTPException(status_code=404, detail="Invalid or expired share link")
     
-    # Check if token has expired
-    expires_at = datetime.fromisoformat(token["expires_at"].replace('Z', '+00:00'))
-    if datetime.now(timezone.utc) > expires_at:
-        raise HTTPException(status_code=410, detail="Share link has expired")
-    
     user_id = token["user_id"]
-    permission_level = token.get("permission_level", "read_only")
     data = {
         "shared_by": token["name"], 
-        "expires_at": token["expires_at"],
-        "permission_level": permission_level
+        "expires_at": token["expires_at"].isoformat(),
+        "permission_level": token.get("permission_level", "read_only"),
+        "unavailable": []
     }
     
-    # Get user's children for reference
-    children = await db.children.find(
-        {"user_id": user_id},
-        {"_id": 0, "child_id": 1, "name": 1, "color": 1}
-    ).to_list(100)
-    data["children"] = children
-    
-    if token.get("include_journals"):
-        journals = await db.journals.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).sort("date", -1).to_list(500)
-        for j in journals:
-            if "photos" not in j:
-                j["photos"] = []
-        data["journals"] = journals
-    
-    if token.get("include_violations"):
-        violations = await db.violations.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).sort("date", -1).to_list(500)
-        data["violations"] = violations
-    
-    if token.get("include_documents"):
-        documents = await db.documents.find(
-            {"user_id": user_id},
-            {"_id": 0, "file_data": 0}  # Exclude binary data
-        ).sort("uploaded_at", -1).to_list(500)
-        data["documents"] = documents
-    
-    if token.get("include_calendar"):
-        events = await db.calendar_events.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).sort("start_date", 1).to_list(500)
-        for e in events:
-            if "custom_color" not in e:
-                e["custom_color"] = ""
-            if "recurrence_pattern" not in e:
-                e["recurrence_pattern"] = ""
-            if "recurrence_end_date" not in e:
-                e["recurrence_end_date"] = ""
-        data["events"] = events
+    keys = [key for key, spec in SHARED_SECTIONS.items() if spec["flag"] is None or token.get(spec["flag"])]
+    sections = await asyncio.gather(*(shared_section_or_none(user_id, key) for key in keys))
+    for key, rows in zip(keys, sections):
+        if rows is None:
+            data["unavailable"].append(key)
+        data[key] = rows or []
     
     return data
 
@@ -1577,61 +4801,94 @@ class TwoFactorSetup(BaseModel):
 class TwoFactorVerify(BaseModel):
     code: str
 
+def legacy_two_factor(settings: dict) -> dict:
+    """users.two_factor built from a two_factor_settings row"""
+    return {
+        "enabled": settings.get("enabled", False),
+        "verified_devices": settings.get("verified_devices", []),
+        "updated_at": settings.get("updated_at", datetime.now(timezone.utc).isoformat())
+    }
+
+async def user_two_factor(user: dict) -> dict:
+    """The user's 2FA settings.
+
+    Migration 0001 runs in one worker while the others already serve traffic, and
+    is only retried on the next startup if it fails, so a user may still have
+    their settings in two_factor_settings. Those are folded in here on first use
+    rather than treated as "2FA disabled".
+    """
+    if "two_factor" in user:
+        return user["two_factor"] or {}
+    settings = await db.two_factor_settings.find_one({"user_id": user["user_id"]}, {"_id": 0})
+    if not settings:
+        return {}
+    two_factor = legacy_two_factor(settings)
+    await db.users.update_one(
+        {"user_id": user["user_id"], "two_factor": {"$exists": False}},
+        {"$set": {"two_factor": two_factor}}
+    )
+    invalidate_user_cache(user["user_id"])
+    return two_factor
+
 @api_router.get("/auth/2fa/status")
 async def get_2fa_status(current_user: dict = Depends(get_current_user)):
     """Get user's 2FA status"""
-    settings = await db.two_factor_settings.find_one(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0}
-    )
+    settings = await user_two_factor(current_user)
     return {
-        "enabled": settings.get("enabled", False) if settings else False,
-        "verified_devices": settings.get("verified_devices", []) if settings else []
+        "enabled": settings.get("enabled", False),
+        "verified_devices": settings.get("verified_devices", [])
     }
 
 @api_router.post("/auth/2fa/enable")
 async def enable_2fa(current_user: dict = Depends(get_current_user)):
     """Enable 2FA for user"""
-    await db.two_factor_settings.update_one(
+    await user_two_factor(current_user)  # Keep verified devices from a legacy row
+    await db.users.update_one(
         {"user_id": current_user["user_id"]},
         {"$set": {
-            "user_id": current_user["user_id"],
-            "enabled": True,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }},
-        upsert=True
+            "two_factor.enabled": True,
+            "two_factor.updated_at": datetime.now(timezone.utc).isoformat()
+        }}
     )
+    invalidate_user_cache(current_user["user_id"])
     return {"status": "success", "message": "Two-factor authentication enabled"}
 
 @api_router.post("/auth/2fa/disable")
 async def disable_2fa(current_user: dict = Depends(get_current_user)):
     """Disable 2FA for user"""
-    await db.two_factor_settings.update_one(
+    await user_two_factor(current_user)
+    await db.users.update_one(
         {"user_id": current_user["user_id"]},
-        {"$set": {"enabled": False, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {
+            "two_factor.enabled": False,
+            "two_factor.updated_at": datetime.now(timezone.utc).isoformat()
+        }}
     )
+    invalidate_user_cache(current_user["user_id"])
     return {"status": "success", "message": "Two-factor authentication disabled"}
 
 @api_router.post("/auth/2fa/send-code")
-async def send_2fa_code(email: str = Form(...)):
+async def send_2fa_code(request: Request, email: str = Form(...)):
     """Send 2FA verification code to user's email"""
+    await enforce_rate_limit(request, "2fa_send", email)
+    
     try:
-        import resend
-        
-        # Find user
-        user = await db.users.find_one({"email": email}, {"_id": 0})
+        # Find user (2FA state is embedded, so this is normally the only lookup)
+        user = await db.users.find_one(
+            {"email": email},
+            {"_id": 0, "user_id": 1, "two_factor": 1}
+        )
         if not user:
             # Don't reveal if user exists
             return {"status": "success", "message": "If the email exists, a code has been sent"}
         
         # Check if 2FA is enabled
-        settings = await db.two_factor_settings.find_one({"user_id": user["user_id"]})
-        if not settings or not settings.get("enabled", False):
+        if not (await user_two_factor(user)).get("enabled", False):
             return {"status": "not_required", "message": "2FA not enabled for this account"}
         
         # Generate 6-digit code
         code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
-        expires_at = (datetime.now(timezone.utc) + timedelta(minutes=10)).isoformat()
+        expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
         
         # Store code
         await db.two_factor_codes.update_one(
@@ -1648,7 +4905,6 @@ async def send_2fa_code(email: str = Form(...)):
         # Send email
         resend_api_key = os.environ.get('RESEND_API_KEY')
         if resend_api_key:
-            resend.api_key = resend_api_key
             sender_email = os.environ.get('SENDER_EMAIL', 'onboarding@resend.dev')
             
             html_content = f"""
@@ -1665,7 +4921,7 @@ async def send_2fa_code(email: str = Form(...)):
             </div>
             """
             
-            await asyncio.to_thread(resend.Emails.send, {
+            await send_resend_email({
                 "from": sender_email,
                 "to": [email],
                 "subject": f"Your CustodyKeeper verification code: {code}",
@@ -1679,21 +4935,28 @@ async def send_2fa_code(email: str = Form(...)):
         return {"status": "success", "message": "If the email exists, a code has been sent"}
 
 @api_router.post("/auth/2fa/verify")
-async def verify_2fa_code(email: str = Form(...), code: str = Form(...), device_id: str = Form(default="")):
+async def verify_2fa_code(
+    request: Request,
+    email: str = Form(...),
+    code: str = Form(...),
+    device_id: str = Form(default="")
+):
     """Verify 2FA code and return token"""
-    user = await db.users.find_one({"email": email}, {"_id": 0})
+    await enforce_rate_limit(request, "2fa_verify", email)
+    
+    user = await db.users.find_one({"email": email}, {"_id": 0, "password_hash": 0})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    # Embed legacy settings first so a verified device is added to the full list
+    await user_two_factor(user)
     
-    # Get stored code
-    stored = await db.two_factor_codes.find_one({"user_id": user["user_id"]})
+    # Get stored code; expired codes are filtered out by the query
+    stored = await db.two_factor_codes.find_one({
+        "user_id": user["user_id"],
+        "expires_at": {"$gt": datetime.now(timezone.utc)}
+    })
     if not stored:
-        raise HTTPException(status_code=401, detail="No verification code found. Please request a new one.")
-    
-    # Check expiry
-    expires_at = datetime.fromisoformat(stored["expires_at"].replace('Z', '+00:00'))
-    if datetime.now(timezone.utc) > expires_at:
-        raise HTTPException(status_code=401, detail="Verification code expired. Please request a new one.")
+        raise HTTPException(status_code=401, detail="Verification code expired or not found. Please request a new one.")
     
     # Verify code
     if stored["code"] != code:
@@ -1701,13 +4964,15 @@ async def verify_2fa_code(email: str = Form(...), code: str = Form(...), device_
     
     # Delete used code
     await db.two_factor_codes.delete_one({"user_id": user["user_id"]})
+    await clear_email_rate_limit("2fa_verify", email)
     
     # Optionally store device as verified
     if device_id:
-        await db.two_factor_settings.update_one(
+        await db.users.update_one(
             {"user_id": user["user_id"]},
-            {"$addToSet": {"verified_devices": device_id}}
+            {"$addToSet": {"two_factor.verified_devices": device_id}}
         )
+        invalidate_user_cache(user["user_id"])
     
     # Generate token
     token = create_token(user["user_id"], user["email"])
@@ -1719,7 +4984,7 @@ async def verify_2fa_code(email: str = Form(...), code: str = Form(...), device_
             "email": user["email"],
             "full_name": user["full_name"],
             "state": user.get("state", ""),
-            "photo": user.get("photo", ""),
+            **avatar_fields(user),
             "created_at": user.get("created_at", "")
         }
     }
@@ -1727,154 +4992,595 @@ async def verify_2fa_code(email: str = Form(...), code: str = Form(...), device_
 
 # ============== EXPORT ALL DATA ==============
 
-@api_router.get("/export/all")
-async def export_all_data(current_user: dict = Depends(get_current_user)):
-    """
-    Export all user data as a ZIP archive containing:
-    - account.json: User profile information
-    - children.json: Children profiles
-    - journals.json: All journal entries
-    - violations.json: All violation records
-    - calendar.json: All calendar events
-    - contacts.json: All contacts
-    - documents/: All uploaded documents
-    """
-    try:
-        user_id = current_user["user_id"]
-        
-        # Create in-memory ZIP file
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # 1. Account Information
-            account_data = {
-                "full_name": current_user.get("full_name", ""),
-                "email": current_user.get("email", ""),
-                "state": current_user.get("state", ""),
-                "created_at": current_user.get("created_at", ""),
-                "exported_at": datetime.now(timezone.utc).isoformat()
-            }
-            zip_file.writestr("account.json", json.dumps(account_data, indent=2))
-            
-            # 2. Children
-            children = await db.children.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).to_list(100)
-            # Remove photo data to reduce size, keep reference
-            for child in children:
-                if child.get("photo"):
-                    child["has_photo"] = True
-                    child["photo"] = "[Photo data exported separately]"
-            zip_file.writestr("children.json", json.dumps(children, indent=2))
-            
-            # 3. Journals
-            journals = await db.journals.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).sort("date", -1).to_list(10000)
-            # Handle photos
-            for journal in journals:
-                if journal.get("photos"):
-                    journal["photo_count"] = len(journal["photos"])
-                    journal["photos"] = "[Photo data included in documents folder]"
-            zip_file.writestr("journals.json", json.dumps(journals, indent=2))
-            
-            # 4. Violations
-            violations = await db.violations.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).sort("date", -1).to_list(10000)
-            zip_file.writestr("violations.json", json.dumps(violations, indent=2))
-            
-            # 5. Calendar Events
-            events = await db.calendar_events.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).sort("start_date", -1).to_list(10000)
-            zip_file.writestr("calendar.json", json.dumps(events, indent=2))
-            
-            # 6. Contacts
-            contacts = await db.contacts.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).to_list(1000)
-            for contact in contacts:
-                if contact.get("photo"):
-                    contact["has_photo"] = True
-                    contact["photo"] = "[Photo data]"
-            zip_file.writestr("contacts.json", json.dumps(contacts, indent=2))
-            
-            # 7. Documents (metadata + files)
-            documents = await db.documents.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).to_list(1000)
-            
-            doc_index = []
-            for i, doc in enumerate(documents):
-                doc_entry = {
-                    "document_id": doc.get("document_id", ""),
-                    "name": doc.get("name", ""),
-                    "category": doc.get("category", ""),
-                    "description": doc.get("description", ""),
-                    "uploaded_at": doc.get("uploaded_at", ""),
-                    "file_type": doc.get("file_type", ""),
-                    "file_size": doc.get("file_size", 0)
-                }
-                doc_index.append(doc_entry)
-                
-                # Include actual file content if available
-                if doc.get("content"):
-                    try:
-                        # Decode base64 content
-                        file_content = base64.b64decode(doc["content"])
-                        safe_name = doc.get("name", f"document_{i}").replace("/", "_").replace("\\", "_")
-                        zip_file.writestr(f"documents/{safe_name}", file_content)
-                    except Exception as e:
-                        logger.warning(f"Could not export document {doc.get('name')}: {str(e)}")
-            
-            zip_file.writestr("documents/index.json", json.dumps(doc_index, indent=2))
-            
-            # 8. Create a README
-            readme_content = f"""CustodyKeeper Data Export
+EXPORT_README = """CustodyKeeper Data Export
 ========================
 
-Exported: {datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")}
-User: {current_user.get("full_name", "Unknown")}
+Exported: {exported}
+User: {user}
 
 Contents:
 - account.json: Your profile information
 - children.json: Your children's profiles
 - journals.json: All journal entries
+- journal_photos/: Photos attached to journal entries
 - violations.json: All violation records
 - calendar.json: All calendar events
 - contacts.json: All case contacts
 - documents/: All uploaded documents
   - index.json: Document metadata
+- deletions.json: Records deleted since the previous export (delta exports only)
+- manifest.json: Export type, record counts and the watermark for the next delta export
+
+A delta export holds only what changed since an earlier export's watermark.
 
 This export contains all your CustodyKeeper data.
 Keep this file secure as it contains sensitive information.
 
 For questions, contact: custodykeeper.feedback@gmail.com
 """
-            zip_file.writestr("README.txt", readme_content)
+
+class ZipSink(io.RawIOBase):
+    """Write-only, unseekable target for zipfile.
+
+    zipfile falls back to data descriptors when it cannot seek back, so each member
+    is final once written and the bytes can be handed to the client straight away.
+    """
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._offset = 0
+        self.pending = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        self.pending += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._offset
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.pending = 0
+        return data
+
+class ExportArchive:
+    """A ZIP produced incrementally: every write method yields the archive bytes as they
+    accumulate, so memory stays bounded by EXPORT_FLUSH_SIZE rather than the account size"""
+    
+    def __init__(self):
+        self.sink = ZipSink()
+        self.zip = zipfile.ZipFile(self.sink, "w")
+        self.records = 0
+        self.counts: Dict[str, int] = {}  # Records per JSON member
+    
+    @property
+    def bytes_written(self) -> int:
+        return self.sink.tell()
+    
+    def _member(self, name: str, compress: bool = True, size: int = 0) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        # Without a seekable target zipfile must decide on ZIP64 before the data is written
+        info.file_size = size
+        return info
+    
+    def _flush(self, force: bool = False) -> bytes:
+        return self.sink.drain() if force or self.sink.pending >= EXPORT_FLUSH_SIZE else b""
+    
+    async def write_text(self, name: str, text: str) -> AsyncIterator[bytes]:
+        self.zip.writestr(self._member(name), text)
+        yield self._flush(force=True)
+    
+    async def write_json_array(self, name: str, records: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+        self.counts[name] = 0
+        with self.zip.open(self._member(name), "w") as member:
+            member.write(b"[")
+            separator = b"\n"
+            async for record in records:
+                member.write(separator + json.dumps(record, indent=2, default=str).encode("utf-8"))
+                separator = b",\n"
+                self.records += 1
+                self.counts[name] += 1
+                chunk = self._flush()
+                if chunk:
+                    yield chunk
+            member.write(b"\n]" if separator == b",\n" else b"]")
+        yield self._flush(force=True)
+    
+    async def write_file(
+        self,
+        name: str,
+        chunks: AsyncIterator[bytes],
+        size: int,
+        compress: bool
+    ) -> AsyncIterator[bytes]:
+        with self.zip.open(self._member(name, compress, size), "w") as member:
+            async for chunk in chunks:
+                if compress:
+                    await asyncio.to_thread(member.write, chunk)
+                else:
+                    member.write(chunk)
+                data = self._flush()
+                if data:
+                    yield data
+        self.records += 1
+        yield self._flush(force=True)
+    
+    async def close(self) -> AsyncIterator[bytes]:
+        self.zip.close()
+        yield self._flush(force=True)
+
+def export_name(name: str) -> str:
+    return name.replace("/", "_").replace("\\", "_")
+
+async def export_owner_records(collection, query: dict) -> AsyncIterator[dict]:
+    """Children/contacts with the avatar reduced to whether one exists"""
+    async for record in collection.find(query, {"_id": 0}):
+        record["has_photo"] = bool(record.pop("photo_media_id", None) or record.get("photo"))
+        record.pop("photo", None)
+        yield record
+
+async def export_journal_records(query: dict) -> AsyncIterator[dict]:
+    async for journal in db.journals.find(query, {"_id": 0, "photos": 0}).sort("date", -1):
+        refs = journal.pop("photo_media", [])
+        journal["photo_count"] = len(refs)
+        journal["photo_files"] = []
+        if refs:
+            async for media in db.media.find(
+                {"media_id": {"$in": [ref["media_id"] for ref in refs]}},
+                {"_id": 0, "media_id": 1, "content_type": 1}
+            ):
+                journal["photo_files"].append(journal_photo_name(media))
+        yield journal
+
+def journal_photo_name(media: dict) -> str:
+    return f"journal_photos/{media['media_id']}.{media['content_type'].split('/')[-1]}"
+
+def document_export_name(doc: dict) -> str:
+    name = export_name(doc.get("filename", doc.get("name", "")) or "document")
+    return f"documents/{doc.get('document_id', '')}_{name}"
+
+async def export_document_index(query: dict) -> AsyncIterator[dict]:
+    async for doc in db.documents.find(query, {"_id": 0, "file_data": 0, "metadata_lease": 0}):
+        yield {
+            "document_id": doc.get("document_id", ""),
+            "name": doc.get("filename", doc.get("name", "")),
+            "category": doc.get("category", ""),
+            "description": doc.get("description", ""),
+            "uploaded_at": doc.get("created_at", doc.get("uploaded_at", "")),
+            "updated_at": doc.get("updated_at", ""),
+            "file_type": doc.get("file_type", ""),
+            "file_size": doc.get("file_size", 0)
+        }
+
+def delta_lower_bound(watermark: str) -> str:
+    """updated_at bound for a delta export since watermark; rejects malformed or expired watermarks"""
+    try:
+        since = parse_iso_datetime(watermark)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid watermark")
+    now = datetime.now(timezone.utc)
+    if since > now:
+        raise HTTPException(status_code=400, detail="Watermark is in the future")
+    if since < now - timedelta(days=DELETION_RETENTION_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail="Watermark is older than the deletion history; run a full export instead"
+        )
+    return (since - timedelta(seconds=DELTA_EXPORT_OVERLAP_SECONDS)).astimezone(timezone.utc).isoformat()
+
+async def stream_export_archive(
+    current_user: dict,
+    archive: Optional[ExportArchive] = None,
+    since: Optional[str] = None,
+    exported_at: Optional[datetime] = None
+) -> AsyncIterator[bytes]:
+    """The account ZIP, built member by member from Mongo cursors.
+
+    With since (the watermark of an earlier export) only records created or updated
+    after it are included, plus deletions.json tombstones; manifest.json carries the
+    watermark for the next delta. Photos, audio, video and other already-compressed
+    files are stored rather than deflated. Pass an archive to watch its progress
+    counters while the stream is consumed.
+    """
+    user_id = current_user["user_id"]
+    archive = archive or ExportArchive()
+    exported_at = exported_at or datetime.now(timezone.utc)
+    bound = delta_lower_bound(since) if since else None
+    owned = {"user_id": user_id, **({"updated_at": {"$gte": bound}} if bound else {})}
+    
+    # Account and README go first so the download starts immediately
+    account_data = {
+        "full_name": current_user.get("full_name", ""),
+        "email": current_user.get("email", ""),
+        "state": current_user.get("state", ""),
+        "created_at": current_user.get("created_at", ""),
+        "exported_at": exported_at.isoformat()
+    }
+    async for chunk in archive.write_text("account.json", json.dumps(account_data, indent=2)):
+        yield chunk
+    readme = EXPORT_README.format(
+        exported=exported_at.strftime("%Y-%m-%d %H:%M:%S UTC"),
+        user=current_user.get("full_name", "Unknown")
+    )
+    async for chunk in archive.write_text("README.txt", readme):
+        yield chunk
+    
+    async for chunk in archive.write_json_array("children.json", export_owner_records(db.children, owned)):
+        yield chunk
+    
+    async for chunk in archive.write_json_array("journals.json", export_journal_records(owned)):
+        yield chunk
+    photos = {"user_id": user_id, "owner_type": "journal", **({"created_at": {"$gte": bound}} if bound else {})}
+    async for media in db.media.find(photos, {"_id": 0}):
+        try:
+            body = await _primed(open_stored_blob(media))
+        except BlobNotFound:
+            logger.warning(f"Could not export journal photo {media['media_id']}")
+            continue
+        async for chunk in archive.write_file(journal_photo_name(media), body, media["size"], compress=False):
+            yield chunk
+    
+    violations = db.violations.find(owned, {"_id": 0}).sort("date", -1)
+    async for chunk in archive.write_json_array("violations.json", violations):
+        yield chunk
+    events = db.calendar_events.find(owned, {"_id": 0}).sort("start_date", -1)
+    async for chunk in archive.write_json_array("calendar.json", events):
+        yield chunk
+    async for chunk in archive.write_json_array("contacts.json", export_owner_records(db.contacts, owned)):
+        yield chunk
+    
+    async for doc in db.documents.find(owned, {"_id": 0, "metadata_lease": 0}):
+        if not (doc.get("blob_key") or doc.get("file_data")):
+            continue
+        try:
+            body = await _primed(open_document_stream(doc)(0, None))
+        except Exception as e:
+            logger.warning(f"Could not export document {doc.get('filename', '')}: {str(e)}")
+            continue
+        # Text-like types are the ones stored compressed at rest; everything else is already packed
+        compress = doc.get("file_type", "") in COMPRESSION_CODECS
+        async for chunk in archive.write_file(document_export_name(doc), body, doc.get("file_size", 0), compress):
+            yield chunk
+    async for chunk in archive.write_json_array("documents/index.json", export_document_index(owned)):
+        yield chunk
+    
+    if bound:
+        deletions = db.deletions.find(
+            {"user_id": user_id, "deleted_at": {"$gte": bound}},
+            {"_id": 0, "collection": 1, "record_id": 1, "deleted_at": 1}
+        ).sort("deleted_at", 1)
+        async for chunk in archive.write_json_array("deletions.json", deletions):
+            yield chunk
+    
+    manifest = {
+        "type": "delta" if since else "full",
+        "since": since,
+        "watermark": exported_at.isoformat(),
+        "exported_at": exported_at.isoformat(),
+        "counts": archive.counts
+    }
+    async for chunk in archive.write_text("manifest.json", json.dumps(manifest, indent=2)):
+        yield chunk
+    
+    async for chunk in archive.close():
+        yield chunk
+
+def export_response(current_user: dict, since: Optional[str] = None) -> StreamingResponse:
+    exported_at = datetime.now(timezone.utc)
+    
+    async def body():
+        try:
+            async for chunk in stream_export_archive(current_user, since=since, exported_at=exported_at):
+                yield chunk
+        except Exception as e:
+            logger.error(f"Failed to export data: {str(e)}")
+            raise
+    
+    kind = "Delta" if since else "Export"
+    filename = f"CustodyKeeper_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        body(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-store",
+            "X-Export-Watermark": exported_at.isoformat()
+        }
+    )
+
+@api_router.get("/export/all")
+async def export_all_data(current_user: dict = Depends(get_current_user)):
+    """
+    Export all user data as a ZIP archive containing:
+    - account.json: User profile information
+    - children.json: Children profiles
+    - journals.json: All journal entries
+    - violations.json: All violation records
+    - calendar.json: All calendar events
+    - contacts.json: All contacts
+    - documents/: All uploaded documents
+    
+    The archive is streamed as it is built; a failure part-way through ends the
+    download without a central directory, so a truncated archive never looks complete.
+    """
+    return export_response(current_user)
+
+@api_router.get("/export/delta")
+async def export_delta(since: str, current_user: dict = Depends(get_current_user)):
+    """Same layout as /export/all, limited to records changed since the watermark of an
+    earlier export (manifest.json or X-Export-Watermark), with deletions.json tombstones.
+
+    Records changed right around the watermark may appear in two consecutive deltas;
+    apply them as upserts keyed by their ids.
+    """
+    delta_lower_bound(since)
+    return export_response(current_user, since)
+
+# ============== EXPORT JOBS ==============
+
+class ExportLeaseLost(Exception):
+    """Another worker took the job over after our lease lapsed"""
+
+class ExportWorker:
+    """Bounded pool that builds /export/all archives in the background.
+
+    Jobs are leased while they run and the lease is renewed with every progress
+    update. If a worker dies mid-export its lease lapses, and the sweeper queues
+    the job again; the archive is then rebuilt from the start under a fresh key.
+    """
+    
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+    
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+    
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def enqueue(self, job_id: str) -> None:
+        self._queue.put_nowait(job_id)
+    
+    async def enqueue_stalled(self) -> int:
+        """Queue unfinished jobs nobody holds a live lease on (new ones, or orphaned by a crash)"""
+        queued = 0
+        async for job in db.export_jobs.find(
+            {
+                "status": {"$in": ["queued", "running"]},
+                "$or": [{"lease_expires": {"$exists": False}}, {"lease_expires": {"$lt": datetime.now(timezone.utc)}}]
+            },
+            {"job_id": 1}
+        ):
+            self.enqueue(job["job_id"])
+            queued += 1
+        return queued
+    
+    async def _run(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except ExportLeaseLost:
+                logger.info(f"Export {job_id} was taken over by another worker")
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Export {job_id} failed: {str(e)}")
+                await self._finish(job_id, {"status": "failed", "error": "Export failed"})
+            finally:
+                self._queue.task_done()
+    
+    async def _process(self, job_id: str) -> None:
+        now = datetime.now(timezone.utc)
+        lease_id = str(uuid.uuid4())
+        job = await db.export_jobs.find_one_and_update(
+            {
+                "job_id": job_id,
+                "status": {"$in": ["queued", "running"]},
+                "$or": [{"lease_expires": {"$exists": False}}, {"lease_expires": {"$lt": now}}]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_id": lease_id,
+                    "lease_expires": now + timedelta(seconds=EXPORT_JOB_LEASE_SECONDS),
+                    "watermark": now.isoformat(),
+                    "records": 0,
+                    "bytes": 0
+                },
+                "$inc": {"attempts": 1}
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            return  # Finished, or another worker holds the lease
+        if job["attempts"] > EXPORT_JOB_MAX_ATTEMPTS:
+            self.failed += 1
+            await self._finish(job_id, {"status": "failed", "error": "Export kept failing; please try again"})
+            return
         
-        # Prepare response
-        zip_buffer.seek(0)
-        filename = f"CustodyKeeper_Export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        user = await db.users.find_one({"user_id": job["user_id"]}, {"_id": 0})
+        if not user:
+            raise ValueError("User no longer exists")
         
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
-        )
+        # A key per attempt, so a worker that lost its lease cannot clobber the winner's artifact
+        key = f"exports/{job_id}/{lease_id}.zip"
+        archive = ExportArchive()
         
-    except Exception as e:
-        logger.error(f"Failed to export data: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to export data: {str(e)}")
+        async def reported() -> AsyncIterator[bytes]:
+            last_report = time.monotonic()
+            async for chunk in stream_export_archive(user, archive, job.get("since"), now):
+                yield chunk
+                if time.monotonic() - last_report >= EXPORT_PROGRESS_INTERVAL_SECONDS:
+                    last_report = time.monotonic()
+                    await self._heartbeat(job_id, lease_id, archive)
+        
+        try:
+            size = await blob_store.put(key, reported(), "application/zip")
+            finished = await self._finish(job_id, {
+                "status": "done",
+                "records": archive.records,
+                "bytes": archive.bytes_written,
+                "size": size,
+                "blob_store": blob_store.name,
+                "blob_key": key
+            }, lease_id)
+            if not finished:
+                raise ExportLeaseLost()
+        except BaseException:
+            await blob_store.delete(key)
+            raise
+        self.completed += 1
+    
+    async def _heartbeat(self, job_id: str, lease_id: str, archive: ExportArchive) -> None:
+        result = await db.export_jobs.update_one(
+            {"job_id": job_id, "lease_id": lease_id},
+            {"$set": {
+                "records": archive.records,
+                "bytes": archive.bytes_written,
+                "lease_expires": datetime.now(timezone.utc) + timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+            }}
+        )
+        if result.matched_count == 0:
+            raise ExportLeaseLost()
+    
+    async def _finish(self, job_id: str, fields: dict, lease_id: Optional[str] = None) -> bool:
+        """Record the outcome and release the user's export slot; False if the lease was lost"""
+        now = datetime.now(timezone.utc)
+        query = {"job_id": job_id, **({"lease_id": lease_id} if lease_id else {})}
+        result = await db.export_jobs.update_one(query, {
+            "$set": {
+                **fields,
+                "finished_at": now.isoformat(),
+                "expires_at": now + timedelta(seconds=EXPORT_ARTIFACT_TTL_SECONDS)
+            },
+            "$unset": {"active": "", "lease_id": "", "lease_expires": ""}
+        })
+        return result.matched_count == 1
+    
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "workers": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+export_worker = ExportWorker(EXPORT_JOB_WORKERS)
+
+async def sweep_export_jobs() -> None:
+    """Delete expired export artifacts and cached exhibit packets, and requeue jobs whose
+    worker stopped renewing its lease"""
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            while job := await db.export_jobs.find_one_and_delete(
+                {"status": {"$in": ["done", "failed"]}, "expires_at": {"$lt": now}}
+            ):
+                if job.get("blob_key"):
+                    await get_blob_store(job["blob_store"]).delete(job["blob_key"])
+            while packet := await db.exhibit_packets.find_one_and_delete({"expires_at": {"$lt": now}}):
+                await get_blob_store(packet["blob_store"]).delete(packet["_id"])
+            requeued = await export_worker.enqueue_stalled()
+            if requeued:
+                logger.info(f"Queued {requeued} export job(s)")
+        except Exception as e:
+            logger.warning(f"Export sweep failed: {str(e)}")
+        await asyncio.sleep(EXPORT_SWEEP_INTERVAL_SECONDS)
+
+def export_job_response(job: dict) -> ExportJobResponse:
+    expires_at = job.get("expires_at")
+    return ExportJobResponse(
+        **{**job, "expires_at": expires_at.isoformat() if expires_at else None},
+        download_url=sign_path(f"/export/jobs/{job['job_id']}/download") if job["status"] == "done" else None
+    )
+
+@api_router.post("/export/jobs", response_model=ExportJobResponse)
+async def start_export_job(since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Build the /export/all archive (or the /export/delta one, given since) in the background;
+    returns the user's running job if there is one"""
+    if since:
+        delta_lower_bound(since)
+    kind = "Delta" if since else "Export"
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "user_id": current_user["user_id"],
+        "status": "queued",
+        "active": True,  # Unique per user while set, so one export runs at a time
+        "records": 0,
+        "bytes": 0,
+        "attempts": 0,
+        "since": since,
+        "filename": f"CustodyKeeper_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    try:
+        await db.export_jobs.insert_one(job)
+    except DuplicateKeyError:
+        job = await db.export_jobs.find_one(
+            {"user_id": current_user["user_id"], "active": True}, {"_id": 0}
+        )
+        if not job:
+            raise HTTPException(status_code=409, detail="An export is finishing; try again")
+        return export_job_response(job)
+    export_worker.enqueue(job["job_id"])
+    return export_job_response(job)
+
+@api_router.get("/export/jobs/{job_id}", response_model=ExportJobResponse)
+async def get_export_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await db.export_jobs.find_one({"job_id": job_id, "user_id": current_user["user_id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return export_job_response(job)
+
+@api_router.get("/export/jobs/{job_id}/download")
+async def download_export_job(
+    job_id: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """The finished archive; authorised by bearer token or the signed download_url"""
+    query = {"job_id": job_id, **await signed_or_owner_filter(
+        f"/export/jobs/{job_id}/download", expires, signature, credentials
+    )}
+    job = await db.export_jobs.find_one(query, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="Export is not ready")
+    
+    store = get_blob_store(job["blob_store"])
+    try:
+        return await file_stream_response(
+            request,
+            lambda start, length: store.open(job["blob_key"], start, length),
+            size=job["size"],
+            etag=f'"{job_id}"',
+            content_type="application/zip",
+            filename=job["filename"],
+            disposition="attachment",
+            cache_control="private, no-store"
+        )
+    except BlobNotFound:
+        raise HTTPException(status_code=410, detail="Export has expired")
 
 
 # ============== AI SERVICES (GPT-5.2) ==============
@@ -2018,16 +5724,16 @@ async def process_google_session(session_data: GoogleAuthSession):
     """Process Google OAuth session_id and create user session"""
     try:
         # Call Emergent Auth to get session data
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_data.session_id}
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid session")
-            
-            auth_data = response.json()
+        response = await outbound_http.request(
+            "GET",
+            EMERGENT_AUTH_SESSION_URL,
+            headers={"X-Session-ID": session_data.session_id}
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid session")
+        
+        auth_data = response.json()
         
         email = auth_data.get("email")
         name = auth_data.get("name", "")
@@ -2043,11 +5749,12 @@ async def process_google_session(session_data: GoogleAuthSession):
         if existing_user:
             user_id = existing_user["user_id"]
             # Update user photo if not set
-            if not existing_user.get("photo") and picture:
+            if not existing_user.get("photo") and not existing_user.get("photo_media_id") and picture:
                 await db.users.update_one(
                     {"user_id": user_id},
                     {"$set": {"photo": picture}}
                 )
+                invalidate_user_cache(user_id)
         else:
             # Create new user
             user_id = str(uuid.uuid4())
@@ -2063,6 +5770,7 @@ async def process_google_session(session_data: GoogleAuthSession):
                 "auth_provider": "google"
             }
             await db.users.insert_one(user_doc)
+            invalidate_user_cache(user_id)
         
         # Store session
         expires_at = datetime.now(timezone.utc) + timedelta(days=7)
@@ -2071,7 +5779,7 @@ async def process_google_session(session_data: GoogleAuthSession):
             {"$set": {
                 "user_id": user_id,
                 "session_token": session_token,
-                "expires_at": expires_at.isoformat(),
+                "expires_at": expires_at,
                 "created_at": datetime.now(timezone.utc).isoformat()
             }},
             upsert=True
@@ -2092,7 +5800,7 @@ async def process_google_session(session_data: GoogleAuthSession):
                 "email": user["email"],
                 "full_name": user.get("full_name", ""),
                 "state": user.get("state", ""),
-                "photo": user.get("photo", ""),
+                **avatar_fields(user),
                 "created_at": user.get("created_at", "")
             }
         }
@@ -2105,6 +5813,257 @@ async def process_google_session(session_data: GoogleAuthSession):
         raise HTTPException(status_code=500, detail=f"Authentication error: {str(e)}")
 
 
+# ============== MIGRATIONS ==============
+
+async def migrate_embed_two_factor_settings():
+    """Fold two_factor_settings rows into users.two_factor"""
+    async for settings in db.two_factor_settings.find({}, {"_id": 0}):
+        await db.users.update_one(
+            {"user_id": settings["user_id"], "two_factor": {"$exists": False}},
+            {"$set": {"two_factor": legacy_two_factor(settings)}}
+        )
+
+def parse_iso_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+async def migrate_expires_at_to_datetime():
+    """Convert ISO-string expires_at fields so the TTL indexes can purge them"""
+    for collection in (db.two_factor_codes, db.user_sessions, db.share_tokens, db.revoked_tokens):
+        batch = []
+        async for doc in collection.find({"expires_at": {"$type": "string"}}, {"expires_at": 1}):
+            try:
+                expires_at = parse_iso_datetime(doc["expires_at"])
+            except ValueError:
+                expires_at = datetime.now(timezone.utc)
+            batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"expires_at": expires_at}}))
+            if len(batch) >= 500:
+                await collection.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await collection.bulk_write(batch, ordered=False)
+
+async def migrate_document_files_to_blob_store():
+    """Move base64 file_data payloads out of documents into the blob store"""
+    cursor = db.documents.find(
+        {"file_data": {"$exists": True}},
+        {"_id": 1, "document_id": 1, "file_type": 1, "file_data": 1}
+    ).batch_size(10)
+    async for doc in cursor:
+        blob_key = f"documents/{doc['document_id']}"
+        await blob_store.put(
+            blob_key,
+            iter_bytes(base64.b64decode(doc["file_data"])),
+            doc.get("file_type", "application/octet-stream")
+        )
+        await db.documents.update_one(
+            {"_id": doc["_id"]},
+            {
+                "$set": {"blob_store": blob_store.name, "blob_key": blob_key},
+                "$unset": {"file_data": ""}
+            }
+        )
+
+async def migrate_document_blobs_to_content_addressed():
+    """Re-key per-document blobs by SHA-256 so duplicates collapse into one"""
+    cursor = db.documents.find(
+        {"blob_key": {"$exists": True}, "content_hash": {"$exists": False}},
+        {"_id": 1, "file_type": 1, "file_size": 1, "blob_store": 1, "blob_key": 1}
+    ).batch_size(10)
+    async for doc in cursor:
+        old_store = get_blob_store(doc["blob_store"])
+        try:
+            file_content = await read_blob(old_store, doc["blob_key"])
+        except BlobNotFound:
+            logger.warning(f"Missing blob {doc['blob_key']} during dedup migration")
+            continue
+        content_hash = await asyncio.to_thread(lambda: hashlib.sha256(file_content).hexdigest())
+        file_type = doc.get("file_type", "application/octet-stream")
+        blob = await acquire_content_blob(
+            content_hash, len(file_content), file_type, lambda: iter_bytes(file_content)
+        )
+        await db.documents.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "content_hash": content_hash,
+                **blob_reference(blob),
+                "compression_ratio": compression_ratio(blob)
+            }}
+        )
+        await old_store.delete(doc["blob_key"])
+
+async def migrate_journal_photos_to_media():
+    """Move base64 journal photos into media objects referenced by photo_media.
+
+    Variants are not pre-rendered here (one background render per photo would
+    be unbounded on a large backfill); they are made on first request instead.
+    """
+    cursor = db.journals.find(
+        {"photos": {"$exists": True}},
+        {"_id": 1, "journal_id": 1, "user_id": 1, "photos": 1, "photo_media": 1}
+    ).batch_size(10)
+    async for journal in cursor:
+        refs = list(journal.get("photo_media", []))
+        unreadable = []
+        for photo in journal.get("photos") or []:
+            try:
+                refs.append(await store_media(
+                    journal["user_id"], "journal", journal["journal_id"], decode_data_url(photo), variants={}
+                ))
+            except (ValueError, HTTPException):
+                unreadable.append(photo)
+        update = {"$set": {"photo_media": refs}, "$unset": {"photos": ""}}
+        if unreadable:
+            # Kept aside rather than lost; they are no longer served
+            logger.warning(f"{len(unreadable)} unreadable photo(s) on journal {journal['journal_id']}")
+            update["$set"]["unreadable_photos"] = unreadable
+        await db.journals.update_one({"_id": journal["_id"]}, update)
+
+async def migrate_avatars_to_media():
+    """Move base64 user, child and contact photos into the avatar store"""
+    owners = (
+        (db.users, "user", "user_id"),
+        (db.children, "child", "child_id"),
+        (db.contacts, "contact", "contact_id")
+    )
+    for collection, owner_type, id_field in owners:
+        cursor = collection.find(
+            {"photo": {"$regex": "^data:"}},
+            {"_id": 1, "user_id": 1, id_field: 1, "photo": 1}
+        ).batch_size(10)
+        async for owner in cursor:
+            try:
+                avatar, _ = await resolve_avatar(
+                    owner["user_id"], owner_type, owner[id_field], owner["photo"], {}, variants={}
+                )
+            except HTTPException:
+                logger.warning(f"Unreadable photo on {owner_type} {owner[id_field]}; left in place")
+                continue
+            await collection.update_one({"_id": owner["_id"]}, {"$set": avatar})
+            if owner_type == "user":
+                invalidate_user_cache(owner["user_id"])
+
+# Applied once, in order; the name is recorded in db.migrations when done
+async def migrate_backfill_updated_at():
+    """Give every exported record an updated_at (its created_at) so delta exports can filter on it"""
+    for collection in (db.children, db.contacts, db.journals, db.violations, db.calendar_events, db.documents):
+        await collection.update_many(
+            {"updated_at": {"$exists": False}},
+            [{"$set": {"updated_at": {"$ifNull": ["$created_at", datetime.now(timezone.utc).isoformat()]}}}]
+        )
+
+async def migrate_metadata_status_pending():
+    """Mark documents from before background metadata extraction as pending, so the
+    workers pick them up from the same claim query as new uploads"""
+    await db.documents.update_many({"metadata_status": None}, {"$set": {"metadata_status": "pending"}})
+    metadata_worker.notify()
+
+MIGRATIONS = [
+    ("0001_embed_two_factor_settings", migrate_embed_two_factor_settings),
+    ("0002_expires_at_to_datetime", migrate_expires_at_to_datetime),
+    ("0003_document_files_to_blob_store", migrate_document_files_to_blob_store),
+    ("0004_content_addressed_document_blobs", migrate_document_blobs_to_content_addressed),
+    ("0005_journal_photos_to_media", migrate_journal_photos_to_media),
+    ("0006_avatars_to_media", migrate_avatars_to_media),
+    ("0007_backfill_updated_at", migrate_backfill_updated_at),
+    ("0008_metadata_status_pending", migrate_metadata_status_pending),
+]
+
+async def claim_migration(name: str, lease_id: str) -> bool:
+    """Take the lease on a migration that is neither applied nor held by a live worker"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.migrations.update_one(
+            {
+                "_id": name,
+                "applied_at": {"$exists": False},
+                "$or": [{"lease_expires": {"$exists": False}}, {"lease_expires": {"$lt": now}}]
+            },
+            {"$set": {
+                "lease_id": lease_id,
+                "lease_expires": now + timedelta(seconds=MIGRATION_LEASE_SECONDS),
+                "started_at": now.isoformat()
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # Applied, or another worker holds a live lease
+
+async def run_leased_migration(name: str, migration: Callable[[], Awaitable], lease_id: str) -> None:
+    """Run one migration, renewing its lease until it finishes"""
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(MIGRATION_LEASE_SECONDS / 3)
+            result = await db.migrations.update_one(
+                {"_id": name, "lease_id": lease_id},
+                {"$set": {"lease_expires": datetime.now(timezone.utc) + timedelta(seconds=MIGRATION_LEASE_SECONDS)}}
+            )
+            if result.matched_count == 0:
+                logger.warning(f"Migration {name} lease was taken over")
+    
+    beat = asyncio.create_task(heartbeat())
+    try:
+        await migration()
+    finally:
+        beat.cancel()
+
+async def run_migrations():
+    """Apply pending migrations in order; each runs on one worker at a time under a lease.
+
+    Workers that find a migration leased elsewhere wait for it (later migrations
+    may depend on it) and take it over if the holder stops renewing.
+    """
+    lease_id = str(uuid.uuid4())
+    for name, migration in MIGRATIONS:
+        while True:
+            marker = await db.migrations.find_one({"_id": name}, {"applied_at": 1})
+            if marker and marker.get("applied_at"):
+                break
+            if not await claim_migration(name, lease_id):
+                await asyncio.sleep(MIGRATION_LEASE_SECONDS / 3)
+                continue
+            try:
+                await run_leased_migration(name, migration, lease_id)
+            except Exception as e:
+                # Release the lease so a waiting worker or the next startup retries
+                await db.migrations.update_one(
+                    {"_id": name, "lease_id": lease_id},
+                    {"$unset": {"lease_id": "", "lease_expires": ""}}
+                )
+                logger.error(f"Migration {name} failed: {str(e)}")
+                return
+            await db.migrations.update_one(
+                {"_id": name},
+                {"$set": {"applied_at": datetime.now(timezone.utc).isoformat()}, "$unset": {"lease_expires": ""}}
+            )
+            logger.info(f"Applied migration {name}")
+            break
+
+# ============== METRICS ==============
+
+async def require_internal_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Gate for operator-only endpoints: INTERNAL_API_TOKEN as a bearer token"""
+    if not INTERNAL_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not credentials or not hmac.compare_digest(credentials.credentials, INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid internal token")
+
+@api_router.get("/metrics/caches", dependencies=[Depends(require_internal_token)])
+async def get_cache_metrics():
+    """Per-process cache counters, used to size the caches"""
+    return {
+        "pid": os.getpid(),
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "outbound_http": outbound_http.stats(),
+        "metadata_worker": metadata_worker.stats(),
+        "export_worker": export_worker.stats()
+    }
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -2114,6 +6073,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Exhibit-Substituted-Characters", "X-Export-Watermark"],
 )
 
 # Create database indexes for better performance
@@ -2125,6 +6085,12 @@ async def create_indexes():
         await db.users.create_index("email", unique=True)
         await db.users.create_index("user_id", unique=True)
         
+        # Change tracking for delta exports
+        for collection in (db.children, db.contacts, db.journals, db.violations, db.calendar_events, db.documents):
+            await collection.create_index([("user_id", 1), ("updated_at", 1)])
+        await db.deletions.create_index([("user_id", 1), ("deleted_at", 1)])
+        await db.deletions.create_index("expires_at", expireAfterSeconds=0)
+        
         # Journal indexes
         await db.journals.create_index([("user_id", 1), ("date", -1)])
         await db.journals.create_index([("user_id", 1), ("children_involved", 1)])
@@ -2139,6 +6105,14 @@ async def create_indexes():
         
         # Document indexes
         await db.documents.create_index([("user_id", 1), ("category", 1)])
+        await db.documents.create_index([("user_id", 1), ("created_at", -1)])
+        await db.documents.create_index([("user_id", 1), ("category", 1), ("created_at", -1)])
+        await db.documents.create_index([("metadata_status", 1), ("created_at", -1)])
+        await db.media_variants.create_index("source_id")
+        
+        # Media indexes
+        await db.media.create_index("media_id", unique=True)
+        await db.media.create_index([("owner_type", 1), ("owner_id", 1)])
         
         # Contact indexes
         await db.contacts.create_index([("user_id", 1), ("category", 1)])
@@ -2147,6 +6121,34 @@ async def create_indexes():
         await db.share_tokens.create_index("share_token", unique=True)
         await db.share_tokens.create_index([("user_id", 1), ("is_active", 1)])
         
+        # Revoked JWT indexes
+        await db.revoked_tokens.create_index("token_digest", unique=True)
+        await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+        
+        # Expiring rows are purged by TTL indexes on BSON datetime expires_at
+        await db.two_factor_codes.create_index("user_id", unique=True)
+        await db.two_factor_codes.create_index("expires_at", expireAfterSeconds=0)
+        await db.user_sessions.create_index("expires_at", expireAfterSeconds=0)
+        await db.share_tokens.create_index(
+            "expires_at",
+            expireAfterSeconds=SHARE_TOKEN_RETENTION_DAYS * 86400
+        )
+        
+        # Shared rate-limit counters expire after two windows
+        await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+        
+        # Resumable upload sessions (expired ones are swept with their chunks, not by TTL)
+        await db.upload_sessions.create_index("upload_id", unique=True)
+        await db.upload_sessions.create_index("expires_at")
+        
+        # Export jobs (finished ones are swept with their artifact, not by TTL)
+        await db.export_jobs.create_index("job_id", unique=True)
+        await db.export_jobs.create_index(
+            "user_id", unique=True, partialFilterExpression={"active": True}
+        )
+        await db.export_jobs.create_index([("status", 1), ("expires_at", 1)])
+        await db.exhibit_packets.create_index("expires_at")
+        
         # Google OAuth session indexes
         await db.user_sessions.create_index("session_token", unique=True)
         await db.user_sessions.create_index([("user_id", 1)])
@@ -2155,6 +6157,50 @@ async def create_indexes():
     except Exception as e:
         logger.warning(f"Index creation warning (may already exist): {str(e)}")
 
+_migration_runner: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def apply_migrations():
+    """Backfills can take a long time, so they run alongside serving rather than before it"""
+    global _migration_runner
+    _migration_runner = asyncio.create_task(run_migrations())
+
+@app.on_event("startup")
+async def start_outbound_http():
+    await outbound_http.start()
+
+@app.on_event("startup")
+async def start_metadata_worker():
+    metadata_worker.start()
+
+_upload_sweeper: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_upload_sweeper():
+    global _upload_sweeper
+    _upload_sweeper = asyncio.create_task(sweep_upload_sessions())
+
+_export_sweeper: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_export_worker():
+    global _export_sweeper
+    export_worker.start()
+    # The first sweep also queues jobs left behind by a previous process
+    _export_sweeper = asyncio.create_task(sweep_export_jobs())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if _migration_runner is not None:
+        _migration_runner.cancel()
+    if _upload_sweeper is not None:
+        _upload_sweeper.cancel()
+    if _export_sweeper is not None:
+        _export_sweeper.cancel()
+    await metadata_worker.close()
+    await export_worker.close()
     client.close()
+    password_hasher.shutdown()
+    if _media_pool is not None:
+        _media_pool.shutdown(wait=False, cancel_futures=True)
+    await outbound_http.close()
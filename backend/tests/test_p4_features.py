@@ -0,0 +1,980 @@
+"""
+Test P4 features:
+- Rate limiting on auth endpoints (429 + Retry-After)
+- Pooled outbound HTTP client retries against a local stub server
+- Streaming document download with Range/206 and ETag/304
+- Streamed multipart uploads with early type/size rejection
+- Paginated document listing with filters and category facets
+- Resumable chunked uploads (session, checksummed chunks, finalize)
+- Media metadata extraction (duration, page count)
+- Compression at rest with ranged, streaming decompression
+- Streamed /export/all ZIP built with bounded memory
+- Background export jobs with progress and signed artifact download
+- Delta exports since a watermark, with tombstones and a manifest
+- NDJSON streaming of journal and violation exports
+- CSV/Parquet table exports with children resolved to names
+- Bates-numbered PDF exhibit packets, cached by input hash
+- Shared view sections read concurrently, degrading on failure or timeout
+- Journal photos stored as media objects and served as signed variants
+- Child avatars served as square variants with ETag/304
+"""
+import pytest
+import requests
+import os
+import sys
+import uuid
+import base64
+import csv
+import io
+import json
+import hashlib
+import asyncio
+import struct
+import threading
+import time
+import wave
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+# Test credentials
+TEST_EMAIL = "test@test.com"
+TEST_PASSWORD = "password"
+
+
+class TestAuth:
+    """Authentication for testing"""
+
+    @pytest.fixture(scope="class")
+    def auth_token(self):
+        """Get authentication token"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": TEST_EMAIL,
+            "password": TEST_PASSWORD
+        })
+        if response.status_code == 200:
+            return response.json()["access_token"]
+        pytest.skip("Authentication failed - skipping authenticated tests")
+
+    @pytest.fixture(scope="class")
+    def auth_headers(self, auth_token):
+        """Headers with auth token"""
+        return {"Authorization": f"Bearer {auth_token}"}
+
+
+class TestRateLimiting:
+    """Test per-email throttling of /api/auth/login"""
+
+    # Must match the server's RATE_LIMIT_LOGIN_EMAIL
+    EMAIL_LIMIT = int(os.environ.get("RATE_LIMIT_LOGIN_EMAIL", "10/300").split("/")[0])
+
+    def test_login_throttled_per_email(self):
+        """Repeated failed logins for one email end in 429 with Retry-After"""
+        email = f"ratelimit_{uuid.uuid4().hex[:8]}@example.com"
+        statuses = []
+        for _ in range(self.EMAIL_LIMIT + 2):
+            response = requests.post(f"{BASE_URL}/api/auth/login", json={
+                "email": email,
+                "password": "wrong-password"
+            })
+            statuses.append(response.status_code)
+            if response.status_code == 429:
+                assert int(response.headers["Retry-After"]) >= 1
+                break
+        assert statuses[0] == 401, f"First attempt should be a normal failure: {statuses}"
+        assert statuses[-1] == 429, f"Expected throttling, got {statuses}"
+        print(f"Login throttled after {len(statuses) - 1} attempts")
+
+    def test_successful_logins_not_counted(self):
+        """Only failed attempts count toward the per-email budget"""
+        for _ in range(self.EMAIL_LIMIT + 1):
+            response = requests.post(f"{BASE_URL}/api/auth/login", json={
+                "email": TEST_EMAIL,
+                "password": TEST_PASSWORD
+            })
+            assert response.status_code != 429
+
+    def test_cache_metrics_report_rate_limiter(self):
+        """GET /api/metrics/caches exposes limiter counters to internal callers"""
+        internal_token = os.environ.get("INTERNAL_API_TOKEN")
+        if not internal_token:
+            pytest.skip("INTERNAL_API_TOKEN not set")
+        response = requests.get(
+            f"{BASE_URL}/api/metrics/caches", headers={"Authorization": f"Bearer {internal_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert "user_cache" in data
+        assert "rate_limiter" in data
+        assert data["rate_limiter"]["rejected"] >= 0
+
+    def test_cache_metrics_require_internal_token(self):
+        """GET /api/metrics/caches is not public"""
+        response = requests.get(f"{BASE_URL}/api/metrics/caches")
+        assert response.status_code in (401, 404)
+        response = requests.get(f"{BASE_URL}/api/metrics/caches", headers={"Authorization": "Bearer wrong"})
+        assert response.status_code in (401, 404)
+
+
+class TestDocumentStreaming(TestAuth):
+    """Test GET /api/documents/{id}/content"""
+
+    @pytest.fixture(scope="class")
+    def uploaded_document(self, auth_headers):
+        content = bytes(range(256)) * 64
+        response = requests.post(
+            f"{BASE_URL}/api/documents",
+            headers=auth_headers,
+            files={"file": ("TEST_stream.pdf", content, "application/pdf")},
+            data={"category": "other", "description": "TEST streaming"}
+        )
+        assert response.status_code == 200, response.text
+        document = response.json()
+        yield document, content
+        requests.delete(f"{BASE_URL}/api/documents/{document['document_id']}", headers=auth_headers)
+
+    def test_full_download(self, auth_headers, uploaded_document):
+        document, content = uploaded_document
+        response = requests.get(
+            f"{BASE_URL}/api/documents/{document['document_id']}/content",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("application/pdf")
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.content == content
+
+    def test_range_request(self, auth_headers, uploaded_document):
+        document, content = uploaded_document
+        response = requests.get(
+            f"{BASE_URL}/api/documents/{document['document_id']}/content",
+            headers={**auth_headers, "Range": "bytes=100-199"}
+        )
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 100-199/{len(content)}"
+        assert response.content == content[100:200]
+
+    def test_etag_not_modified(self, auth_headers, uploaded_document):
+        document, _ = uploaded_document
+        url = f"{BASE_URL}/api/documents/{document['document_id']}/content"
+        etag = requests.get(url, headers=auth_headers).headers["ETag"]
+        response = requests.get(url, headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 304
+
+    def test_signed_stream_url(self, auth_headers, uploaded_document):
+        document, content = uploaded_document
+        response = requests.get(
+            f"{BASE_URL}/api/documents/{document['document_id']}/stream-url",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        signed = requests.get(f"{BASE_URL}/api{response.json()['path']}", headers={"Range": "bytes=-10"})
+        assert signed.status_code == 206
+        assert signed.content == content[-10:]
+
+    def test_requires_auth(self, uploaded_document):
+        document, _ = uploaded_document
+        response = requests.get(f"{BASE_URL}/api/documents/{document['document_id']}/content")
+        assert response.status_code == 401
+
+
+class TestStreamedUpload(TestAuth):
+    """Test limits enforced while POST /api/documents is being read"""
+
+    def test_rejects_disallowed_type(self, auth_headers):
+        response = requests.post(
+            f"{BASE_URL}/api/documents",
+            headers=auth_headers,
+            files={"file": ("TEST_script.sh", b"echo hi", "application/x-sh")},
+            data={"category": "other"}
+        )
+        assert response.status_code == 400
+        assert "not allowed" in response.json()["detail"]
+
+    def test_rejects_oversized_file(self, auth_headers):
+        content = b"%PDF" + b"0" * (10 * 1024 * 1024)
+        response = requests.post(
+            f"{BASE_URL}/api/documents",
+            headers=auth_headers,
+            files={"file": ("TEST_big.pdf", content, "application/pdf")},
+            data={"category": "other"}
+        )
+        assert response.status_code == 400
+        assert "too large" in response.json()["detail"]
+
+    def test_requires_category(self, auth_headers):
+        response = requests.post(
+            f"{BASE_URL}/api/documents",
+            headers=auth_headers,
+            files={"file": ("TEST_small.pdf", b"%PDF-1.4", "application/pdf")}
+        )
+        assert response.status_code == 422
+
+
+class TestDocumentListing(TestAuth):
+    """Test GET /api/documents/page pagination, filters and category facets"""
+
+    @pytest.fixture(scope="class")
+    def listed_documents(self, auth_headers):
+        created = []
+        for index, category in enumerate(["medical", "medical", "school"]):
+            response = requests.post(
+                f"{BASE_URL}/api/documents",
+                headers=auth_headers,
+                files={"file": (f"TEST_listing_{index}.pdf", b"%PDF-1.4 listing", "application/pdf")},
+                data={"category": category, "description": "TEST listing"}
+            )
+            assert response.status_code == 200, response.text
+            created.append(response.json())
+        yield created
+        for document in created:
+            requests.delete(f"{BASE_URL}/api/documents/{document['document_id']}", headers=auth_headers)
+
+    def test_page_shape(self, auth_headers, listed_documents):
+        response = requests.get(f"{BASE_URL}/api/documents/page", headers=auth_headers, params={"page_size": 2})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["items"]) <= 2
+        assert data["page"] == 1 and data["page_size"] == 2
+        assert data["total_pages"] == -(-data["total"] // 2)
+        created = [item["created_at"] for item in data["items"]]
+        assert created == sorted(created, reverse=True)
+
+    def test_category_filter_keeps_facets(self, auth_headers, listed_documents):
+        response = requests.get(
+            f"{BASE_URL}/api/documents/page",
+            headers=auth_headers,
+            params={"category": "medical", "q": "TEST_listing"}
+        )
+        data = response.json()
+        assert data["total"] == 2
+        assert all(item["category"] == "medical" for item in data["items"])
+        assert data["facets"] == {"medical": 2, "school": 1}
+
+    def test_type_and_date_filters(self, auth_headers, listed_documents):
+        today = listed_documents[0]["created_at"][:10]
+        response = requests.get(
+            f"{BASE_URL}/api/documents/page",
+            headers=auth_headers,
+            params={"type": "pdf", "date_from": today, "date_to": today, "q": "TEST_listing"}
+        )
+        assert response.json()["total"] == 3
+        response = requests.get(
+            f"{BASE_URL}/api/documents/page",
+            headers=auth_headers,
+            params={"type": "image", "q": "TEST_listing"}
+        )
+        assert response.json()["total"] == 0
+
+    def test_rejects_unknown_type(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/documents/page", headers=auth_headers, params={"type": "spreadsheet"})
+        assert response.status_code == 400
+
+    def test_rejects_malformed_dates(self, auth_headers):
+        for params in ({"date_from": "garbage"}, {"date_to": "2024-13-40"}):
+            response = requests.get(f"{BASE_URL}/api/documents/page", headers=auth_headers, params=params)
+            assert response.status_code == 400
+
+    def test_plain_list_still_served(self, auth_headers, listed_documents):
+        """GET /api/documents keeps returning a list for existing callers"""
+        response = requests.get(f"{BASE_URL}/api/documents", headers=auth_headers, params={"q": "TEST_listing"})
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list) and len(data) == 3
+
+
+class TestResumableUpload(TestAuth):
+    """Test /api/uploads session -> chunks -> complete"""
+
+    def test_chunked_upload_round_trip(self, auth_headers):
+        content = os.urandom(3000)
+        session = requests.post(f"{BASE_URL}/api/uploads", headers=auth_headers, json={
+            "filename": "TEST_resumable.mp3",
+            "content_type": "audio/mpeg",
+            "size": len(content),
+            "category": "other",
+            "description": "TEST resumable"
+        })
+        assert session.status_code == 200, session.text
+        session = session.json()
+        assert session["received_chunks"] == []
+        chunk_url = f"{BASE_URL}/api/uploads/{session['upload_id']}/chunks"
+
+        bad = requests.put(f"{chunk_url}/0", headers={**auth_headers, "X-Chunk-SHA256": "0" * 64},
+                           data=content[:session["chunk_size"]])
+        assert bad.status_code == 400
+
+        for index in range(session["total_chunks"]):
+            chunk = content[index * session["chunk_size"]:(index + 1) * session["chunk_size"]]
+            response = requests.put(
+                f"{chunk_url}/{index}",
+                headers={**auth_headers, "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest()},
+                data=chunk
+            )
+            assert response.status_code == 200, response.text
+
+        status = requests.get(f"{BASE_URL}/api/uploads/{session['upload_id']}", headers=auth_headers)
+        assert status.json()["received_chunks"] == list(range(session["total_chunks"]))
+        assert status.json()["status"] == "open"
+
+        complete = requests.post(f"{BASE_URL}/api/uploads/{session['upload_id']}/complete", headers=auth_headers)
+        assert complete.status_code == 200, complete.text
+        document = complete.json()
+        try:
+            downloaded = requests.get(
+                f"{BASE_URL}/api/documents/{document['document_id']}/content", headers=auth_headers
+            )
+            assert downloaded.content == content
+        finally:
+            requests.delete(f"{BASE_URL}/api/documents/{document['document_id']}", headers=auth_headers)
+
+    def test_complete_requires_all_chunks(self, auth_headers):
+        session = requests.post(f"{BASE_URL}/api/uploads", headers=auth_headers, json={
+            "filename": "TEST_partial.mp4",
+            "content_type": "video/mp4",
+            "size": 1024,
+            "category": "other"
+        }).json()
+        response = requests.post(f"{BASE_URL}/api/uploads/{session['upload_id']}/complete", headers=auth_headers)
+        assert response.status_code == 400
+        requests.delete(f"{BASE_URL}/api/uploads/{session['upload_id']}", headers=auth_headers)
+
+
+# 1x1 PNG
+PNG_DATA_URL = (
+    "data:image/png;base64,"
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+class TestJournalPhotos(TestAuth):
+    """Test journal photos as referenced media"""
+
+    @pytest.fixture(scope="class")
+    def journal(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/journals", headers=auth_headers, json={
+            "title": "TEST_photo journal",
+            "content": "TEST photo content",
+            "date": "2024-01-15",
+            "photos": [PNG_DATA_URL]
+        })
+        assert response.status_code == 200, response.text
+        journal = response.json()
+        yield journal
+        requests.delete(f"{BASE_URL}/api/journals/{journal['journal_id']}", headers=auth_headers)
+
+    def test_photo_stored_as_reference(self, journal):
+        assert len(journal["photo_media"]) == 1
+        photo = journal["photo_media"][0]
+        assert (photo["width"], photo["height"]) == (1, 1)
+        assert journal["photos"] == [photo["preview_url"]]
+        assert not journal["photos"][0].startswith("data:")
+
+    def test_signed_variant_served(self, journal):
+        photo = journal["photo_media"][0]
+        response = requests.get(f"{BASE_URL}/api{photo['thumbnail_url']}")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/webp"
+
+    def test_update_keeps_existing_photo(self, auth_headers, journal):
+        response = requests.put(
+            f"{BASE_URL}/api/journals/{journal['journal_id']}",
+            headers=auth_headers,
+            json={
+                "title": "TEST_photo journal",
+                "content": "TEST edited",
+                "date": "2024-01-15",
+                "photos": journal["photos"]
+            }
+        )
+        assert response.status_code == 200
+        media_ids = [p["media_id"] for p in response.json()["photo_media"]]
+        assert media_ids == [journal["photo_media"][0]["media_id"]]
+
+    def test_add_and_remove_photo(self, auth_headers, journal):
+        png = base64.b64decode(PNG_DATA_URL.split(",", 1)[1])
+        added = requests.post(
+            f"{BASE_URL}/api/journals/{journal['journal_id']}/photos",
+            headers=auth_headers,
+            files={"file": ("TEST_photo.png", png, "image/png")}
+        )
+        assert added.status_code == 200
+        assert len(added.json()["photo_media"]) == 2
+        media_id = added.json()["photo_media"][-1]["media_id"]
+        removed = requests.delete(
+            f"{BASE_URL}/api/journals/{journal['journal_id']}/photos/{media_id}",
+            headers=auth_headers
+        )
+        assert removed.status_code == 200
+        assert media_id not in [p["media_id"] for p in removed.json()["photo_media"]]
+
+
+class TestAvatars(TestAuth):
+    """Test child photos in the avatar store"""
+
+    @pytest.fixture(scope="class")
+    def child(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/children", headers=auth_headers, json={
+            "name": "TEST_Avatar Child",
+            "date_of_birth": "2018-05-01",
+            "photo": PNG_DATA_URL
+        })
+        assert response.status_code == 200, response.text
+        child = response.json()
+        yield child
+        requests.delete(f"{BASE_URL}/api/children/{child['child_id']}", headers=auth_headers)
+
+    def test_child_keeps_only_reference(self, child):
+        assert child["photo"].startswith("/media/")
+        assert "/variants/avatar_md?" in child["photo"]
+        assert "/variants/avatar_sm?" in child["photo_small"]
+
+    def test_avatar_etag(self, child):
+        url = f"{BASE_URL}/api{child['photo_small']}"
+        response = requests.get(url)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/webp"
+        cached = requests.get(url, headers={"If-None-Match": response.headers["ETag"]})
+        assert cached.status_code == 304
+
+    def test_update_without_new_photo_keeps_avatar(self, auth_headers, child):
+        response = requests.put(f"{BASE_URL}/api/children/{child['child_id']}", headers=auth_headers, json={
+            "name": "TEST_Avatar Child",
+            "date_of_birth": "2018-05-01",
+            "photo": child["photo"]
+        })
+        assert response.status_code == 200
+        assert response.json()["photo"].split("?")[0] == child["photo"].split("?")[0]
+
+
+class _FlakyStubHandler(BaseHTTPRequestHandler):
+    """Answers 503 for the first request, then 200"""
+    calls = 0
+
+    def do_GET(self):
+        type(self).calls += 1
+        status = 503 if type(self).calls == 1 else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server_module():
+    """The backend module itself, for tests that exercise helpers directly"""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("motor")
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "test_database")
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import server
+    return server
+
+
+class TestOutboundHTTP:
+    """Test OutboundHTTP against a local stub server (imports the backend module)"""
+
+    @pytest.fixture(scope="class")
+    def stub_url(self):
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FlakyStubHandler)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{httpd.server_address[1]}/session"
+        httpd.shutdown()
+
+    def test_retries_transient_status(self, server_module, stub_url):
+        """A 503 is retried and the follow-up 200 is returned"""
+        outbound = server_module.OutboundHTTP(timeout=5, max_connections=4, per_host_limit=2, retries=2)
+
+        async def run():
+            try:
+                return await outbound.request("GET", stub_url)
+            finally:
+                await outbound.close()
+
+        response = asyncio.run(run())
+        assert response.status_code == 200
+        assert outbound.retried == 1
+
+
+class TestMetadataExtraction:
+    """Test extract_media_metadata on small synthetic files"""
+
+    def test_wav_duration(self, server_module, tmp_path):
+        path = tmp_path / "tone.wav"
+        with wave.open(str(path), "wb") as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(8000)
+            audio.writeframes(b"\x00\x00" * 12000)
+        assert server_module.extract_media_metadata(str(path), "audio/wav") == {"duration_seconds": 1.5}
+
+    def test_mp4_duration(self, server_module, tmp_path):
+        mvhd_body = bytes(4) + struct.pack(">IIII", 0, 0, 1000, 2500) + bytes(80)
+        mvhd = struct.pack(">I4s", 8 + len(mvhd_body), b"mvhd") + mvhd_body
+        moov = struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+        ftyp = struct.pack(">I4s4sI", 16, b"ftyp", b"isom", 0)
+        path = tmp_path / "clip.mp4"
+        path.write_bytes(ftyp + moov)
+        assert server_module.extract_media_metadata(str(path), "video/mp4") == {"duration_seconds": 2.5}
+
+    def test_pdf_page_count(self, server_module, tmp_path):
+        path = tmp_path / "doc.pdf"
+        path.write_bytes(
+            b"%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+            b"2 0 obj << /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >> endobj\n"
+            b"3 0 obj << /Type /Page /Parent 2 0 R >> endobj\n"
+            b"4 0 obj << /Type /Page /Parent 2 0 R >> endobj\n%%EOF"
+        )
+        assert server_module.extract_media_metadata(str(path), "application/pdf") == {"page_count": 2}
+
+
+class TestCompressionAtRest:
+    """Test compress_stream/decompress_stream round trips, including byte ranges"""
+
+    @pytest.mark.parametrize("codec", ["zlib", "lzma"])
+    def test_ranged_round_trip(self, server_module, codec):
+        data = b"custody journal " * 4096 + os.urandom(2048)
+
+        async def chunked(payload, size):
+            for i in range(0, len(payload), size):
+                yield payload[i:i + size]
+
+        async def collect(stream):
+            return b"".join([chunk async for chunk in stream])
+
+        async def run():
+            compressed = await collect(server_module.compress_stream(chunked(data, 1000), codec))
+            assert len(compressed) < len(data) // 4
+            whole = await collect(server_module.decompress_stream(chunked(compressed, 777), codec))
+            middle = await collect(server_module.decompress_stream(chunked(compressed, 777), codec, 30000, 5000))
+            return whole, middle
+
+        whole, middle = asyncio.run(run())
+        assert whole == data
+        assert middle == data[30000:35000]
+
+    @pytest.mark.parametrize("codec", ["zlib", "lzma"])
+    def test_output_bounded_per_piece(self, server_module, monkeypatch, codec):
+        """One highly compressible stored chunk is inflated in BLOB_CHUNK_SIZE steps"""
+        monkeypatch.setattr(server_module, "BLOB_CHUNK_SIZE", 4096)
+        data = bytes(1024 * 1024)
+
+        async def single(payload):
+            yield payload
+
+        async def run():
+            compressed = b"".join([c async for c in server_module.compress_stream(single(data), codec)])
+            return [piece async for piece in server_module.decompress_stream(single(compressed), codec)]
+
+        pieces = asyncio.run(run())
+        assert b"".join(pieces) == data
+        assert max(len(piece) for piece in pieces) <= 4096
+
+
+class TestStreamingExport:
+    """Test ExportArchive writing to an unseekable sink"""
+
+    def test_archive_streams_in_pieces(self, server_module, monkeypatch):
+        monkeypatch.setattr(server_module, "EXPORT_FLUSH_SIZE", 4096)
+        photo = os.urandom(50000)
+
+        async def records():
+            for index in range(500):
+                yield {"index": index, "notes": "picked up late " * 4}
+
+        async def empty():
+            return
+            yield
+
+        async def chunked(payload):
+            for i in range(0, len(payload), 8192):
+                yield payload[i:i + 8192]
+
+        async def run():
+            archive = server_module.ExportArchive()
+            pieces = []
+            for stream in (
+                archive.write_json_array("journals.json", records()),
+                archive.write_json_array("violations.json", empty()),
+                archive.write_file("journal_photos/a.jpeg", chunked(photo), len(photo), compress=False),
+                archive.close()
+            ):
+                pieces.extend([chunk async for chunk in stream])
+            return pieces
+
+        pieces = asyncio.run(run())
+        assert len(pieces) > 10
+        assert max(len(piece) for piece in pieces) < 4096 + 16384
+        with zipfile.ZipFile(io.BytesIO(b"".join(pieces))) as archive:
+            assert archive.testzip() is None
+            assert len(json.loads(archive.read("journals.json"))) == 500
+            assert json.loads(archive.read("violations.json")) == []
+            assert archive.getinfo("journal_photos/a.jpeg").compress_type == zipfile.ZIP_STORED
+            assert archive.read("journal_photos/a.jpeg") == photo
+
+
+class TestExportAllStreaming(TestAuth):
+    """Test GET /api/export/all is sent chunked and unpacks completely"""
+
+    def test_streamed_zip(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/all", headers=auth_headers, stream=True)
+        assert response.status_code == 200
+        assert "Content-Length" not in response.headers
+        content = b"".join(response.iter_content(65536))
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            assert archive.testzip() is None
+            assert archive.namelist()[:2] == ["account.json", "README.txt"]
+            assert "documents/index.json" in archive.namelist()
+
+
+class TestExportJobs(TestAuth):
+    """Test POST /api/export/jobs -> status polling -> signed download"""
+
+    def wait_for(self, auth_headers, job):
+        deadline = time.time() + 60
+        while job["status"] in ("queued", "running") and time.time() < deadline:
+            time.sleep(0.5)
+            job = requests.get(f"{BASE_URL}/api/export/jobs/{job['job_id']}", headers=auth_headers).json()
+        return job
+
+    def test_job_round_trip(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/export/jobs", headers=auth_headers)
+        assert response.status_code == 200
+        job = response.json()
+        # One export per user: starting again while it runs returns the same job
+        again = requests.post(f"{BASE_URL}/api/export/jobs", headers=auth_headers).json()
+        if again["status"] in ("queued", "running"):
+            assert again["job_id"] == job["job_id"]
+
+        job = self.wait_for(auth_headers, job)
+        assert job["status"] == "done", job
+        assert job["records"] > 0 and job["bytes"] == job["size"]
+
+        download = requests.get(f"{BASE_URL}/api{job['download_url']}")
+        assert download.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(download.content)) as archive:
+            assert archive.testzip() is None
+            assert "account.json" in archive.namelist()
+
+    def test_download_requires_auth(self, auth_headers):
+        job = requests.post(f"{BASE_URL}/api/export/jobs", headers=auth_headers).json()
+        job = self.wait_for(auth_headers, job)
+        response = requests.get(f"{BASE_URL}/api/export/jobs/{job['job_id']}/download")
+        assert response.status_code == 401
+
+    def test_unknown_job(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/jobs/{uuid.uuid4()}", headers=auth_headers)
+        assert response.status_code == 404
+
+
+class TestDeltaExport(TestAuth):
+    """Test GET /api/export/delta against the watermark of a full export"""
+
+    def read_archive(self, response):
+        assert response.status_code == 200, response.text
+        return zipfile.ZipFile(io.BytesIO(response.content))
+
+    def test_delta_since_full_export(self, auth_headers):
+        violation = requests.post(f"{BASE_URL}/api/violations", headers=auth_headers, json={
+            "title": "TEST_delta removed",
+            "description": "TEST delta",
+            "date": "2024-02-01",
+            "violation_type": "late_pickup",
+            "severity": "low"
+        }).json()
+        full = self.read_archive(requests.get(f"{BASE_URL}/api/export/all", headers=auth_headers))
+        manifest = json.loads(full.read("manifest.json"))
+        assert manifest["type"] == "full"
+        watermark = manifest["watermark"]
+
+        journal = requests.post(f"{BASE_URL}/api/journals", headers=auth_headers, json={
+            "title": "TEST_delta added",
+            "content": "TEST delta",
+            "date": "2024-02-02"
+        }).json()
+        requests.delete(f"{BASE_URL}/api/violations/{violation['violation_id']}", headers=auth_headers)
+        try:
+            delta = self.read_archive(requests.get(
+                f"{BASE_URL}/api/export/delta", headers=auth_headers, params={"since": watermark}
+            ))
+            manifest = json.loads(delta.read("manifest.json"))
+            assert manifest["type"] == "delta" and manifest["since"] == watermark
+            journals = json.loads(delta.read("journals.json"))
+            assert journal["journal_id"] in [entry["journal_id"] for entry in journals]
+            deletions = json.loads(delta.read("deletions.json"))
+            assert any(
+                d["collection"] == "violations" and d["record_id"] == violation["violation_id"] for d in deletions
+            )
+            assert manifest["counts"]["journals.json"] == len(journals)
+        finally:
+            requests.delete(f"{BASE_URL}/api/journals/{journal['journal_id']}", headers=auth_headers)
+
+    @pytest.mark.parametrize("since", ["not-a-date", "2000-01-01T00:00:00+00:00"])
+    def test_rejects_bad_watermark(self, auth_headers, since):
+        response = requests.get(f"{BASE_URL}/api/export/delta", headers=auth_headers, params={"since": since})
+        assert response.status_code == 400
+
+
+class TestRecordExportStreaming(TestAuth):
+    """Test /api/export/journals and /api/export/violations as JSON and NDJSON"""
+
+    @pytest.fixture(scope="class")
+    def violations(self, auth_headers):
+        created = []
+        for index in range(5):
+            response = requests.post(f"{BASE_URL}/api/violations", headers=auth_headers, json={
+                "title": f"TEST_ndjson {index}",
+                "description": "TEST ndjson",
+                "date": f"2024-03-0{index + 1}",
+                "violation_type": "late_pickup"
+            })
+            created.append(response.json()["violation_id"])
+        yield created
+        for violation_id in created:
+            requests.delete(f"{BASE_URL}/api/violations/{violation_id}", headers=auth_headers)
+
+    def test_json_envelope(self, auth_headers, violations):
+        response = requests.get(f"{BASE_URL}/api/export/violations", headers=auth_headers, params={"batch_size": 2})
+        assert response.status_code == 200
+        data = response.json()
+        assert "exported_at" in data
+        assert set(violations) <= {v["violation_id"] for v in data["violations"]}
+
+    def test_ndjson_by_accept_header(self, auth_headers, violations):
+        response = requests.get(
+            f"{BASE_URL}/api/export/violations",
+            headers={**auth_headers, "Accept": "application/x-ndjson"},
+            params={"batch_size": 2},
+            stream=True
+        )
+        assert response.headers["Content-Type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.iter_lines() if line]
+        assert set(violations) <= {row["violation_id"] for row in rows}
+        dates = [row["date"] for row in rows]
+        assert dates == sorted(dates, reverse=True)
+
+    def test_ndjson_by_format(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/journals", headers=auth_headers, params={"format": "ndjson"})
+        assert response.status_code == 200
+        assert all("journal_id" in json.loads(line) for line in response.text.splitlines())
+
+    def test_rejects_unknown_format(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/journals", headers=auth_headers, params={"format": "xml"})
+        assert response.status_code == 400
+
+
+class TestTableExport(TestAuth):
+    """Test GET /api/export/tables/{dataset} as CSV and Parquet"""
+
+    @pytest.fixture(scope="class")
+    def journal_with_child(self, auth_headers):
+        child = requests.post(f"{BASE_URL}/api/children", headers=auth_headers, json={
+            "name": "TEST_table child",
+            "date_of_birth": "2018-05-01"
+        }).json()
+        journal = requests.post(f"{BASE_URL}/api/journals", headers=auth_headers, json={
+            "title": "TEST_table journal",
+            "content": "TEST, with \"quotes\"\nand a newline",
+            "date": "2024-04-01",
+            "children_involved": [child["child_id"]],
+            "photos": [PNG_DATA_URL]
+        }).json()
+        yield journal, child
+        requests.delete(f"{BASE_URL}/api/journals/{journal['journal_id']}", headers=auth_headers)
+        requests.delete(f"{BASE_URL}/api/children/{child['child_id']}", headers=auth_headers)
+
+    def test_csv_resolves_children(self, auth_headers, journal_with_child):
+        journal, child = journal_with_child
+        response = requests.get(f"{BASE_URL}/api/export/tables/journals", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+        row = next(r for r in rows if r["journal_id"] == journal["journal_id"])
+        assert row["children"] == child["name"]
+        assert row["content"] == journal["content"]
+        assert row["photo_count"] == "1"
+        assert "photos" not in row and "photo_media" not in row
+
+    def test_parquet_typed_dates(self, auth_headers, journal_with_child):
+        pq = pytest.importorskip("pyarrow.parquet")
+        response = requests.get(
+            f"{BASE_URL}/api/export/tables/journals", headers=auth_headers, params={"format": "parquet"}
+        )
+        assert response.status_code == 200, response.text
+        table = pq.read_table(io.BytesIO(response.content))
+        assert str(table.schema.field("date").type) == "date32[day]"
+        assert str(table.schema.field("created_at").type).startswith("timestamp")
+
+    def test_unknown_dataset(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/tables/contacts", headers=auth_headers)
+        assert response.status_code == 404
+
+
+class TestExhibitPacketRendering:
+    """Test the PDF packet renderer directly"""
+
+    def test_toc_and_bates_numbering(self, server_module):
+        exhibits = [{
+            "kind": "Journal Entry",
+            "record_id": str(index),
+            "title": f"Missed exchange (#{index})",
+            "date": f"2024-03-{index + 1:02d}",
+            "date_label": f"March {index + 1}, 2024",
+            "meta": [("Mood", "anxious")],
+            "sections": [("Entry", "late pickup " * (400 if index == 0 else 5))],
+            "photos": []
+        } for index in range(3)]
+        rendered = server_module.render_exhibit_packet({
+            "title": "TEST Exhibits",
+            "prepared_by": "Test User",
+            "generated_at": "now",
+            "bates_prefix": "TST",
+            "bates_start": 100,
+            "exhibits": exhibits
+        })
+        pdf = rendered["pdf"]
+        assert pdf.startswith(b"%PDF") and pdf.rstrip().endswith(b"%%EOF")
+        pages = pdf.count(b"/Type /Page\n")
+        # Cover/TOC, a long first exhibit, then one page each
+        assert pages >= 4
+        assert pdf.count(b"/Type /Outlines") == 1
+        assert rendered["substituted"] == 0
+
+    def test_unicode_kept_and_undrawable_flagged(self, server_module):
+        covered = server_module.drawable_codepoints()
+        text, substituted = server_module.printable_text("Привет Zoë", covered)
+        assert text == "Привет Zoë" and substituted == 0
+        text, substituted = server_module.printable_text("pickup \U000F0000", frozenset(map(ord, "pickup ")))
+        assert text == "pickup [U+F0000]" and substituted == 1
+
+        rendered = server_module.render_exhibit_packet({
+            "title": "TEST Exhibits",
+            "prepared_by": "Test User",
+            "generated_at": "now",
+            "bates_prefix": "TST",
+            "bates_start": 1,
+            "exhibits": [{
+                "kind": "Journal Entry",
+                "record_id": "1",
+                "title": "Обмен \U000F0000",
+                "date": "2024-03-01",
+                "date_label": "March 1, 2024",
+                "meta": [],
+                "sections": [("Entry", "Ребёнок")],
+                "photos": []
+            }]
+        })
+        assert rendered["pdf"].startswith(b"%PDF")
+        assert rendered["substituted"] == 1
+
+
+class TestExhibitPackets(TestAuth):
+    """Test POST /api/exhibits/packet"""
+
+    @pytest.fixture(scope="class")
+    def records(self, auth_headers):
+        journal = requests.post(f"{BASE_URL}/api/journals", headers=auth_headers, json={
+            "title": "TEST_exhibit journal",
+            "content": "TEST exhibit content",
+            "date": "2024-05-02",
+            "photos": [PNG_DATA_URL]
+        }).json()
+        violation = requests.post(f"{BASE_URL}/api/violations", headers=auth_headers, json={
+            "title": "TEST_exhibit violation",
+            "violation_type": "late_pickup",
+            "description": "TEST exhibit violation",
+            "date": "2024-05-01",
+            "severity": "medium"
+        }).json()
+        yield journal, violation
+        requests.delete(f"{BASE_URL}/api/journals/{journal['journal_id']}", headers=auth_headers)
+        requests.delete(f"{BASE_URL}/api/violations/{violation['violation_id']}", headers=auth_headers)
+
+    def test_packet_is_cached_by_inputs(self, auth_headers, records):
+        journal, violation = records
+        body = {
+            "title": "TEST Packet",
+            "journal_ids": [journal["journal_id"]],
+            "violation_ids": [violation["violation_id"]]
+        }
+        first = requests.post(f"{BASE_URL}/api/exhibits/packet", headers=auth_headers, json=body)
+        assert first.status_code == 200
+        assert first.headers["Content-Type"] == "application/pdf"
+        assert first.content.startswith(b"%PDF")
+        assert b"/Subtype /Image" in first.content
+        assert first.headers["X-Exhibit-Substituted-Characters"] == "0"
+
+        again = requests.post(f"{BASE_URL}/api/exhibits/packet", headers=auth_headers, json=body)
+        assert again.headers["ETag"] == first.headers["ETag"]
+
+        renumbered = requests.post(f"{BASE_URL}/api/exhibits/packet", headers=auth_headers, json={
+            **body, "bates_start": 500
+        })
+        assert renumbered.headers["ETag"] != first.headers["ETag"]
+
+    def test_rejects_empty_and_bad_prefix(self, auth_headers, records):
+        response = requests.post(f"{BASE_URL}/api/exhibits/packet", headers=auth_headers, json={})
+        assert response.status_code == 400
+        response = requests.post(f"{BASE_URL}/api/exhibits/packet", headers=auth_headers, json={
+            "journal_ids": [records[0]["journal_id"]], "bates_prefix": "bad prefix!"
+        })
+        assert response.status_code == 400
+
+
+class TestSharedViewSections:
+    """Test that a slow or failing shared-view section degrades instead of failing the view"""
+
+    def test_timeout_and_failure_degrade(self, server_module, monkeypatch):
+        monkeypatch.setattr(server_module, "SHARED_VIEW_TIMEOUT_SECONDS", 0.2)
+
+        async def load(user_id, key):
+            if key == "journals":
+                await asyncio.sleep(5)
+            if key == "documents":
+                raise RuntimeError("boom")
+            return [{"key": key}]
+
+        monkeypatch.setattr(server_module, "load_shared_section", load)
+
+        async def run():
+            keys = ["children", "journals", "documents", "events"]
+            started = time.monotonic()
+            results = await asyncio.gather(*(server_module.shared_section_or_none("u", key) for key in keys))
+            return dict(zip(keys, results)), time.monotonic() - started
+
+        results, elapsed = asyncio.run(run())
+        assert results["journals"] is None and results["documents"] is None
+        assert results["children"] == [{"key": "children"}]
+        assert results["events"] == [{"key": "events"}]
+        assert elapsed < 1
+
+
+class TestSharedView(TestAuth):
+    """Test GET /api/shared/{token} section layout"""
+
+    def test_sections_follow_token_flags(self, auth_headers):
+        token = requests.post(f"{BASE_URL}/api/share/tokens", headers=auth_headers, json={
+            "name": "TEST_concurrent share",
+            "include_journals": True,
+            "include_violations": False,
+            "include_documents": True,
+            "include_calendar": False
+        }).json()
+        try:
+            response = requests.get(f"{BASE_URL}/api/shared/{token['share_token']}")
+            assert response.status_code == 200
+            data = response.json()
+            assert data["unavailable"] == []
+            assert {"children", "journals", "documents"} <= data.keys()
+            assert "violations" not in data and "events" not in data
+            assert all("file_data" not in doc and "blob_key" not in doc for doc in data["documents"])
+        finally:
+            requests.delete(f"{BASE_URL}/api/share/tokens/{token['token_id']}", headers=auth_headers)
@@ -29,6 +29,9 @@ import AuthCallback from "@/pages/AuthCallback";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Stored images come back as API-relative signed paths; data: and external URLs pass through
+const mediaSrc = (value) => (value?.startsWith("/") ? `${API}${value}` : value);
+
 // Create Auth Context
 const AuthContext = createContext(null);
 
@@ -100,6 +103,12 @@ const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    if (token) {
+      // Revoke the token server-side; local logout proceeds regardless
+      axios.post(`${API}/auth/logout`, null, {
+        headers: { Authorization: `Bearer ${token}` }
+      }).catch(() => {});
+    }
     localStorage.removeItem("token");
     setToken(null);
     setUser(null);
@@ -209,4 +218,4 @@ function App() {
 }
 
 export default App;
-export { API };
+export { API, mediaSrc };
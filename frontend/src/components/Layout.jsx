@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import { Link, useLocation, useNavigate } from "react-router-dom";
-import { useAuth } from "@/App";
+import { useAuth, mediaSrc } from "@/App";
 import { Button } from "@/components/ui/button";
 import {
   Dialog,
@@ -142,7 +142,7 @@ export const Layout = ({ children }) => {
                   >
                     {user?.photo ? (
                       <img 
-                        src={user.photo} 
+                        src={mediaSrc(user.photo_small || user.photo)} 
                         alt={user.full_name}
                         className="w-8 h-8 rounded-full object-cover"
                       />
@@ -14,6 +14,7 @@ import { toast } from "sonner";
 import { User, Plus, Trash2, Users, Calendar, Camera, Edit2 } from "lucide-react";
 import { format, parseISO, differenceInYears } from "date-fns";
 import axios from "axios";
+import { mediaSrc } from "@/App";
 
 const CHILD_COLORS = [
   "#EF4444", "#F97316", "#F59E0B", "#EAB308", "#84CC16", 
@@ -146,7 +147,7 @@ export function ChildrenSection({ children, token, API, fetchChildren }) {
                 <div className="relative">
                   {formData.photo ? (
                     <img 
-                      src={formData.photo} 
+                      src={mediaSrc(formData.photo)} 
                       alt="Child"
                       className="w-24 h-24 rounded-full object-cover border-4 border-[#E8F6F3]"
                     />
@@ -258,7 +259,7 @@ export function ChildrenSection({ children, token, API, fetchChildren }) {
                 <div className="flex items-center gap-4">
                   {child.photo ? (
                     <img 
-                      src={child.photo} 
+                      src={mediaSrc(child.photo_small || child.photo)} 
                       alt={child.name}
                       className="w-12 h-12 rounded-full object-cover flex-shrink-0"
                       style={{ border: `3px solid ${child.color || '#3B82F6'}` }}
@@ -1,42 +1,74 @@
 import { useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
-import { Download, FileArchive, Loader2 } from "lucide-react";
+import { Download, FileArchive, FileSpreadsheet, Loader2 } from "lucide-react";
 import { toast } from "sonner";
 import axios from "axios";
 
+const POLL_INTERVAL_MS = 2000;
+
+const TABLE_EXPORTS = [
+  { dataset: "journals", label: "Journals" },
+  { dataset: "violations", label: "Violations" },
+  { dataset: "calendar", label: "Calendar" },
+];
+
+const formatBytes = (bytes) => {
+  if (bytes < 1024 * 1024) return `${Math.round(bytes / 1024)} KB`;
+  return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+};
+
 export function ExportDataSection({ token, API }) {
   const [exporting, setExporting] = useState(false);
+  const [progress, setProgress] = useState(null);
+  const [tableExporting, setTableExporting] = useState(null);
 
-  const handleExportAll = async () => {
-    setExporting(true);
+  // Flat CSV with children by name, for spreadsheets and analysis tools
+  const handleExportTable = async (dataset) => {
+    setTableExporting(dataset);
     try {
-      const response = await axios.get(`${API}/export/all`, {
+      const response = await axios.get(`${API}/export/tables/${dataset}`, {
         headers: { Authorization: `Bearer ${token}` },
+        params: { format: "csv" },
         responseType: 'blob'
       });
-      
-      // Create download link
-      const blob = new Blob([response.data], { type: 'application/zip' });
-      const url = window.URL.createObjectURL(blob);
+      const url = window.URL.createObjectURL(response.data);
       const link = document.createElement('a');
       link.href = url;
-      
-      // Get filename from header or generate one
-      const contentDisposition = response.headers['content-disposition'];
-      let filename = `CustodyKeeper_Export_${new Date().toISOString().split('T')[0]}.zip`;
-      if (contentDisposition) {
-        const filenameMatch = contentDisposition.match(/filename=(.+)/);
-        if (filenameMatch) {
-          filename = filenameMatch[1];
-        }
-      }
-      
-      link.setAttribute('download', filename);
+      link.setAttribute('download', `${dataset}-export-${new Date().toISOString().split('T')[0]}.csv`);
       document.body.appendChild(link);
       link.click();
       link.remove();
       window.URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error("Table export failed:", error);
+      toast.error("Failed to export data. Please try again.");
+    } finally {
+      setTableExporting(null);
+    }
+  };
+
+  // The archive is built by a background job; poll it, then hand the signed link to the browser
+  const handleExportAll = async () => {
+    setExporting(true);
+    setProgress(null);
+    const headers = { Authorization: `Bearer ${token}` };
+    try {
+      let { data: job } = await axios.post(`${API}/export/jobs`, null, { headers });
+      while (job.status === "queued" || job.status === "running") {
+        setProgress(job);
+        await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+        ({ data: job } = await axios.get(`${API}/export/jobs/${job.job_id}`, { headers }));
+      }
+      if (job.status !== "done") {
+        throw new Error(job.error || "Export failed");
+      }
+
+      const link = document.createElement('a');
+      link.href = `${API}${job.download_url}`;
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
       
       toast.success("Data exported successfully!");
     } catch (error) {
@@ -44,6 +76,7 @@ export function ExportDataSection({ token, API }) {
       toast.error("Failed to export data. Please try again.");
     } finally {
       setExporting(false);
+      setProgress(null);
     }
   };
 
@@ -82,7 +115,9 @@ export function ExportDataSection({ token, API }) {
           {exporting ? (
             <>
               <Loader2 className="w-4 h-4 mr-2 animate-spin" />
-              Preparing Export...
+              {progress && progress.records > 0
+                ? `Preparing Export... ${progress.records} items, ${formatBytes(progress.bytes)}`
+                : "Preparing Export..."}
             </>
           ) : (
             <>
@@ -92,6 +127,30 @@ export function ExportDataSection({ token, API }) {
           )}
         </Button>
         
+        <div className="pt-2">
+          <h4 className="font-semibold text-[#1A202C] mb-2">Spreadsheet exports (CSV):</h4>
+          <div className="flex flex-wrap gap-2">
+            {TABLE_EXPORTS.map(({ dataset, label }) => (
+              <Button
+                key={dataset}
+                variant="outline"
+                size="sm"
+                onClick={() => handleExportTable(dataset)}
+                disabled={tableExporting !== null}
+                className="border-[#E2E8F0] text-[#2C3E50]"
+                data-testid={`export-csv-${dataset}`}
+              >
+                {tableExporting === dataset ? (
+                  <Loader2 className="w-4 h-4 mr-2 animate-spin" />
+                ) : (
+                  <FileSpreadsheet className="w-4 h-4 mr-2" />
+                )}
+                {label}
+              </Button>
+            ))}
+          </div>
+        </div>
+        
         <p className="text-xs text-[#9CA3AF]">
           Your data will be downloaded as a secure ZIP file. Keep this file safe as it contains sensitive information.
         </p>
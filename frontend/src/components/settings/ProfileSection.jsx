@@ -13,6 +13,7 @@ import { User, Camera } from "lucide-react";
 import { format, parseISO } from "date-fns";
 import { toast } from "sonner";
 import axios from "axios";
+import { mediaSrc } from "@/App";
 
 export function ProfileSection({ user, token, API, setUser }) {
   const [profilePhotoDialogOpen, setProfilePhotoDialogOpen] = useState(false);
@@ -76,7 +77,7 @@ export function ProfileSection({ user, token, API, setUser }) {
           <div className="relative">
             {user?.photo ? (
               <img 
-                src={user.photo} 
+                src={mediaSrc(user.photo)} 
                 alt={user.full_name}
                 className="w-20 h-20 rounded-full object-cover border-4 border-[#E8F6F3]"
               />
@@ -110,7 +111,7 @@ export function ProfileSection({ user, token, API, setUser }) {
                     <div className="relative">
                       {profilePhoto ? (
                         <img 
-                          src={profilePhoto} 
+                          src={mediaSrc(profilePhoto)} 
                           alt="Profile preview"
                           className="w-32 h-32 rounded-full object-cover border-4 border-[#E8F6F3]"
                         />
@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import axios from "axios";
-import { useAuth, API } from "@/App";
+import { useAuth, API, mediaSrc } from "@/App";
 import { Layout } from "@/components/Layout";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
@@ -196,7 +196,7 @@ export default function ContactsPage() {
                   <div className="relative">
                     {formData.photo ? (
                       <img 
-                        src={formData.photo} 
+                        src={mediaSrc(formData.photo)} 
                         alt="Contact" 
                         className="w-24 h-24 rounded-full object-cover border-4 border-[#E8F6F3]"
                       />
@@ -359,7 +359,7 @@ export default function ContactsPage() {
                   <div className="flex items-start gap-4">
                     {contact.photo ? (
                       <img 
-                        src={contact.photo} 
+                        src={mediaSrc(contact.photo_small || contact.photo)} 
                         alt={contact.name}
                         className="w-16 h-16 rounded-full object-cover flex-shrink-0"
                       />
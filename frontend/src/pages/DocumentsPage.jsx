@@ -16,7 +16,7 @@ import {
   DialogTrigger,
 } from "@/components/ui/dialog";
 import { toast } from "sonner";
-import { Plus, FileText, Upload, Trash2, Download, Search, File, FileImage, FileType, Eye, X, Video, Music, Share2 } from "lucide-react";
+import { Plus, FileText, Upload, Trash2, Download, Search, File, FileImage, FileType, Eye, X, Video, Music, Share2, ChevronLeft, ChevronRight } from "lucide-react";
 import { format, parseISO } from "date-fns";
 import { DocumentPreview } from "@/components/DocumentPreview";
 
@@ -58,6 +58,22 @@ const formatFileSize = (bytes) => {
   return (bytes / (1024 * 1024)).toFixed(1) + " MB";
 };
 
+const PAGE_SIZE = 24;
+const RESUMABLE_UPLOADS_KEY = "custodykeeper-uploads";
+
+// Extracted in the background after upload, so any of these may be missing
+const formatMetadata = (metadata) => {
+  if (!metadata) return "";
+  if (metadata.duration_seconds) {
+    const total = Math.round(metadata.duration_seconds);
+    const seconds = String(total % 60).padStart(2, "0");
+    return `${Math.floor(total / 60)}:${seconds}`;
+  }
+  if (metadata.page_count) return `${metadata.page_count} page${metadata.page_count === 1 ? "" : "s"}`;
+  if (metadata.width && metadata.height) return `${metadata.width}×${metadata.height}`;
+  return "";
+};
+
 export default function DocumentsPage() {
   const { token } = useAuth();
   const [documents, setDocuments] = useState([]);
@@ -70,27 +86,59 @@ export default function DocumentsPage() {
   const [previewData, setPreviewData] = useState(null);
   const [searchQuery, setSearchQuery] = useState("");
   const [filterCategory, setFilterCategory] = useState("all");
+  const [debouncedSearch, setDebouncedSearch] = useState("");
+  const [page, setPage] = useState(1);
+  const [totalPages, setTotalPages] = useState(1);
+  const [facets, setFacets] = useState({});
   const fileInputRef = useRef(null);
+  const latestFetch = useRef(0);
   const [selectedFile, setSelectedFile] = useState(null);
   const [formData, setFormData] = useState({
     category: "court_order",
     description: ""
   });
 
+  // Filter changes reset the page in the same update, so no fetch goes out for the
+  // old page with the new filter
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      const query = searchQuery.trim();
+      if (query === debouncedSearch) return;
+      setDebouncedSearch(query);
+      setPage(1);
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [searchQuery]);
+
+  const handleCategoryChange = (value) => {
+    setFilterCategory(value);
+    setPage(1);
+  };
+
   useEffect(() => {
     fetchDocuments();
-  }, []);
+  }, [page, debouncedSearch, filterCategory]);
 
+  // Filtering and paging happen on the server; only the current page is held here
+  // Responses can arrive out of order; only the most recent request updates the page
   const fetchDocuments = async () => {
+    const fetchId = ++latestFetch.current;
     try {
-      const response = await axios.get(`${API}/documents`, {
-        headers: { Authorization: `Bearer ${token}` }
+      const params = { page, page_size: PAGE_SIZE };
+      if (filterCategory !== "all") params.category = filterCategory;
+      if (debouncedSearch) params.q = debouncedSearch;
+      const response = await axios.get(`${API}/documents/page`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params
       });
-      setDocuments(response.data);
+      if (fetchId !== latestFetch.current) return;
+      setDocuments(response.data.items);
+      setTotalPages(Math.max(response.data.total_pages, 1));
+      setFacets(response.data.facets);
     } catch (error) {
       console.error("Failed to fetch documents:", error);
     } finally {
-      setLoading(false);
+      if (fetchId === latestFetch.current) setLoading(false);
     }
   };
 
@@ -106,6 +154,69 @@ export default function DocumentsPage() {
     }
   };
 
+  // Audio/video use the resumable protocol, so a dropped connection only costs one chunk
+  // Sessions survive a failed attempt: picking the same file again continues from
+  // the chunks the server already has (GET /uploads/{id} -> received_chunks)
+  const uploadResumable = async (file) => {
+    const headers = { Authorization: `Bearer ${token}` };
+    const fingerprint = `${file.name}:${file.size}:${file.lastModified}`;
+    const saved = JSON.parse(localStorage.getItem(RESUMABLE_UPLOADS_KEY) || "{}");
+    const remember = (uploadId) => {
+      if (uploadId) saved[fingerprint] = uploadId;
+      else delete saved[fingerprint];
+      localStorage.setItem(RESUMABLE_UPLOADS_KEY, JSON.stringify(saved));
+    };
+
+    let session = null;
+    if (saved[fingerprint]) {
+      try {
+        ({ data: session } = await axios.get(`${API}/uploads/${saved[fingerprint]}`, { headers }));
+      } catch (error) {
+        session = null; // Expired or swept; start over
+      }
+    }
+    if (!session || session.status !== "open") {
+      ({ data: session } = await axios.post(`${API}/uploads`, {
+        filename: file.name,
+        content_type: file.type,
+        size: file.size,
+        category: formData.category,
+        description: formData.description
+      }, { headers }));
+      remember(session.upload_id);
+    }
+
+    const received = new Set(session.received_chunks);
+    for (let index = 0; index < session.total_chunks; index++) {
+      if (received.has(index)) continue;
+      const start = index * session.chunk_size;
+      const chunk = await file.slice(start, start + session.chunk_size).arrayBuffer();
+      const digest = await crypto.subtle.digest("SHA-256", chunk);
+      const sha256 = Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await axios.put(`${API}/uploads/${session.upload_id}/chunks/${index}`, chunk, {
+            headers: { ...headers, "Content-Type": "application/octet-stream", "X-Chunk-SHA256": sha256 }
+          });
+          break;
+        } catch (error) {
+          if (error.response?.status === 404) {
+            remember(null);
+            throw error;
+          }
+          if (attempt >= 3 || (error.response && error.response.status < 500)) {
+            error.resumable = true;
+            throw error;
+          }
+          await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+        }
+      }
+    }
+
+    await axios.post(`${API}/uploads/${session.upload_id}/complete`, {}, { headers });
+    remember(null);
+  };
+
   const handleUpload = async (e) => {
     e.preventDefault();
     if (!selectedFile) {
@@ -120,18 +231,24 @@ export default function DocumentsPage() {
     formDataObj.append("description", formData.description);
 
     try {
-      await axios.post(`${API}/documents`, formDataObj, {
-        headers: {
-          Authorization: `Bearer ${token}`,
-          "Content-Type": "multipart/form-data"
-        }
-      });
+      if (selectedFile.type.startsWith("video/") || selectedFile.type.startsWith("audio/")) {
+        await uploadResumable(selectedFile);
+      } else {
+        await axios.post(`${API}/documents`, formDataObj, {
+          headers: {
+            Authorization: `Bearer ${token}`,
+            "Content-Type": "multipart/form-data"
+          }
+        });
+      }
       toast.success("Document uploaded successfully");
       setDialogOpen(false);
       resetForm();
       fetchDocuments();
     } catch (error) {
-      toast.error(error.response?.data?.detail || "Failed to upload document");
+      toast.error(error.resumable
+        ? "Upload interrupted. Upload the same file again to continue where it stopped."
+        : error.response?.data?.detail || "Failed to upload document");
     } finally {
       setUploading(false);
     }
@@ -150,33 +267,29 @@ export default function DocumentsPage() {
     }
   };
 
+  // Raw bytes straight from the streaming endpoint (no base64 round trip)
+  const fetchDocumentBlob = async (doc) => {
+    const response = await axios.get(`${API}/documents/${doc.document_id}/content`, {
+      headers: { Authorization: `Bearer ${token}` },
+      responseType: 'blob'
+    });
+    return new Blob([response.data], { type: doc.file_type });
+  };
+
   const handleDownload = async (document) => {
     try {
       toast.info("Downloading document...");
-      const response = await axios.get(`${API}/documents/${document.document_id}/download`, {
-        headers: { Authorization: `Bearer ${token}` },
-        responseType: 'json'
-      });
-      
-      const { filename, file_type, file_data } = response.data;
-      
-      // Decode base64 to blob
-      const byteCharacters = atob(file_data);
-      const byteNumbers = new Array(byteCharacters.length);
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i);
-      }
-      const byteArray = new Uint8Array(byteNumbers);
-      const blob = new Blob([byteArray], { type: file_type });
+      const filename = document.filename;
+      const blob = await fetchDocumentBlob(document);
       
       // Create download link
       const url = URL.createObjectURL(blob);
-      const a = document.createElement("a");
+      const a = window.document.createElement("a");
       a.href = url;
       a.download = filename;
-      document.body.appendChild(a);
+      window.document.body.appendChild(a);
       a.click();
-      document.body.removeChild(a);
+      window.document.body.removeChild(a);
       URL.revokeObjectURL(url);
       
       toast.success("Document downloaded successfully");
@@ -191,21 +304,8 @@ export default function DocumentsPage() {
       toast.info("Preparing document for sharing...");
       
       // Get the file data
-      const response = await axios.get(`${API}/documents/${document.document_id}/download`, {
-        headers: { Authorization: `Bearer ${token}` },
-        responseType: 'json'
-      });
-      
-      const { filename, file_type, file_data } = response.data;
-      
-      // Decode base64 to blob
-      const byteCharacters = atob(file_data);
-      const byteNumbers = new Array(byteCharacters.length);
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i);
-      }
-      const byteArray = new Uint8Array(byteNumbers);
-      const blob = new Blob([byteArray], { type: file_type });
+      const { filename, file_type } = document;
+      const blob = await fetchDocumentBlob(document);
       
       // Create File object for Web Share API
       const file = new File([blob], filename, { type: file_type });
@@ -245,18 +345,24 @@ export default function DocumentsPage() {
     setPreviewLoading(true);
     
     try {
-      const response = await axios.get(`${API}/documents/${doc.document_id}/download`, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
+      const { filename, file_type } = doc;
       
-      const { filename, file_type, file_data } = response.data;
-      const byteCharacters = atob(file_data);
-      const byteNumbers = new Array(byteCharacters.length);
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i);
+      // Audio/video stream from a signed URL so the player can seek with Range requests
+      if (file_type.includes("video") || file_type.includes("audio")) {
+        const response = await axios.get(`${API}/documents/${doc.document_id}/stream-url`, {
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        setPreviewData({ url: `${API}${response.data.path}`, filename, file_type, blob: null });
+        return;
       }
-      const byteArray = new Uint8Array(byteNumbers);
-      const blob = new Blob([byteArray], { type: file_type });
+      
+      // Images preview from the cached WebP variant instead of the full original
+      if (doc.preview_url) {
+        setPreviewData({ url: `${API}${doc.preview_url}`, filename, file_type, blob: null });
+        return;
+      }
+      
+      const blob = await fetchDocumentBlob(doc);
       const url = URL.createObjectURL(blob);
       
       setPreviewData({
@@ -274,7 +380,7 @@ export default function DocumentsPage() {
   };
 
   const closePreview = () => {
-    if (previewData?.url) {
+    if (previewData?.blob) {
       URL.revokeObjectURL(previewData.url);
     }
     setPreviewOpen(false);
@@ -397,13 +503,6 @@ export default function DocumentsPage() {
     }
   };
 
-  const filteredDocuments = documents.filter(doc => {
-    const matchesSearch = doc.filename.toLowerCase().includes(searchQuery.toLowerCase()) ||
-      doc.description.toLowerCase().includes(searchQuery.toLowerCase());
-    const matchesCategory = filterCategory === "all" || doc.category === filterCategory;
-    return matchesSearch && matchesCategory;
-  });
-
   if (loading) {
     return (
       <Layout>
@@ -541,23 +640,25 @@ export default function DocumentsPage() {
               data-testid="document-search-input"
             />
           </div>
-          <Select value={filterCategory} onValueChange={setFilterCategory}>
+          <Select value={filterCategory} onValueChange={handleCategoryChange}>
             <SelectTrigger className="w-full sm:w-48 h-12 bg-white border-[#E2E8F0] text-[#1A202C]" data-testid="filter-category-select">
               <SelectValue placeholder="Filter by category" />
             </SelectTrigger>
             <SelectContent>
               <SelectItem value="all">All Categories</SelectItem>
               {DOCUMENT_CATEGORIES.map(cat => (
-                <SelectItem key={cat.value} value={cat.value}>{cat.label}</SelectItem>
+                <SelectItem key={cat.value} value={cat.value}>
+                  {cat.label}{facets[cat.value] ? ` (${facets[cat.value]})` : ""}
+                </SelectItem>
               ))}
             </SelectContent>
           </Select>
         </div>
 
         {/* Documents Grid */}
-        {filteredDocuments.length > 0 ? (
+        {documents.length > 0 ? (
           <div className="grid sm:grid-cols-2 lg:grid-cols-3 gap-4">
-            {filteredDocuments.map((doc, index) => (
+            {documents.map((doc, index) => (
               <Card
                 key={doc.document_id}
                 className={`bg-white border-[#E2E8F0] card-hover animate-fade-in stagger-${Math.min(index + 1, 5)}`}
@@ -566,7 +667,16 @@ export default function DocumentsPage() {
                 <CardContent className="p-3 sm:p-4">
                   <div className="flex items-start gap-3">
                     <div className="flex-shrink-0">
-                      {getFileIcon(doc.file_type)}
+                      {doc.thumbnail_url ? (
+                        <img
+                          src={`${API}${doc.thumbnail_url}`}
+                          alt={doc.filename}
+                          loading="lazy"
+                          className="w-12 h-12 object-cover rounded-md border border-[#E2E8F0]"
+                        />
+                      ) : (
+                        getFileIcon(doc.file_type)
+                      )}
                     </div>
                     <div className="flex-1 min-w-0 overflow-hidden">
                       <p className="font-semibold text-[#1A202C] truncate text-sm max-w-full" title={doc.filename}>{doc.filename}</p>
@@ -577,7 +687,9 @@ export default function DocumentsPage() {
                         <p className="text-xs text-[#718096] mt-1 line-clamp-1 sm:line-clamp-2">{doc.description}</p>
                       )}
                       <p className="text-xs text-[#9CA3AF] mt-1">
-                        {formatFileSize(doc.file_size)} • {format(parseISO(doc.created_at), "MMM d")}
+                        {formatFileSize(doc.file_size)}
+                        {formatMetadata(doc.metadata) && ` • ${formatMetadata(doc.metadata)}`}
+                        {" • "}{format(parseISO(doc.created_at), "MMM d")}
                       </p>
                     </div>
                   </div>
@@ -654,6 +766,32 @@ export default function DocumentsPage() {
           </Card>
         )}
 
+        {totalPages > 1 && (
+          <div className="flex items-center justify-center gap-4" data-testid="documents-pagination">
+            <Button
+              variant="outline"
+              size="sm"
+              onClick={() => setPage(page - 1)}
+              disabled={page <= 1}
+              className="border-[#E2E8F0] text-[#2C3E50]"
+              data-testid="documents-prev-page"
+            >
+              <ChevronLeft className="w-4 h-4" />
+            </Button>
+            <span className="text-sm text-[#718096]">Page {page} of {totalPages}</span>
+            <Button
+              variant="outline"
+              size="sm"
+              onClick={() => setPage(page + 1)}
+              disabled={page >= totalPages}
+              className="border-[#E2E8F0] text-[#2C3E50]"
+              data-testid="documents-next-page"
+            >
+              <ChevronRight className="w-4 h-4" />
+            </Button>
+          </div>
+        )}
+
         {/* Document Preview Dialog */}
         <Dialog open={previewOpen} onOpenChange={(open) => { if (!open) closePreview(); }}>
           <DialogContent className="sm:max-w-4xl max-h-[90vh] overflow-hidden bg-white">
@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import axios from "axios";
-import { useAuth, API } from "@/App";
+import { useAuth, API, mediaSrc } from "@/App";
 import { Layout } from "@/components/Layout";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
@@ -18,8 +18,7 @@ import {
 import { toast } from "sonner";
 import { Plus, BookOpen, Search, Trash2, Edit2, Download, Clock, MapPin, FileText, Sparkles, Loader2, Wand2 } from "lucide-react";
 import { format, parseISO } from "date-fns";
-import { PrintableExport } from "@/components/PrintableExport";
-import { generateCourtReadyPDF } from "@/utils/pdfExport";
+import { downloadExhibitPacket } from "@/utils/pdfExport";
 
 const MOOD_OPTIONS = [
   { value: "happy", label: "Happy", color: "mood-happy" },
@@ -39,11 +38,12 @@ const MOOD_OPTIONS = [
 ];
 
 export default function JournalPage() {
-  const { token, user } = useAuth();
+  const { token } = useAuth();
   const [journals, setJournals] = useState([]);
   const [children, setChildren] = useState([]);
   const [loading, setLoading] = useState(true);
   const [dialogOpen, setDialogOpen] = useState(false);
+  const [pdfExporting, setPdfExporting] = useState(false);
   const [editingJournal, setEditingJournal] = useState(null);
   const [searchQuery, setSearchQuery] = useState("");
   const [childFilter, setChildFilter] = useState("all"); // Multi-child filter
@@ -67,24 +67,28 @@ export default function JournalPage() {
   const [aiSuggestion, setAiSuggestion] = useState("");
   const [aiWritingLoading, setAiWritingLoading] = useState(false);
 
-  const handlePDFExport = () => {
+  const handlePDFExport = async () => {
     if (filteredJournals.length === 0) {
       toast.error("No journal entries to export");
       return;
     }
+    setPdfExporting(true);
     try {
-      const fileName = generateCourtReadyPDF({
+      const { fileName, substituted } = await downloadExhibitPacket({
+        API,
+        token,
         title: "Parenting Journal Records",
-        records: filteredJournals,
-        type: "journal",
-        children: children,
-        userName: user?.full_name,
-        userState: user?.state
+        journalIds: filteredJournals.map((journal) => journal.journal_id)
       });
       toast.success(`PDF exported: ${fileName}`);
+      if (substituted > 0) {
+        toast.warning(`${substituted} character(s) could not be printed and appear as [U+XXXX] codes in the PDF`);
+      }
     } catch (error) {
       toast.error("Failed to generate PDF");
       console.error(error);
+    } finally {
+      setPdfExporting(false);
     }
   };
 
@@ -342,17 +346,16 @@ export default function JournalPage() {
             <Button
               variant="outline"
               onClick={handlePDFExport}
+              disabled={pdfExporting}
               className="border-[#E2E8F0] text-[#2C3E50]"
               data-testid="pdf-export-journals-btn"
             >
-              <FileText className="w-4 h-4 mr-2" /> PDF
+              {pdfExporting ? (
+                <Loader2 className="w-4 h-4 mr-2 animate-spin" />
+              ) : (
+                <FileText className="w-4 h-4 mr-2" />
+              )} PDF
             </Button>
-            <PrintableExport 
-              title="Parenting Journal" 
-              records={filteredJournals} 
-              type="journal"
-              children={children}
-            />
             <Dialog open={dialogOpen} onOpenChange={(open) => { setDialogOpen(open); if (!open) resetForm(); }}>
               <DialogTrigger asChild>
                 <Button
@@ -481,7 +484,7 @@ export default function JournalPage() {
                         {formData.photos.map((photo, index) => (
                           <div key={index} className="relative group">
                             <img
-                              src={photo}
+                              src={mediaSrc(photo)}
                               alt={`Evidence ${index + 1}`}
                               className="w-full h-20 object-cover rounded-lg border border-[#E2E8F0]"
                             />
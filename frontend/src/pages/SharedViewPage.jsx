@@ -159,6 +159,17 @@ export default function SharedViewPage() {
           </CardContent>
         </Card>
 
+        {data.unavailable?.length > 0 && (
+          <Card className="bg-[#FEF3C7] border-none mb-6 no-print">
+            <CardContent className="pt-6 flex items-center gap-2 text-sm text-[#D35400]">
+              <AlertTriangle className="w-4 h-4 flex-shrink-0" />
+              <span>
+                Some records could not be loaded right now ({data.unavailable.join(', ')}). Refresh the page to try again.
+              </span>
+            </CardContent>
+          </Card>
+        )}
+
         {/* Tabs */}
         <div className="flex gap-2 mb-6 overflow-x-auto pb-2">
           {tabs.map(tab => {
@@ -189,15 +200,17 @@ export default function SharedViewPage() {
                   </span>
                 </div>
                 <p className="text-[#4A5568] whitespace-pre-wrap">{journal.content}</p>
-                {journal.photos?.length > 0 && (
+                {journal.photo_media?.length > 0 && (
                   <div className="flex gap-2 mt-4">
-                    {journal.photos.map((photo, i) => (
-                      <img 
-                        key={i} 
-                        src={photo} 
-                        alt={`Evidence ${i+1}`}
-                        className="w-20 h-20 object-cover rounded-lg border"
-                      />
+                    {journal.photo_media.map((photo, i) => (
+                      <a key={photo.media_id} href={`${API}${photo.preview_url}`} target="_blank" rel="noreferrer">
+                        <img 
+                          src={`${API}${photo.thumbnail_url}`} 
+                          alt={`Evidence ${i+1}`}
+                          loading="lazy"
+                          className="w-20 h-20 object-cover rounded-lg border"
+                        />
+                      </a>
                     ))}
                   </div>
                 )}
@@ -48,14 +48,27 @@ export default function TimelinePage() {
     applyFilters();
   }, [records, filterType, searchQuery, dateFrom, dateTo, sortOrder]);
 
+  // Documents are paged server-side; walk every page so none are left off the timeline
+  const fetchAllDocuments = async () => {
+    const documents = [];
+    for (let page = 1; ; page++) {
+      const { data } = await axios.get(`${API}/documents/page`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { page, page_size: 100 }
+      });
+      documents.push(...data.items);
+      if (page >= data.total_pages) return documents;
+    }
+  };
+
   const fetchAllRecords = async () => {
     setLoading(true);
     try {
-      const [journalsRes, violationsRes, eventsRes, documentsRes] = await Promise.all([
+      const [journalsRes, violationsRes, eventsRes, documents] = await Promise.all([
         axios.get(`${API}/journals`, { headers: { Authorization: `Bearer ${token}` } }),
         axios.get(`${API}/violations`, { headers: { Authorization: `Bearer ${token}` } }),
         axios.get(`${API}/calendar`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/documents`, { headers: { Authorization: `Bearer ${token}` } }),
+        fetchAllDocuments(),
       ]);
 
       // Normalize all records into a unified format
@@ -90,7 +103,7 @@ export default function TimelinePage() {
           color: "bg-green-100 text-green-700 dark:bg-green-900/30 dark:text-green-400",
           metadata: { location: item.location, event_type: item.event_type }
         })),
-        ...documentsRes.data.map(item => ({
+        ...documents.map(item => ({
           id: item.document_id,
           type: "document",
           title: item.file_name,
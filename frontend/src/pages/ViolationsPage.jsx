@@ -18,8 +18,7 @@ import {
 import { toast } from "sonner";
 import { Plus, AlertTriangle, Search, Trash2, Download, Clock, FileWarning, Edit2, FileText, Sparkles, Loader2 } from "lucide-react";
 import { format, parseISO } from "date-fns";
-import { PrintableExport } from "@/components/PrintableExport";
-import { generateCourtReadyPDF } from "@/utils/pdfExport";
+import { downloadExhibitPacket } from "@/utils/pdfExport";
 
 const VIOLATION_TYPES = [
   { value: "parenting_time_denial", label: "Parenting Time Denial" },
@@ -50,10 +49,11 @@ const SEVERITY_LEVELS = [
 ];
 
 export default function ViolationsPage() {
-  const { token, user } = useAuth();
+  const { token } = useAuth();
   const [violations, setViolations] = useState([]);
   const [loading, setLoading] = useState(true);
   const [dialogOpen, setDialogOpen] = useState(false);
+  const [pdfExporting, setPdfExporting] = useState(false);
   const [editingViolation, setEditingViolation] = useState(null);
   const [viewDialogOpen, setViewDialogOpen] = useState(false);
   const [selectedViolation, setSelectedViolation] = useState(null);
@@ -95,23 +95,28 @@ export default function ViolationsPage() {
     }
   };
 
-  const handlePDFExport = () => {
+  const handlePDFExport = async () => {
     if (filteredViolations.length === 0) {
       toast.error("No violations to export");
       return;
     }
+    setPdfExporting(true);
     try {
-      const fileName = generateCourtReadyPDF({
+      const { fileName, substituted } = await downloadExhibitPacket({
+        API,
+        token,
         title: "Violation Log Records",
-        records: filteredViolations,
-        type: "violation",
-        userName: user?.full_name,
-        userState: user?.state
+        violationIds: filteredViolations.map((violation) => violation.violation_id)
       });
       toast.success(`PDF exported: ${fileName}`);
+      if (substituted > 0) {
+        toast.warning(`${substituted} character(s) could not be printed and appear as [U+XXXX] codes in the PDF`);
+      }
     } catch (error) {
       toast.error("Failed to generate PDF");
       console.error(error);
+    } finally {
+      setPdfExporting(false);
     }
   };
 
@@ -272,16 +277,16 @@ export default function ViolationsPage() {
             <Button
               variant="outline"
               onClick={handlePDFExport}
+              disabled={pdfExporting}
               className="border-[#E2E8F0] text-[#2C3E50]"
               data-testid="pdf-export-violations-btn"
             >
-              <FileText className="w-4 h-4 mr-2" /> PDF
+              {pdfExporting ? (
+                <Loader2 className="w-4 h-4 mr-2 animate-spin" />
+              ) : (
+                <FileText className="w-4 h-4 mr-2" />
+              )} PDF
             </Button>
-            <PrintableExport 
-              title="Violation Log" 
-              records={filteredViolations} 
-              type="violation"
-            />
             <Dialog open={dialogOpen} onOpenChange={setDialogOpen}>
               <DialogTrigger asChild>
                 <Button